@@ -0,0 +1,229 @@
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+from graphical2 import main2
+from graphical2 import map1gen
+from graphical2 import astar_1
+from graphical2 import pathing
+from graphical2 import hpa
+from graphical2 import minimap
+from graphical2 import autotile
+from graphical2 import levelfile
+from graphical2 import config
+from graphical2 import ecs
+from graphical2.objects import entity_index
+from graphical2.prefabs import PREFABS
+
+# Timings for the hot paths of the graphical2 game, no window needed (SDL's dummy video driver).
+#   python -m benchmarks.bench_engine --report bench_baseline.json
+#   python -m benchmarks.bench_engine --compare bench_baseline.json --threshold 0.25
+#
+# Each thing is timed on a few map sizes with a crowd of crabs on it, best of several goes, so warm up and the odd
+# hiccup don't count.  Results are json, "name map=N crabs=M" -> ms.  With --compare it prints old against new and
+# exits with an error if anything got slower than the baseline by more than --threshold (0.25 is 25%).
+#
+# Run it from the top of the repo, the sprites load from images/.
+
+# (map size, crabs)
+SIZES = ((10, 10), (30, 100), (60, 400))
+
+
+def setup_level(size, crabs, seed=0):
+    # main2's globals, but with a bigger map and a crowd of crabs
+    rand = random.Random(seed)
+    random.seed(seed)
+    main2.ACTORS, main2.PROPS, main2.SELECTED, main2.TILES = map1gen.map_1_generate(size, size)
+    main2.STORE = ecs.STORE
+    taken = {(ent.x, ent.y) for ent in main2.ACTORS}
+    free = [(x, y) for x in range(1, size - 1) for y in range(1, size - 1)
+            if main2.TILES.passable[x, y] and (x, y) not in taken]
+    for x, y in rand.sample(free, min(crabs, len(free))):
+        main2.ACTORS.append(PREFABS.spawn('crab', x, y))
+    main2.ACTORS = main2.sort_objects(main2.ACTORS)
+    main2.INDEX = entity_index()
+    main2.INDEX.add_all(main2.ACTORS + main2.PROPS)
+    main2.PATHS = pathing.path_cache()
+    main2.HPA = hpa.hpa_map(main2.TILES.passable, config.HPA_CLUSTER)
+    main2.TILES.watch(main2.HPA.update)
+    main2.VARIANTS = autotile.tile_variants(main2.TILES, config.AUTOTILE_SOLID)
+    main2.TILES.watch(main2.VARIANTS.update)
+    main2.MINIMAP = minimap.minimap(main2.TILES, config.MINIMAP_COLOURS, config.MINIMAP_SIZE)
+    main2.TILES.watch(main2.MINIMAP.mark)
+    main2.place_dots()
+    main2.PARTICLES = []
+    main2.TOUCHED = set()
+    main2.STATE['camera pos'] = (32, 32)
+
+
+def timed_ms(func, setup=None, budget=0.2, repeat=None):
+    # best time of func(), run until about budget seconds are used (at least 3 goes)
+    best = None
+    spent = 0.0
+    goes = 0
+    while goes < 3 or (spent < budget and (repeat is None or goes < repeat)):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        spent += seconds
+        goes += 1
+        if best is None or seconds < best:
+            best = seconds
+    return best * 1000
+
+
+def bench_astar(size):
+    # corner to corner, like a skaven chasing the player across the room
+    blockmap = main2.build_blockmap(None)
+    return timed_ms(lambda: astar_1.Astar(blockmap).run((1, 1), (size - 2, size - 2)))
+
+
+def bench_find_path(size):
+    # the same, with the search main2 uses
+    blockmap = main2.build_blockmap(None)
+    return timed_ms(lambda: pathing.find_path(blockmap, (1, 1), (size - 2, size - 2)))
+
+
+def bench_hpa_route(size):
+    # the same again, by clusters, and the first leg turned into cells
+    blockmap = main2.build_blockmap(None)
+    return timed_ms(lambda: main2.HPA.next_leg(main2.HPA.route((1, 1), (size - 2, size - 2)), blockmap))
+
+
+def bench_blockmap(size):
+    return timed_ms(lambda: main2.build_blockmap(main2.SELECTED))
+
+
+def bench_query_object(size):
+    cells = [(x, y) for x in range(size) for y in range(size)]
+
+    def query_all():
+        for x, y in cells:
+            main2.query_object(x, y)
+    # per cell, so different map sizes can be compared
+    return timed_ms(query_all) / len(cells)
+
+
+def bench_sort_objects(size):
+    return timed_ms(lambda: main2.sort_objects(main2.ACTORS))
+
+
+def bench_particles(size):
+    def make_particles():
+        main2.PARTICLES = []
+        for i in range(20):
+            main2.create_particles(size // 2, size // 2, 10, 'spark')
+    return timed_ms(main2.process_particles, setup=make_particles)
+
+
+def bench_wander(size):
+    # one turn of the random persona for every crab, moving them too
+    return timed_ms(lambda: main2.wander(main2.STORE.with_persona('random')))
+
+
+def bench_minimap(size):
+    # the whole minimap redrawn, the worst it gets (usually only a bit of it is)
+    def everything():
+        main2.MINIMAP.mark(0, 0, size, size)
+        main2.place_dots()
+    return timed_ms(lambda: main2.MINIMAP.draw(main2.SURFACE_MAIN, (0, 0)), setup=everything)
+
+
+def bench_autotile(size):
+    # masks for the whole map again
+    return timed_ms(lambda: main2.VARIANTS.update(0, 0, size, size))
+
+
+def bench_generate(size):
+    return timed_ms(lambda: map1gen.map_1_generate(size, size))
+
+
+def bench_load_level(size):
+    # the current level written out as a level file, then loaded once it's compiled
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "level.json")
+    chars = numpy.where(main2.TILES.passable, ".", "#").T
+    with open(path, "w") as f:
+        json.dump({"legend": {"#": ["T_WALL", False], ".": ["T_FLOOR", True]},
+                   "map": ["".join(row) for row in chars],
+                   "player": {"kind": main2.SELECTED.prefab.kind, "x": main2.SELECTED.x, "y": main2.SELECTED.y},
+                   "entities": [{"kind": ent.prefab.kind, "x": ent.x, "y": ent.y} for ent in main2.ACTORS
+                                if ent is not main2.SELECTED]}, f)
+    cache = os.path.join(folder, "cache")
+    levelfile.load_level(path, cache)
+    try:
+        return timed_ms(lambda: levelfile.load_level(path, cache))
+    finally:
+        shutil.rmtree(folder)
+
+
+def bench_draw(size):
+    # a frame with the camera on the middle of the map
+    main2.STATE['camera pos'] = (400 - (size // 2) * config.CELL_WIDTH, 300 - (size // 2) * config.CELL_HEIGHT)
+    return timed_ms(main2.draw_game)
+
+
+BENCHES = (('Astar.run', bench_astar), ('find_path', bench_find_path), ('hpa route', bench_hpa_route),
+           ('blockmap rebuild', bench_blockmap), ('query_object per cell', bench_query_object),
+           ('sort_objects', bench_sort_objects), ('wander', bench_wander), ('process_particles', bench_particles),
+           ('map_1_generate', bench_generate), ('level load', bench_load_level), ('autotile', bench_autotile),
+           ('minimap', bench_minimap), ('draw_game', bench_draw))
+
+
+def run(sizes=SIZES):
+    main2.game_initialize()
+    # the log would only slow things down
+    main2.events.BUS.unsubscribe(main2.LOG)
+    main2.LOG.close()
+    main2.LOG = None
+    results = {}
+    for size, crabs in sizes:
+        for name, bench in BENCHES:
+            setup_level(size, crabs)
+            results['%s map=%d crabs=%d' % (name, size, crabs)] = round(bench(size), 4)
+    return results
+
+
+def compare(old, new, threshold):
+    # prints both, returns the names that got slower by more than threshold
+    slower = []
+    for key in sorted(set(old) | set(new)):
+        a, b = old.get(key), new.get(key)
+        if a and b:
+            change = (b - a) / a
+            flag = " SLOWER" if change > threshold else ""
+            if flag:
+                slower.append(key)
+            print("%-44s %10.4f %10.4f %+8.1f%%%s" % (key, a, b, 100.0 * change, flag))
+        else:
+            print("%-44s %10s %10s" % (key, a, b))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the game's hot paths")
+    parser.add_argument('--report', help="write the results here")
+    parser.add_argument('--compare', help="baseline results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="how much slower counts as a regression")
+    args = parser.parse_args()
+    results = run()
+    text = json.dumps(results, indent=1, sort_keys=True)
+    print(text)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(json.load(f), results, args.threshold)
+        if slower:
+            print(len(slower), "slower than the baseline by more than %d%%" % (args.threshold * 100))
+            sys.exit(1)
@@ -0,0 +1,162 @@
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from graphical2.objects import obj_entity, com_sprite, com_health, com_ondeath, com_attack
+from graphical2.prefabs import prefab
+
+# Memory per entity and garbage collector pauses for lots of entities.
+#   python -m benchmarks.bench_memory
+#   python -m benchmarks.bench_memory --sizes 10000 100000 --max-bytes 700
+#
+# An entity here is a crab with a sprite, health, an attack and an ondeath, about what map1gen makes.  The same
+# thing is also built the old way (a __dict__ on everything and owner as a real reference back to the entity, see
+# old_entity below) for comparison, that's the "dict" line, and from a prefab (shared attack and ondeath, see
+# prefabs.py), the "prefab" line.  The old way is skipped above --old-max, a million of them is a lot of memory.
+#
+# "gc full ms" is a full collection with everything still alive, which is the pause you get every so often while
+# playing.  "drop ms" is deleting the lot and collecting: the old way nothing is freed until the collector finds the
+# cycles, the slotted way refcounting frees it all straight away and the collector finds nothing.
+#
+# The slotted entity's numbers include its row in the entity store (see ecs.py) and the store's weak reference to
+# it.  On 3.11 (where plain objects got much smaller dicts) at 100k that's about 620 bytes against 630 the old way,
+# and the full collection takes about as long.  What's left is the prefab line (about 420 bytes) and nothing for
+# the collector to find when they're dropped.
+#
+# It exits with an error if a slotted entity takes more than --max-bytes (MAX_BYTES unless told otherwise), so it
+# can guard against someone adding a __dict__ back by accident.
+
+MAX_BYTES = 700
+
+
+def make_entity(i):
+    return obj_entity(i % 1000, i // 1000, "crab", sprite=com_sprite(None), blockpath=True, ai_persona='random',
+                      health=com_health(5), attack=com_attack(1), ondeath=com_ondeath(None))
+
+
+CRAB = prefab('crab', "crab", None, blockpath=True, hp=5, attack=1, ai_persona='random', deathimg='S_CRAB_DIE')
+
+
+def make_prefab_entity(i):
+    return CRAB.spawn(i % 1000, i // 1000)
+
+
+# The entity and components as they were before __slots__ and the entity store (main2.py back then), frozen here
+# so the "dict" line keeps measuring the old layout whatever happens to objects.py: plain attributes in a __dict__
+# and owner as a real reference back to the entity.
+class old_entity:
+    def __init__(self, x, y, objtype, sprite, blockpath=False, health=None, inventory=None, ondeath=None, attack=None,
+                 ai_persona="none", special=None):
+        self.x = x
+        self.y = y
+        self.dx = 0
+        self.dy = 0
+        self.type = objtype
+        self.blockpath = blockpath
+        self.ai_persona = ai_persona
+        self.sprite = sprite
+        self.health = health
+        self.attack = attack
+        self.inventory = inventory
+        self.ondeath = ondeath
+        self.special = special
+        for com in (sprite, health, attack, inventory, ondeath, special):
+            if com:
+                com.owner = self
+
+
+class old_health:
+    def __init__(self, hp, maxhp=None):
+        self.owner = None
+        self.hp = hp
+        self.dead = False
+        self.maxhp = hp if maxhp is None else maxhp
+
+
+class old_sprite:
+    def __init__(self, img, spriteoffsetx=0, spriteoffsety=0, layering=0):
+        self.img = img
+        self.spriteoffsetx = spriteoffsetx
+        self.spriteoffsety = spriteoffsety
+        self.layering = layering
+        self.owner = None
+
+
+class old_attack:
+    def __init__(self, attackdamage):
+        self.owner = None
+        self.attackdamage = attackdamage
+
+
+class old_ondeath:
+    def __init__(self, deathimg=None, spriteoffsetx=0, spriteoffsety=0, blockafterdeath=False):
+        self.owner = None
+        self.deathimg = deathimg
+        self.blockafterdeath = blockafterdeath
+        self.spriteoffsetx = spriteoffsetx
+        self.spriteoffsety = spriteoffsety
+
+
+def make_old_entity(i):
+    return old_entity(i % 1000, i // 1000, "crab", sprite=old_sprite(None), blockpath=True, ai_persona='random',
+                      health=old_health(5), attack=old_attack(1), ondeath=old_ondeath(None))
+
+
+def timed_ms(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        ms = (time.perf_counter() - start) * 1000
+        if best is None or ms < best:
+            best = ms
+    return best
+
+
+# returns a dict of numbers for count entities made by make
+def measure(make, count):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    ents = [make(i) for i in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    result = {'bytes per entity': used / count, 'gc full ms': timed_ms(gc.collect)}
+
+    start = time.perf_counter()
+    del ents
+    result['found by gc'] = gc.collect()
+    result['drop ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def run(sizes=(10000, 100000, 1000000), old_max=100000):
+    # returns (what, count, result)
+    results = []
+    for count in sizes:
+        results.append(('slots', count, measure(make_entity, count)))
+        results.append(('prefab', count, measure(make_prefab_entity, count)))
+        if count <= old_max:
+            results.append(('dict', count, measure(make_old_entity, count)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bytes per entity and gc pauses")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--old-max', type=int, default=100000, help="biggest count to build the old way")
+    parser.add_argument('--max-bytes', type=float, default=MAX_BYTES,
+                        help="fail if a slotted entity takes more than this")
+    args = parser.parse_args()
+
+    print("%-6s %9s %14s %12s %12s %10s" % ("what", "entities", "bytes/entity", "gc full ms", "found by gc", "drop ms"))
+    too_big = False
+    for name, count, result in run(args.sizes, args.old_max):
+        print("%-6s %9d %14.1f %12.2f %12d %10.2f" % (name, count, result['bytes per entity'], result['gc full ms'],
+                                                      result['found by gc'], result['drop ms']))
+        if name == 'slots' and args.max_bytes and result['bytes per entity'] > args.max_bytes:
+            too_big = True
+    if too_big:
+        print("slotted entities are over", args.max_bytes, "bytes each")
+        sys.exit(1)
@@ -0,0 +1,75 @@
+import random
+import time
+from graphical2_server import protocol
+
+# Encode/decode throughput for the wire protocol.
+#   python -m benchmarks.bench_protocol
+
+
+def make_world(count, seed=0):
+    rand = random.Random(seed)
+    return {entity_id: (rand.randrange(1000), rand.randrange(1000), rand.randrange(20), rand.randrange(4))
+            for entity_id in range(1, count + 1)}
+
+
+# moves some fraction of the world one cell and hurts a few, like a busy tick would
+def make_tick(entities, active, seed=1):
+    rand = random.Random(seed)
+    current = dict(entities)
+    changed = rand.sample(sorted(entities), int(len(entities) * active))
+    for entity_id in changed:
+        x, y, hp, state = current[entity_id]
+        if rand.random() < 0.2:
+            hp = max(0, hp - 1)
+        current[entity_id] = (x + rand.choice((-1, 0, 1)), y + rand.choice((-1, 0, 1)), hp, state)
+    return current, changed
+
+
+# best time out of repeat calls, so warm up and the odd hiccup don't count
+def timed(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, result
+
+
+# returns (what, world size, entities handled, seconds per call, bytes)
+def run(sizes=(1000, 10000, 100000), active=0.05):
+    results = []
+    for count in sizes:
+        repeat = max(5, 200000 // count)
+        entities = make_world(count)
+        seconds, snapshot = timed(lambda: protocol.encode_snapshot(1, entities.items()), repeat)
+        results.append(('snapshot encode', count, count, seconds, len(snapshot)))
+        view = protocol.world_view()
+        seconds, nothing = timed(lambda: view.apply(snapshot), repeat)
+        results.append(('snapshot decode', count, count, seconds, len(snapshot)))
+
+        current, changed = make_tick(entities, active)
+
+        tracker = protocol.delta_tracker()
+        tracker.sent = dict(entities)
+
+        def encode_delta():
+            data = protocol.encode_delta(2, *tracker.diff(current.get, changed))
+            # put the tracker back how it was for the next go
+            tracker.sent.update((entity_id, entities[entity_id]) for entity_id in changed)
+            return data
+        seconds, delta = timed(encode_delta, repeat)
+        results.append(('delta encode', count, len(changed), seconds, len(delta)))
+
+        # steps are relative, so applying the same delta over and over is fine for timing
+        seconds, nothing = timed(lambda: view.apply(delta), repeat)
+        results.append(('delta decode', count, len(changed), seconds, len(delta)))
+    return results
+
+
+if __name__ == '__main__':
+    print("%-16s %8s %8s %10s %12s %10s" % ("what", "world", "handled", "ms", "entities/s", "bytes"))
+    for name, count, handled, seconds, size in run():
+        print("%-16s %8d %8d %10.3f %12.0f %10d" % (name, count, handled, seconds * 1000,
+                                                     handled / seconds if seconds else 0, size))
@@ -0,0 +1,128 @@
+import time
+import numpy
+import pygame
+
+# Picks a look for each tile from what's around it, so walls get proper edges instead of every wall being the same
+# square.
+#
+# For every cell there's an 8 bit mask of which neighbours are solid (walls, or void, off the map counts too):
+#   N 1, E 2, S 4, W 8, NE 16, SE 32, SW 64, NW 128      (north is y - 1, arrays are [x, y] like the tile layers)
+# A corner bit only stays if both sides next to it are set as well (the usual 47 tile "blob" set), a corner on its own
+# doesn't change how anything looks.  The masks are worked out for the whole map at once by comparing the solid
+# array against shifted copies of itself, no loop over cells.  When tiles change, update() redoes just that rectangle
+# and the ring around it (tile_layers.watch).
+#
+# variant_sprites makes the pictures to go with them from the one sprite per terrain there is: walls get a dark edge
+# on every side that isn't against another wall and a notch in inside corners, floors get a shadow under walls.  Each
+# (terrain, mask) is only drawn the first time it's needed.
+
+N, E, S, W, NE, SE, SW, NW = 1, 2, 4, 8, 16, 32, 64, 128
+# (bit, dx, dy)
+DIRECTIONS = ((N, 0, -1), (E, 1, 0), (S, 0, 1), (W, -1, 0), (NE, 1, -1), (SE, 1, 1), (SW, -1, 1), (NW, -1, -1))
+# corner bit, and the two sides it needs
+CORNERS = ((NE, N, E), (SE, S, E), (SW, S, W), (NW, N, W))
+
+
+def neighbour_masks(solid):
+    # masks for the middle of solid, which has a one cell border all the way round
+    width, height = solid.shape[0] - 2, solid.shape[1] - 2
+    masks = numpy.zeros((width, height), dtype=numpy.uint8)
+    for bit, dx, dy in DIRECTIONS:
+        masks |= solid[1 + dx:1 + dx + width, 1 + dy:1 + dy + height].astype(numpy.uint8) * numpy.uint8(bit)
+    for corner, side_a, side_b in CORNERS:
+        both = (masks & (side_a | side_b)) == (side_a | side_b)
+        masks &= numpy.where(both, 255, 255 ^ corner).astype(numpy.uint8)
+    return masks
+
+
+class tile_variants:
+    def __init__(self, tiles, solid_ids):
+        self.tiles = tiles
+        self.solid_ids = numpy.asarray(solid_ids)
+        self.masks = numpy.zeros((tiles.width, tiles.height), dtype=numpy.uint8)
+        self.update(0, 0, tiles.width, tiles.height)
+
+    def update(self, x0, y0, x1, y1):
+        # cells [x0, x1) by [y0, y1) changed, which changes their neighbours' masks too
+        tiles = self.tiles
+        x0, y0, x1, y1 = tiles.clip(x0 - 1, y0 - 1, x1 + 1, y1 + 1)
+        if x0 >= x1 or y0 >= y1:
+            return
+        # with one more cell all round to look at, anything off the map counts as solid
+        ox0, oy0, ox1, oy1 = tiles.clip(x0 - 1, y0 - 1, x1 + 1, y1 + 1)
+        solid = numpy.ones((x1 - x0 + 2, y1 - y0 + 2), dtype=bool)
+        solid[ox0 - x0 + 1:ox1 - x0 + 1, oy0 - y0 + 1:oy1 - y0 + 1] = \
+            numpy.isin(tiles.terrain[ox0:ox1, oy0:oy1], self.solid_ids)
+        self.masks[x0:x1, y0:y1] = neighbour_masks(solid)
+
+    def keys(self, x0, y0, x1, y1):
+        # terrain id and mask in one number (terrain << 8 | mask) for a block of cells, as lists, for the renderer
+        terrain = self.tiles.terrain[x0:x1, y0:y1].astype(numpy.int32)
+        return ((terrain << 8) | self.masks[x0:x1, y0:y1]).tolist()
+
+
+class variant_sprites:
+    def __init__(self, sprites, solid_ids):
+        self.sprites = sprites  # terrain id -> the plain sprite
+        self.solid_ids = set(solid_ids)
+        self.made = {}  # terrain << 8 | mask -> surface (or None for terrain that isn't drawn)
+
+    def get(self, key):
+        img = self.made.get(key)
+        if img is None and key not in self.made:
+            img = self.made[key] = self.make(key >> 8, key & 255)
+        return img
+
+    def make(self, terrain, mask):
+        base = self.sprites.get(terrain)
+        if base is None:
+            return None
+        img = base.copy()
+        w, h = img.get_size()
+        edge = max(1, w // 10)
+        if terrain in self.solid_ids:
+            # dark edge on sides that face something open
+            dark = (25, 20, 20)
+            sides = ((N, (0, 0, w, edge)), (S, (0, h - edge, w, edge)), (W, (0, 0, edge, h)),
+                     (E, (w - edge, 0, edge, h)))
+            for bit, rect in sides:
+                if not mask & bit:
+                    img.fill(dark, rect)
+            # inside corners, both sides are wall but the diagonal is open
+            corners = ((NE, N | E, (w - edge, 0)), (SE, S | E, (w - edge, h - edge)), (SW, S | W, (0, h - edge)),
+                       (NW, N | W, (0, 0)))
+            for bit, sides_needed, (x, y) in corners:
+                if mask & sides_needed == sides_needed and not mask & bit:
+                    img.fill(dark, (x, y, edge, edge))
+        else:
+            # floors get a shadow from walls to the north and west
+            shadow = pygame.Surface((w, h), pygame.SRCALPHA)
+            if mask & N:
+                shadow.fill((0, 0, 0, 110), (0, 0, w, edge * 2))
+            if mask & W:
+                shadow.fill((0, 0, 0, 70), (0, edge * 2 if mask & N else 0, edge, h))
+            img.blit(shadow, (0, 0))
+        return img
+
+
+if __name__ == '__main__':
+    # masks for a big cave, and what a small change costs
+    #   python -m graphical2.autotile
+    from graphical2 import tilemap
+    size = 1000
+    rng = numpy.random.default_rng(0)
+    tiles = tilemap.new_layers(size, size)
+    walls = rng.random((size, size)) < 0.45
+    tiles.terrain[:] = numpy.where(walls, 2, 1)
+    start = time.perf_counter()
+    variants = tile_variants(tiles, (0, 2))
+    print("whole map: %.1f ms" % ((time.perf_counter() - start) * 1000))
+    tiles.watch(variants.update)
+    start = time.perf_counter()
+    for i in range(100):
+        x, y = rng.integers(0, size - 3, 2)
+        tiles.fill_rect(x, y, x + 3, y + 3, 1, True)
+    print("3x3 change: %.3f ms" % ((time.perf_counter() - start) * 10))
+    fresh = tile_variants(tiles, (0, 2))
+    print("same as redoing the lot:", bool((fresh.masks == variants.masks).all()))
+    print("different masks in use:", len(numpy.unique(variants.masks)))
@@ -0,0 +1,143 @@
+import math
+import time
+import numpy
+from graphical2 import ecs
+
+# Ranged and area attacks.
+#
+# Everything works on two arrays indexed [x, y] like the tile layers: passable (walls stop bolts) and an occupancy
+# array holding the id of whatever is standing in each cell, or -1 (ecs.entity_store keeps one, main2 uses its store's).
+#   trace()         follows a line from the shooter and says what it hit first
+#   gather_radius() everything within a circle, for blasts
+#   gather_cone()   everything within a cone, for breath and such
+#
+# Hits aren't applied straight away.  They go in a damage_batch, and once everything for the turn is in, the batch
+# is applied in one go and only then does anything die.  So a fireball over 500 monsters is one gather and one numpy
+# subtract, about the same as hitting one, and nothing dies halfway through the turn and changes what the rest hit.
+
+
+def line(x0, y0, x1, y1):
+    # the cells from (x0, y0) to (x1, y1), both ends included, as two arrays.  these are the cells bresenham's line
+    # picks (up to which way a tie rounds), just worked out all at once: one step along the long axis each cell and
+    # the short axis rounded to the nearest cell.
+    dx, dy = x1 - x0, y1 - y0
+    steps = max(abs(dx), abs(dy))
+    if steps == 0:
+        return numpy.array([x0]), numpy.array([y0])
+    along = numpy.arange(steps + 1)
+    xs = x0 + (2 * along * dx + steps) // (2 * steps)
+    ys = y0 + (2 * along * dy + steps) // (2 * steps)
+    return xs, ys
+
+
+def trace(passable, occupancy, x0, y0, x1, y1, reach=None):
+    # shoots from (x0, y0) towards (x1, y1).  stops at the first thing in the way, at a wall, at the edge of the map
+    # or after reach cells.  returns (id of what got hit or -1, x, y where it stopped)
+    xs, ys = line(x0, y0, x1, y1)
+    xs, ys = xs[1:], ys[1:]
+    if reach is not None:
+        xs, ys = xs[:reach], ys[:reach]
+    width, height = passable.shape
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    if not inside.all():
+        edge = numpy.argmin(inside)
+        xs, ys = xs[:edge], ys[:edge]
+    if not len(xs):
+        return -1, x0, y0
+    walls = ~passable[xs, ys]
+    ids = occupancy[xs, ys]
+    stops = numpy.flatnonzero(walls | (ids >= 0))
+    if not len(stops):
+        return -1, int(xs[-1]), int(ys[-1])
+    stop = stops[0]
+    if walls[stop]:
+        # it stops in front of the wall
+        if stop == 0:
+            return -1, x0, y0
+        return -1, int(xs[stop - 1]), int(ys[stop - 1])
+    return int(ids[stop]), int(xs[stop]), int(ys[stop])
+
+
+def window(occupancy, x, y, radius):
+    # the part of occupancy within radius of (x, y), and the cell coordinates for it
+    width, height = occupancy.shape
+    x0, y0 = max(0, x - radius), max(0, y - radius)
+    x1, y1 = min(width, x + radius + 1), min(height, y + radius + 1)
+    gx, gy = numpy.mgrid[x0:x1, y0:y1]
+    return occupancy[x0:x1, y0:y1], gx - x, gy - y
+
+
+def gather_radius(occupancy, x, y, radius):
+    # ids of everything within radius of (x, y), the middle included.  walls don't shield anything, it's a blast.
+    ids, ox, oy = window(occupancy, x, y, radius)
+    ids = ids[ox * ox + oy * oy <= radius * radius]
+    return ids[ids >= 0]
+
+
+def gather_cone(occupancy, x, y, aim_x, aim_y, radius, spread=45):
+    # ids of everything within radius of (x, y) and no more than spread degrees off the direction (aim_x, aim_y).
+    # the middle cell (whoever is doing it) isn't included.
+    ids, ox, oy = window(occupancy, x, y, radius)
+    length = math.hypot(aim_x, aim_y) or 1.0
+    dist_sq = ox * ox + oy * oy
+    # cos of the angle between each cell and the aim, compared without a sqrt per cell
+    dot = (ox * aim_x + oy * aim_y) / length
+    inside = (dist_sq > 0) & (dist_sq <= radius * radius) & (dot > 0) & \
+        (dot * dot >= dist_sq * math.cos(math.radians(spread)) ** 2)
+    ids = ids[inside]
+    return ids[ids >= 0]
+
+
+class damage_batch:
+    def __init__(self):
+        self.targets = []  # arrays of ids
+        self.amounts = []  # matching arrays of damage
+
+    def add(self, targets, amount):
+        targets = numpy.asarray(targets, dtype=numpy.int64)
+        self.targets.append(targets)
+        self.amounts.append(numpy.broadcast_to(numpy.asarray(amount, dtype=numpy.int64), targets.shape))
+
+    def clear(self):
+        self.targets = []
+        self.amounts = []
+
+    def totals(self, size):
+        # (ids, total damage for each) with everything added up, and the batch emptied
+        if not self.targets:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        summed = numpy.bincount(numpy.concatenate(self.targets), numpy.concatenate(self.amounts), minlength=size)
+        self.clear()
+        ids = numpy.flatnonzero(summed)
+        return ids, summed[ids].astype(numpy.int64)
+
+    def apply(self, store):
+        # hurts everything in an ecs.entity_store at once, then works out who died.  returns the ids that died.
+        if self.targets:
+            ecs.damage_system(store, numpy.concatenate(self.targets), numpy.concatenate(self.amounts))
+            self.clear()
+        return ecs.death_system(store)
+
+
+if __name__ == '__main__':
+    # a fireball over lots of monsters against a bolt at one
+    #   python -m graphical2.combat
+    rng = numpy.random.default_rng(0)
+    size = 200
+    store = ecs.entity_store(size, size)
+    passable = numpy.ones((size, size), dtype=bool)
+    cells = rng.choice(size * size, 20000, replace=False)
+    store.spawn_many(cells // size, cells % size, hp=5, blockpath=True)
+    batch = damage_batch()
+    for radius in (0, 4, 12, 30):
+        start = time.perf_counter()
+        for i in range(100):
+            ids = gather_radius(store.occupancy, size // 2, size // 2, radius)
+            # no damage, so the same monsters are still there for the next go
+            batch.add(ids, 0)
+            batch.apply(store)
+        print("blast radius %2d: %4d monsters, %.3f ms" % (radius, len(ids), (time.perf_counter() - start) * 10))
+    start = time.perf_counter()
+    for i in range(100):
+        trace(passable, store.occupancy, 0, 0, size - 1, size // 3)
+    print("bolt across the map: %.3f ms" % ((time.perf_counter() - start) * 10))
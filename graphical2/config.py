@@ -3,6 +3,47 @@ CELL_WIDTH = 64
 CELL_HEIGHT = 64
 WAIT_TIME = 0.1
 MAP_1_GEN_SIZE = (10, 10)
+# set this to a folder to keep the generated level's tile layers in memmap files instead of memory (see tilemap.py)
+MAP_1_TILE_FOLDER = None
+# play a level file (see levelfile.py) instead of the generated map, e.g. "levels/first_room.json", and where the
+# compiled levels are kept
+LEVEL_FILE = None
+LEVEL_CACHE = "level_cache"
+# how far around the player gets marked as explored
+EXPLORE_RADIUS = 6
+# write game events (attacks, deaths, moves...) to the console, see events.py
+LOG_EVENTS = True
+# frame profiler (see profiler.py): how many frames the stats cover, and where they go when the game quits
+PROFILE_WINDOW = 600
+PROFILE_FILE = "frame_profile.json"
+# ai planning (see scheduler.py): seconds of each frame it can use, cells a path search looks at between checking
+# the clock, and how many frames a turn gets before everyone has to go with what they've got
+AI_BUDGET = 0.008
+AI_SLICE = 200
+AI_HURRY_FRAMES = 30
+# plan the enemy turn on a worker thread while the player is deciding (see speculate.py)
+AI_SPECULATE = True
+# kept paths (see path_cache in pathing.py): how far the goal can move and the path still gets patched up, how many
+# cells the patch-up search gets, how many patches before it's a proper search again, and how close to an actor
+# something walking onto its path has to be to make it look for another way
+PATH_REPAIR_REACH = 3
+PATH_REPAIR_LIMIT = 64
+PATH_REFRESH = 10
+PATH_LOOKAHEAD = 4
+# long routes (see hpa.py): cells across a cluster, and how far away something has to be before it uses them
+HPA_CLUSTER = 10
+HPA_DISTANCE = 30
+# ranged attacks (see combat.py)
+RANGED_REACH = 8
+BOLT_DAMAGE = 2
+FIREBALL_RADIUS = 2
+FIREBALL_DAMAGE = 3
+
+# terrain ids for the tile layers
+T_VOID = 0
+T_FLOOR = 1
+T_WALL = 2
+T_TRAPDOOR = 3
 
 #Sprites
 S_WALL = pygame.transform.scale(pygame.image.load("images/wall2.png"), (CELL_WIDTH, CELL_HEIGHT))
@@ -18,3 +59,12 @@ S_HUMAN = pygame.transform.scale(pygame.image.load("images/human2.png"), (1 * CE
 #skaven
 S_SKAVEN = pygame.transform.scale(pygame.image.load("images/skaven.png"), (1 * CELL_WIDTH, 2 * CELL_HEIGHT))
 S_SKAVEN_DIE = pygame.transform.scale(pygame.image.load("images/skaven_dead.png"), (CELL_WIDTH, CELL_HEIGHT))
+
+# what to draw for each terrain id
+TERRAIN_SPRITES = {T_FLOOR: S_FLOOR, T_WALL: S_WALL, T_TRAPDOOR: S_TRAPDOOR}
+# terrain that counts as solid when picking wall edges and floor shadows (see autotile.py)
+AUTOTILE_SOLID = (T_VOID, T_WALL)
+
+# the overview map (see minimap.py): how many pixels across at most, and a colour for each terrain id
+MINIMAP_SIZE = 160
+MINIMAP_COLOURS = {T_FLOOR: (90, 80, 70), T_WALL: (170, 170, 170), T_TRAPDOOR: (140, 80, 30)}
@@ -0,0 +1,325 @@
+import numpy
+import time
+import weakref
+
+# Entity store, struct of arrays style: instead of keeping everything in python objects, the numbers that change
+# every turn are numpy columns and an entity is just a row number (its id).  Systems then work on whole columns at
+# once, so a turn for 50k crabs is a handful of numpy calls instead of 50k trips through python.
+#
+# obj_entity (objects.py) is a view over a row: ent.x, ent.dx, ent.blockpath, ent.ai_persona and ent.health.hp read
+# and write the store, so the game can keep using entities one at a time and still hand whole columns to numpy.  Each
+# entity goes in STORE when it's made, and new_level() starts a fresh one the size of the map (map1gen and levelfile
+# call it).  Entities from an older level keep the store they were made in.  Rows can also be made without an
+# entity, for things that are only ever handled in bulk:
+#
+#   store = entity_store(width, height)
+#   crab = store.spawn(3, 4, hp=5, blockpath=True, persona=PERSONA_RANDOM)
+#   store.dx[crab], store.dy[crab] = 1, 0
+#   moved, attackers, targets = move_system(store, passable)
+#   damage_system(store, targets, store.attack[attackers])
+#   dead = death_system(store)
+#
+# Positions are [x, y] like the tile layers, and store.occupancy is an (width, height) array holding the id of the
+# blocking entity in each cell (or -1), so "is something in the way" is one lookup for everyone at once.  It's kept
+# up to date as things move, so nothing has to build it.  Anything that changes x, y or blockpath by hand has to go
+# through place()/place_many()/set_blockpath() (obj_entity does), writing the columns straight skips the occupancy.  Two blockers
+# can end up on the same cell for a moment (a rewind puts x back before y), stacked counts them so the one left
+# behind takes the cell back.
+
+PERSONA_NONE = 0
+PERSONA_RANDOM = 1
+PERSONA_DUMB_ATTACK = 2
+# code -> name, anything new gets added the first time it's used (see persona_code)
+PERSONAS = ['none', 'random', 'dumb_attack']
+
+# name, dtype.  maxhp 0 means no health, it can't be hurt.  mortal is whether it dies when hp runs out (obj_entity
+# sets it when there's an ondeath)
+COLUMNS = (('x', numpy.int32), ('y', numpy.int32), ('dx', numpy.int8), ('dy', numpy.int8),
+           ('hp', numpy.int32), ('maxhp', numpy.int32), ('attack', numpy.int32), ('dead', numpy.bool_),
+           ('mortal', numpy.bool_), ('blockpath', numpy.bool_), ('persona', numpy.uint8), ('used', numpy.bool_))
+
+
+def persona_code(name):
+    try:
+        return PERSONAS.index(name)
+    except ValueError:
+        PERSONAS.append(name)
+        return len(PERSONAS) - 1
+
+
+class entity_store:
+    def __init__(self, width, height, capacity=1024):
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        for name, dtype in COLUMNS:
+            setattr(self, name, numpy.zeros(capacity, dtype=dtype))
+        # id -> weakref to its obj_entity, or None for rows that don't have one
+        self.objects = [None] * capacity
+        self.occupancy = numpy.full((width, height), -1, dtype=numpy.int32)
+        # how many blockers are in each cell, nearly always 0 or 1
+        self.stacked = numpy.zeros((width, height), dtype=numpy.int32)
+        # ids never used yet start at count, ids given back go in free
+        self.count = 0
+        self.free = []
+
+    def grow(self, capacity):
+        for name, dtype in COLUMNS:
+            column = numpy.zeros(capacity, dtype=dtype)
+            column[:self.capacity] = getattr(self, name)
+            setattr(self, name, column)
+        self.objects += [None] * (capacity - self.capacity)
+        self.capacity = capacity
+
+    def spawn(self, x, y, hp=0, attack=0, blockpath=False, persona=PERSONA_NONE, mortal=True, obj=None):
+        if self.free:
+            ent = self.free.pop()
+        else:
+            if self.count == self.capacity:
+                self.grow(self.capacity * 2)
+            ent = self.count
+            self.count += 1
+        self.x[ent], self.y[ent], self.dx[ent], self.dy[ent] = x, y, 0, 0
+        self.hp[ent], self.maxhp[ent], self.attack[ent], self.dead[ent] = hp, hp, attack, False
+        self.mortal[ent], self.blockpath[ent], self.persona[ent], self.used[ent] = mortal, blockpath, persona, True
+        self.objects[ent] = weakref.ref(obj) if obj is not None else None
+        if blockpath:
+            self.block(ent)
+        return ent
+
+    def spawn_many(self, xs, ys, hp=0, attack=0, blockpath=False, persona=PERSONA_NONE, mortal=True):
+        # lots of the same thing at once, returns the ids
+        number = len(xs)
+        if self.count + number > self.capacity:
+            self.grow(max(self.capacity * 2, self.count + number))
+        ids = numpy.arange(self.count, self.count + number)
+        self.count += number
+        self.x[ids], self.y[ids], self.dx[ids], self.dy[ids] = xs, ys, 0, 0
+        self.hp[ids], self.maxhp[ids], self.attack[ids], self.dead[ids] = hp, hp, attack, False
+        self.mortal[ids], self.blockpath[ids], self.persona[ids], self.used[ids] = mortal, blockpath, persona, True
+        if blockpath:
+            self.occupancy[xs, ys] = ids
+            numpy.add.at(self.stacked, (xs, ys), 1)
+        return ids
+
+    def remove(self, ent):
+        if self.blockpath[ent]:
+            self.unblock(ent)
+        self.used[ent] = False
+        self.blockpath[ent] = False
+        self.objects[ent] = None
+        self.free.append(ent)
+
+    def entity(self, ent):
+        # the obj_entity for an id, or None
+        ref = self.objects[ent]
+        return ref() if ref is not None else None
+
+    def inside(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def block(self, ent):
+        x, y = self.x.item(ent), self.y.item(ent)
+        if self.inside(x, y):
+            self.occupancy[x, y] = ent
+            self.stacked[x, y] += 1
+
+    def unblock(self, ent):
+        # takes ent out of its cell, if another blocker is stacked on the same cell it gets the cell back
+        x, y = self.x.item(ent), self.y.item(ent)
+        if not self.inside(x, y):
+            return
+        self.stacked[x, y] -= 1
+        if self.occupancy[x, y] == ent:
+            self.occupancy[x, y] = -1
+            if self.stacked[x, y]:
+                self.refill(numpy.array([x]), numpy.array([y]), ent)
+
+    def refill(self, xs, ys, skip=-1):
+        # puts back whichever blocker is really in each of these cells (after the one on record left)
+        count = self.count
+        blockers = numpy.flatnonzero(self.used[:count] & self.blockpath[:count])
+        blockers = blockers[blockers != skip]
+        keys = self.x[blockers].astype(numpy.int64) * self.height + self.y[blockers]
+        blockers = blockers[numpy.isin(keys, xs.astype(numpy.int64) * self.height + ys)]
+        self.occupancy[self.x[blockers], self.y[blockers]] = blockers
+
+    def place(self, ent, x, y):
+        if self.blockpath[ent]:
+            self.unblock(ent)
+            self.x[ent], self.y[ent] = x, y
+            self.block(ent)
+        else:
+            self.x[ent], self.y[ent] = x, y
+
+    def leave_cells(self, blockers):
+        # takes blockers out of the occupancy where they are now, gives back the cells somebody else is stacked on
+        # (they need a refill once the leavers are gone from there)
+        ox, oy = self.x[blockers], self.y[blockers]
+        if (self.stacked[ox, oy] > 1).any():
+            numpy.subtract.at(self.stacked, (ox, oy), 1)
+        else:
+            # a cell each, the quick way
+            self.stacked[ox, oy] -= 1
+        mine = self.occupancy[ox, oy] == blockers
+        self.occupancy[ox[mine], oy[mine]] = -1
+        left_behind = mine & (self.stacked[ox, oy] > 0)
+        return ox[left_behind], oy[left_behind]
+
+    def place_many(self, ents, xs, ys):
+        # place() for lots at once.  the cells have to be free and a different one for each blocker
+        blockers = ents[self.blockpath[ents]]
+        lx, ly = self.leave_cells(blockers)
+        self.x[ents] = xs
+        self.y[ents] = ys
+        bx, by = self.x[blockers], self.y[blockers]
+        self.occupancy[bx, by] = blockers
+        self.stacked[bx, by] += 1
+        if len(lx):
+            self.refill(lx, ly)
+
+    def set_blockpath(self, ent, blockpath):
+        if blockpath == self.blockpath[ent]:
+            return
+        if blockpath:
+            self.blockpath[ent] = True
+            self.block(ent)
+        else:
+            self.unblock(ent)
+            self.blockpath[ent] = False
+
+    def ids(self):
+        return numpy.flatnonzero(self.used[:self.count])
+
+    def living(self):
+        # everything in use that isn't dead
+        return numpy.flatnonzero(self.used[:self.count] & ~self.dead[:self.count])
+
+    def with_persona(self, name):
+        # ids of everything with that ai persona, same lot as entity_index.with_persona but without the entities
+        count = self.count
+        return numpy.flatnonzero(self.used[:count] & (self.persona[:count] == persona_code(name)))
+
+
+# the store new entities go in
+STORE = entity_store(0, 0)
+
+
+def new_level(width, height):
+    # a fresh store for a new map, everything made after this goes in it
+    global STORE
+    STORE = entity_store(width, height)
+    return STORE
+
+
+###########################
+####      SYSTEMS      ####
+###########################
+
+def move_system(store, passable):
+    # moves everything with a dx/dy that can go there.  a blocker in the way gets bumped instead (attacked, if the
+    # mover can attack).  when two movers want the same cell the lower id gets it and the other one bumps into it.
+    # a cell somebody moves out of is free for the rest, so a queue of crabs walking the same way all get to move:
+    # it goes in rounds, each one moves whoever has somewhere free to go now, until nobody else can.
+    # returns (ids that moved, attacker ids, target ids), and clears dx/dy like move_objects does.
+    count = store.count
+    movers = numpy.flatnonzero(store.used[:count] & ((store.dx[:count] != 0) | (store.dy[:count] != 0)))
+    if not len(movers):
+        return movers, movers, movers
+    tx = store.x[movers] + store.dx[movers]
+    ty = store.y[movers] + store.dy[movers]
+    store.dx[movers] = 0
+    store.dy[movers] = 0
+    inside = (tx >= 0) & (tx < store.width) & (ty >= 0) & (ty < store.height)
+    movers, tx, ty = movers[inside], tx[inside], ty[inside]
+    open_floor = passable[tx, ty]
+    movers, tx, ty = movers[open_floor], tx[open_floor], ty[open_floor]
+
+    moved = []
+    while len(movers):
+        free = store.occupancy[tx, ty] < 0
+        if not free.any():
+            break
+        # only blockers can't share a cell.  movers are in id order so the first one for each cell wins
+        going = numpy.flatnonzero(free)
+        blocking = store.blockpath[movers[going]]
+        cells, first = numpy.unique(tx[going[blocking]] * store.height + ty[going[blocking]], return_index=True)
+        winners = numpy.zeros(len(movers), dtype=bool)
+        winners[going[~blocking]] = True
+        winners[going[numpy.flatnonzero(blocking)[first]]] = True
+        store.place_many(movers[winners], tx[winners], ty[winners])
+        moved.append(movers[winners])
+        movers, tx, ty = movers[~winners], tx[~winners], ty[~winners]
+
+    # whoever couldn't go bumps into what's there
+    occupant = store.occupancy[tx, ty]
+    bumped = occupant >= 0
+    attackers, targets = movers[bumped], occupant[bumped]
+    hurtable = (store.attack[attackers] > 0) & (store.maxhp[targets] > 0) & ~store.dead[targets]
+    moved = numpy.concatenate(moved) if moved else movers[:0]
+    return moved, attackers[hurtable], targets[hurtable]
+
+
+def damage_system(store, targets, amounts):
+    # everything hurt this turn in one go.  the same target can be in there lots of times, it all adds up.
+    targets = numpy.asarray(targets)
+    if not len(targets):
+        return
+    numpy.subtract.at(store.hp, targets, numpy.broadcast_to(numpy.asarray(amounts, dtype=numpy.int32), targets.shape))
+
+
+def death_system(store, blockafterdeath=False):
+    # anything mortal with health that's run out dies, same as com_ondeath.die: it stops thinking and (normally)
+    # stops blocking.  returns the ids that died this turn.
+    count = store.count
+    died = numpy.flatnonzero(store.used[:count] & store.mortal[:count] & ~store.dead[:count]
+                             & (store.maxhp[:count] > 0) & (store.hp[:count] <= 0))
+    if not len(died):
+        return died
+    store.dead[died] = True
+    store.persona[died] = PERSONA_NONE
+    if not blockafterdeath:
+        blockers = died[store.blockpath[died]]
+        lx, ly = store.leave_cells(blockers)
+        store.blockpath[blockers] = False
+        if len(lx):
+            store.refill(lx, ly)
+    return died
+
+
+def wander_system(store, rng):
+    # gives everything with the random persona a random step, like ai_moves does one at a time
+    count = store.count
+    wanderers = numpy.flatnonzero(store.used[:count] & (store.persona[:count] == PERSONA_RANDOM))
+    # same odds as ai_moves: two in three pick a dx, the rest a dy, either way -1, 0 or 1
+    steps = rng.integers(-1, 2, len(wanderers))
+    along_x = rng.integers(0, 3, len(wanderers)) > 0
+    store.dx[wanderers] = numpy.where(along_x, steps, 0)
+    store.dy[wanderers] = numpy.where(along_x, 0, steps)
+    return wanderers
+
+
+if __name__ == '__main__':
+    # how long a turn takes for a big crowd of crabs with some fighting
+    #   python -m graphical2.ecs 50000
+    import sys
+    crabs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    size = int((crabs * 4) ** 0.5)
+    rng = numpy.random.default_rng(0)
+    passable = numpy.ones((size, size), dtype=bool)
+    store = entity_store(size, size)
+    cells = rng.choice(size * size, crabs, replace=False)
+    store.spawn_many(cells // size, cells % size, hp=5, attack=1, blockpath=True, persona=PERSONA_RANDOM)
+    turns = 20
+    start = time.perf_counter()
+    moves = hits = deaths = 0
+    for turn in range(turns):
+        wander_system(store, rng)
+        moved, attackers, targets = move_system(store, passable)
+        damage_system(store, targets, store.attack[attackers])
+        moves += len(moved)
+        hits += len(targets)
+        deaths += len(death_system(store))
+    seconds = (time.perf_counter() - start) / turns
+    print("%d crabs on %dx%d: %.2f ms a turn, %d moves, %d hits, %d deaths over %d turns"
+          % (crabs, size, size, seconds * 1000, moves, hits, deaths, turns))
@@ -0,0 +1,118 @@
+import queue
+import sys
+import threading
+
+# Event bus, so the game doesn't print() in the middle of a turn.
+#
+# Game code says what happened:
+#   events.BUS.emit(events.EV_ATTACK, attacker name, attacker hp, target name, target hp)
+# which just drops a tuple in a ring buffer.  Once a frame BUS.dispatch() hands everything since last time to each
+# subscriber as one list (only the kinds it asked for), so the UI, the network or some stats counter can deal with a
+# whole turn of events at once.
+#
+# The console log is just one more subscriber (log_flusher): it passes each batch to a background thread which does
+# the formatting and the writing, so slow console output never holds up a turn.  With nobody subscribed emit() is
+# swapped for a function that does nothing, so turning the log off (config.LOG_EVENTS) costs nothing.
+#
+# Events should carry plain values (names, numbers) and not entities, the entity might have changed by the time
+# anyone looks at the event.
+
+EV_MOVE = 0  # (name, x, y)
+EV_ATTACK = 1  # (attacker name, attacker hp, target name, target hp)  hp before the hit
+EV_DEATH = 2  # (name,)
+EV_CLICK = 3  # (x, y)  grid position of a mouse click
+EV_SELECT = 4  # (name,)  something under the click
+EV_REWIND = 5  # (turn,)
+EV_WANDER = 6  # (count,)  how many of the random wanderers stepped this turn, one event for the whole crowd
+
+# how each kind reads in the log, mostly what used to get printed
+FORMATS = {
+    EV_MOVE: lambda name, x, y: '%s moved to %s, %s' % (name, x, y),
+    EV_ATTACK: lambda attacker, attacker_hp, target, target_hp: '%s ( %s hp) attacks %s ( %s hp)' % (
+        attacker, attacker_hp, target, target_hp),
+    EV_DEATH: lambda name: '%s Died!' % name,
+    EV_CLICK: lambda x, y: '%s %s' % (x, y),
+    EV_SELECT: lambda name: str(name),
+    EV_REWIND: lambda turn: 'rewound to turn %s' % turn,
+    EV_WANDER: lambda count: '%s wanderers moved' % count,
+}
+
+
+def describe(event):
+    return FORMATS[event[0]](*event[1])
+
+
+class event_bus:
+    def __init__(self, size=4096):
+        # size is rounded up to a power of two so the position in the ring is just a mask
+        self.size = 1 << max(0, size - 1).bit_length()
+        self.mask = self.size - 1
+        self.events = [None] * self.size
+        self.written = 0  # every event ever emitted
+        self.read = 0  # dispatched up to here
+        self.dropped = 0  # overwritten before anyone got them
+        self.subscribers = []  # (set of kinds or None for everything, callback)
+        self.emit = self.ignore
+
+    def record(self, kind, *args):
+        self.events[self.written & self.mask] = (kind, args)
+        self.written += 1
+
+    def ignore(self, kind, *args):
+        pass
+
+    def subscribe(self, callback, kinds=None):
+        self.subscribers.append((set(kinds) if kinds is not None else None, callback))
+        self.emit = self.record
+
+    def unsubscribe(self, callback):
+        self.subscribers = [(kinds, sub) for kinds, sub in self.subscribers if sub is not callback]
+        if not self.subscribers:
+            self.emit = self.ignore
+
+    def dispatch(self):
+        # hands out everything since the last dispatch, returns how many events that was
+        if self.written - self.read > self.size:
+            # the ring went all the way round, the oldest ones are gone
+            self.dropped += self.written - self.read - self.size
+            self.read = self.written - self.size
+        if self.read == self.written:
+            return 0
+        mask, events = self.mask, self.events
+        batch = [events[i & mask] for i in range(self.read, self.written)]
+        self.read = self.written
+        for kinds, callback in self.subscribers:
+            mine = batch if kinds is None else [event for event in batch if event[0] in kinds]
+            if mine:
+                callback(mine)
+        return len(batch)
+
+
+# subscriber that writes events to a stream (the console by default) from a background thread
+class log_flusher:
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='event log', daemon=True)
+        self.thread.start()
+
+    def __call__(self, batch):
+        self.queue.put(batch)
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            stream = self.stream or sys.stdout
+            stream.write(''.join(describe(event) + '\n' for event in batch))
+            stream.flush()
+
+    def close(self):
+        # writes out whatever is still waiting and stops the thread
+        self.queue.put(None)
+        self.thread.join()
+
+
+# the game's bus
+BUS = event_bus()
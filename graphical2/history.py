@@ -0,0 +1,145 @@
+import collections
+
+# Turn history, for rewinding the game (debugging and undo).
+# Instead of copying ACTORS/PROPS every turn, each turn only stores what changed:
+#   (entity, field, old value, new value)
+# and every so often a keyframe (full state of everything) so a long rewind can jump to the keyframe and only undo
+# the last few turns instead of every turn in between.  Old turns fall off the back once the budget is used up.
+
+# the parts of an entity we track, in the order they're stored
+FIELDS = ('x', 'y', 'hp', 'dead', 'img', 'layering', 'spriteoffsetx', 'spriteoffsety', 'blockpath', 'ai_persona')
+X, Y, HP, DEAD, IMG, LAYERING, OFFX, OFFY, BLOCKPATH, PERSONA = range(len(FIELDS))
+
+# rough bytes per stored change (the tuple plus the list slot), used for the memory budget.
+CHANGE_BYTES = 100
+
+
+def capture(ent):
+    health, sprite = ent.health, ent.sprite
+    return (ent.x, ent.y,
+            health.hp if health else None, health.dead if health else None,
+            sprite.img, sprite.layering, sprite.spriteoffsetx, sprite.spriteoffsety,
+            ent.blockpath, ent.ai_persona)
+
+
+def set_field(ent, field, value):
+    if field == X:
+        ent.x = value
+    elif field == Y:
+        ent.y = value
+    elif field == HP:
+        ent.health.hp = value
+    elif field == DEAD:
+        ent.health.dead = value
+    elif field == IMG:
+        ent.sprite.img = value
+    elif field == LAYERING:
+        ent.sprite.layering = value
+    elif field == OFFX:
+        ent.sprite.spriteoffsetx = value
+    elif field == OFFY:
+        ent.sprite.spriteoffsety = value
+    elif field == BLOCKPATH:
+        ent.blockpath = value
+    elif field == PERSONA:
+        ent.ai_persona = value
+
+
+def restore(ent, state):
+    for field, value in enumerate(state):
+        if field in (HP, DEAD) and not ent.health:
+            continue
+        set_field(ent, field, value)
+
+
+class turn_history:
+    def __init__(self, keyframe_every=50, budget_bytes=4 * 1024 * 1024):
+        self.keyframe_every = keyframe_every
+        self.budget_bytes = budget_bytes
+        self.turn = 0
+        # (turn number, [(ent, field, old, new), ...]) oldest first
+        self.turns = collections.deque()
+        # (turn number, {ent: state}) oldest first
+        self.keyframes = collections.deque()
+        # last state we saw for every entity, so we can work out what changed
+        self.last = {}
+        self.used_bytes = 0
+
+    def track(self, entities):
+        # start watching entities (call once at the start, and for anything that shows up later)
+        for ent in entities:
+            if ent not in self.last:
+                self.last[ent] = capture(ent)
+
+    def commit(self, touched):
+        # ends the turn.  touched is everything that might have changed this turn (moved, got hit, died...)
+        changes = []
+        for ent in touched:
+            state = capture(ent)
+            old = self.last.get(ent)
+            self.last[ent] = state
+            if old is None or old == state:
+                continue
+            for field in range(len(FIELDS)):
+                if old[field] != state[field]:
+                    changes.append((ent, field, old[field], state[field]))
+        self.turn += 1
+        self.turns.append((self.turn, changes))
+        self.used_bytes += (len(changes) + 1) * CHANGE_BYTES
+        if self.turn % self.keyframe_every == 0:
+            self.keyframes.append((self.turn, dict(self.last)))
+            self.used_bytes += len(self.last) * CHANGE_BYTES
+        self.trim()
+
+    def trim(self):
+        while self.used_bytes > self.budget_bytes and len(self.turns) > 1:
+            number, changes = self.turns.popleft()
+            self.used_bytes -= (len(changes) + 1) * CHANGE_BYTES
+            # a keyframe is only useful while we still have the turns after it
+            while self.keyframes and self.keyframes[0][0] < number:
+                self.used_bytes -= len(self.keyframes.popleft()[1]) * CHANGE_BYTES
+
+    def oldest_turn(self):
+        # how far back we can go
+        if self.turns:
+            return self.turns[0][0] - 1
+        return self.turn
+
+    def rewind(self, n):
+        # puts every tracked entity back the way it was n turns ago and forgets those turns.
+        # returns the set of entities that were changed so the caller can fix up its lists.
+        target = max(self.turn - n, self.oldest_turn())
+        changed = set()
+
+        # drop keyframes we're rewinding past, but remember the oldest one that's still ahead of the target
+        keyframe = None
+        while self.keyframes and self.keyframes[-1][0] >= target:
+            number, states = self.keyframes.pop()
+            self.used_bytes -= len(states) * CHANGE_BYTES
+            if number < self.turn:
+                keyframe = (number, states)
+        if keyframe:
+            # jump straight to the keyframe, then undo the turns we popped past it below
+            number, states = keyframe
+            for ent, state in states.items():
+                if self.last.get(ent) != state:
+                    restore(ent, state)
+                    self.last[ent] = state
+                    changed.add(ent)
+            while self.turns and self.turns[-1][0] > number:
+                self.used_bytes -= (len(self.turns.pop()[1]) + 1) * CHANGE_BYTES
+            if number == target:
+                self.keyframes.append(keyframe)
+                self.used_bytes += len(states) * CHANGE_BYTES
+
+        # undo the remaining turns newest first
+        while self.turns and self.turns[-1][0] > target:
+            number, changes = self.turns.pop()
+            self.used_bytes -= (len(changes) + 1) * CHANGE_BYTES
+            for ent, field, old, new in reversed(changes):
+                set_field(ent, field, old)
+                changed.add(ent)
+        for ent in changed:
+            self.last[ent] = capture(ent)
+        self.turn = target
+        return changed
@@ -0,0 +1,302 @@
+import heapq
+import time
+import numpy
+from graphical2 import pathing
+
+# Hierarchical pathfinding (HPA*), for routes across maps too big to search cell by cell every turn.
+#
+# The map is cut into square clusters (size cells across).  Wherever two clusters touch and there's a gap in the wall
+# between them, the gap becomes an entrance: a pair of nodes, one each side, one step apart (a long gap gets one at
+# each end).  Inside each cluster every node knows how far it is to the others in the same cluster, found with a
+# search that stays inside the cluster.  That's the abstract graph, and it's a lot smaller than the map.
+#
+# route() drops the start and goal into the graph for the moment (joined to the nodes of their clusters) and runs A*
+# over it, so a long route costs about the number of clusters it crosses instead of the number of cells.  Nothing gets
+# turned back into cells except the next leg, next_leg() does that with a normal search to the first waypoint, on a
+# blockmap that can have the actors in it so they get walked around.
+#
+# The graph only knows about the map (passable, [x, y], kept by reference so it sees changes).  When tiles change,
+# update() redoes the entrances and distances for the clusters the change touched and their neighbours, nothing else.
+# main2 has the tile layers call it (tilemap.watch).
+
+# gaps this wide or wider get an entrance at each end instead of one in the middle
+WIDE_ENTRANCE = 6
+
+
+def runs(open_cells):
+    # (start, end) of each stretch of True in a 1d array, end not included
+    edges = numpy.diff(numpy.concatenate(([0], open_cells.astype(numpy.int8), [0])))
+    return zip(numpy.flatnonzero(edges == 1).tolist(), numpy.flatnonzero(edges == -1).tolist())
+
+
+class hpa_map:
+    def __init__(self, passable, size=10):
+        self.passable = passable
+        self.size = size
+        self.width, self.height = passable.shape
+        self.columns = -(-self.width // size)
+        self.rows = -(-self.height // size)
+        self.graph = {}  # node -> {node: cost}
+        self.refs = {}  # node -> how many entrances made it (corners can be on two borders)
+        self.cluster_nodes = {}  # (cx, cy) -> set of nodes in it
+        self.border_pairs = {}  # ('v' or 'h', cx, cy) -> entrances that border made, (node, node across)
+        for cx in range(self.columns):
+            for cy in range(self.rows):
+                self.cluster_nodes[cx, cy] = set()
+        for cx in range(self.columns):
+            for cy in range(self.rows):
+                self.build_border('v', cx, cy)
+                self.build_border('h', cx, cy)
+        self.build_clusters(0, 0, self.columns - 1, self.rows - 1)
+
+    def cluster_of(self, cell):
+        return cell[0] // self.size, cell[1] // self.size
+
+    def bounds(self, cx, cy):
+        return cx * self.size, cy * self.size, min(self.width, (cx + 1) * self.size), \
+            min(self.height, (cy + 1) * self.size)
+
+    def add_node(self, cell):
+        if cell in self.refs:
+            self.refs[cell] += 1
+            return
+        self.refs[cell] = 1
+        self.graph[cell] = {}
+        self.cluster_nodes[self.cluster_of(cell)].add(cell)
+
+    def drop_node(self, cell):
+        self.refs[cell] -= 1
+        if self.refs[cell]:
+            return
+        del self.refs[cell]
+        for other in self.graph.pop(cell):
+            self.graph[other].pop(cell, None)
+        self.cluster_nodes[self.cluster_of(cell)].discard(cell)
+
+    def build_border(self, side, cx, cy):
+        # the entrances between (cx, cy) and the cluster right of it ('v') or below it ('h')
+        for a, b in self.border_pairs.pop((side, cx, cy), ()):
+            # a corner node can be an entrance on two borders, so this one's crossing goes first either way
+            self.graph[a].pop(b, None)
+            self.graph[b].pop(a, None)
+            self.drop_node(a)
+            self.drop_node(b)
+        x0, y0, x1, y1 = self.bounds(cx, cy)
+        if side == 'v':
+            if x1 >= self.width:
+                return
+            gaps = self.passable[x1 - 1, y0:y1] & self.passable[x1, y0:y1]
+            pairs = lambda i: ((x1 - 1, y0 + i), (x1, y0 + i))
+        else:
+            if y1 >= self.height:
+                return
+            gaps = self.passable[x0:x1, y1 - 1] & self.passable[x0:x1, y1]
+            pairs = lambda i: ((x0 + i, y1 - 1), (x0 + i, y1))
+        made = []
+        for start, end in runs(gaps):
+            if end - start >= WIDE_ENTRANCE:
+                spots = (start, end - 1)
+            else:
+                spots = ((start + end - 1) // 2,)
+            for i in spots:
+                a, b = pairs(i)
+                self.add_node(a)
+                self.add_node(b)
+                self.graph[a][b] = self.graph[b][a] = 1
+                made.append((a, b))
+        self.border_pairs[side, cx, cy] = made
+
+    def distances(self, start, cx, cy):
+        # breadth first from start without leaving cluster (cx, cy), cell -> steps
+        x0, y0, x1, y1 = self.bounds(cx, cy)
+        # indexing lists beats indexing numpy one cell at a time
+        inside = self.passable[x0:x1, y0:y1].tolist()
+        width, height = x1 - x0, y1 - y0
+        seen = {start: 0}
+        frontier = [start]
+        steps = 0
+        while frontier:
+            steps += 1
+            nxt = []
+            for x, y in frontier:
+                for dx, dy in pathing.NEIGHBOURS:
+                    lx, ly = x + dx - x0, y + dy - y0
+                    if 0 <= lx < width and 0 <= ly < height and inside[lx][ly]:
+                        cell = (x + dx, y + dy)
+                        if cell not in seen:
+                            seen[cell] = steps
+                            nxt.append(cell)
+            frontier = nxt
+        return seen
+
+    def build_clusters(self, cx0, cy0, cx1, cy1):
+        # how far each node is from the others in its cluster, going through the cluster, for clusters (cx0, cy0) to
+        # (cx1, cy1).  a breadth first search per node is a lot of python, so it's all of them at once in numpy:
+        # layer j has the j'th node of every cluster in it, and each step every layer spreads one cell, never
+        # across a cluster edge.
+        clusters = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+        nodes = {}
+        for cluster in clusters:
+            nodes[cluster] = sorted(self.cluster_nodes[cluster])
+            for node in nodes[cluster]:
+                links = self.graph[node]
+                for other in [other for other in links if self.cluster_of(other) == cluster]:
+                    del links[other]
+        layers = max(len(group) for group in nodes.values())
+        if layers < 2:
+            return
+        x0, y0 = cx0 * self.size, cy0 * self.size
+        x1, y1 = self.bounds(cx1, cy1)[2:]
+        passable = self.passable[x0:x1, y0:y1]
+        # which cells you can step between, (x, y) to (x + 1, y) and (x, y) to (x, y + 1)
+        same_x = (numpy.arange(x0, x1 - 1) // self.size) == (numpy.arange(x0 + 1, x1) // self.size)
+        same_y = (numpy.arange(y0, y1 - 1) // self.size) == (numpy.arange(y0 + 1, y1) // self.size)
+        across = passable[:-1, :] & passable[1:, :] & same_x[:, None]
+        down = passable[:, :-1] & passable[:, 1:] & same_y[None, :]
+        steps = numpy.full((layers,) + passable.shape, -1, dtype=numpy.int32)
+        frontier = numpy.zeros((layers,) + passable.shape, dtype=bool)
+        for group in nodes.values():
+            for j, (x, y) in enumerate(group):
+                frontier[j, x - x0, y - y0] = True
+        reached = frontier.copy()
+        steps[frontier] = 0
+        step = 0
+        while frontier.any():
+            step += 1
+            grown = numpy.zeros_like(frontier)
+            grown[:, 1:, :] |= frontier[:, :-1, :] & across
+            grown[:, :-1, :] |= frontier[:, 1:, :] & across
+            grown[:, :, 1:] |= frontier[:, :, :-1] & down
+            grown[:, :, :-1] |= frontier[:, :, 1:] & down
+            grown &= ~reached
+            reached |= grown
+            steps[grown] = step
+            frontier = grown
+        for group in nodes.values():
+            for j, node in enumerate(group):
+                links = self.graph[node]
+                for other in group:
+                    if other != node:
+                        far = int(steps[j, other[0] - x0, other[1] - y0])
+                        if far >= 0:
+                            links[other] = far
+
+    def update(self, x0, y0, x1, y1):
+        # tiles in [x0, x1) by [y0, y1) changed.  a change on the edge of a cluster can open or shut an entrance
+        # with the next one over, so the clusters either side of the rectangle get looked at too.
+        if x0 >= x1 or y0 >= y1:
+            return
+        cx0, cy0 = max(0, (x0 - 1) // self.size), max(0, (y0 - 1) // self.size)
+        cx1, cy1 = min(self.columns - 1, x1 // self.size), min(self.rows - 1, y1 // self.size)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self.build_border('v', cx, cy)
+                self.build_border('h', cx, cy)
+        # the clusters on the far side of a redone border have new nodes too
+        self.build_clusters(max(0, cx0 - 1), max(0, cy0 - 1), min(self.columns - 1, cx1 + 1),
+                            min(self.rows - 1, cy1 + 1))
+
+    def links(self, cell):
+        # cell joined to the nodes of its own cluster, for dropping the start or goal into the graph
+        cx, cy = self.cluster_of(cell)
+        seen = self.distances(cell, cx, cy)
+        return {node: seen[node] for node in self.cluster_nodes[cx, cy] if node in seen and node != cell}
+
+    def route(self, start, goal):
+        # waypoints from start to goal over the abstract graph, both included, or None if there's no way there
+        start, goal = tuple(start), tuple(goal)
+        if start == goal:
+            return [start]
+        start_links = self.links(start)
+        if start in self.graph:
+            # it's a node already, it can go across its border too
+            start_links.update(self.graph[start])
+        goal_links = self.links(goal)
+        if self.cluster_of(start) == self.cluster_of(goal):
+            # maybe it can just walk there without leaving the cluster
+            seen = self.distances(start, *self.cluster_of(start))
+            if goal in seen:
+                start_links[goal] = seen[goal]
+        graph = self.graph
+        gx, gy = goal
+        cost = {start: 0}
+        came_from = {start: None}
+        counter = 0
+        # same as pathing.path_search, ties go to whichever is closer to the goal
+        left = abs(start[0] - gx) + abs(start[1] - gy)
+        open_list = [(left, left, counter, start)]
+        while open_list:
+            estimate, left, order, node = heapq.heappop(open_list)
+            so_far = estimate - left
+            if so_far > cost[node]:
+                continue
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = came_from[node]
+                path.reverse()
+                return path
+            if node == start:
+                links = start_links.items()
+            else:
+                links = graph[node].items()
+                if node in goal_links:
+                    links = list(links) + [(goal, goal_links[node])]
+            for nxt, step in links:
+                new_cost = so_far + step
+                if new_cost < cost.get(nxt, new_cost + 1):
+                    cost[nxt] = new_cost
+                    came_from[nxt] = node
+                    counter += 1
+                    left = abs(nxt[0] - gx) + abs(nxt[1] - gy)
+                    heapq.heappush(open_list, (new_cost + left, left, counter, nxt))
+        return None
+
+    def next_leg(self, route, blocked=None):
+        # the cells from the start of route to its first waypoint, or None if it can't get there.  blocked is a
+        # blockmap like main2.build_blockmap makes (actors in it), waypoints someone is standing on get skipped.
+        # without one it's just the walls.
+        if route is None or len(route) < 2:
+            return None
+        start = route[0]
+        if blocked is None:
+            blocked = ~self.passable
+        for target in route[1:]:
+            if target == route[-1] or not blocked[target]:
+                break
+        search = pathing.path_search(blocked, start, target)
+        # waypoints are a cluster or so apart, if the leg takes more than this the crowd's in the way
+        search.step(self.size * self.size * 4)
+        return search.path()
+
+
+if __name__ == '__main__':
+    # a long route on a big map, against searching the whole thing
+    #   python -m graphical2.hpa
+    rng = numpy.random.default_rng(0)
+    size = 400
+    passable = numpy.ones((size, size), dtype=bool)
+    # walls every 20 cells with gaps in them
+    for i in range(10, size, 20):
+        passable[i, :] = False
+        passable[:, i] = False
+    for i in range(10, size, 20):
+        for gap in rng.choice(size, size // 3, replace=False):
+            passable[i, gap] = True
+            passable[gap, i] = True
+    start = time.perf_counter()
+    world = hpa_map(passable, 10)
+    print("build: %d nodes, %.1f ms" % (len(world.graph), (time.perf_counter() - start) * 1000))
+    a, b = (1, 1), (size - 2, size - 2)
+    start = time.perf_counter()
+    route = world.route(a, b)
+    leg = world.next_leg(route)
+    print("route + next leg: %d waypoints, %.2f ms" % (len(route), (time.perf_counter() - start) * 1000))
+    start = time.perf_counter()
+    path = pathing.find_path(~passable, a, b)
+    print("find_path: %d cells, %.2f ms" % (len(path), (time.perf_counter() - start) * 1000))
+    start = time.perf_counter()
+    passable[15, 5] = False
+    world.update(15, 5, 16, 6)
+    print("one tile changed: %.2f ms" % ((time.perf_counter() - start) * 1000))
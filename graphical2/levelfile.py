@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import numpy
+from graphical2 import config
+from graphical2 import ecs
+from graphical2 import tilemap
+from graphical2.prefabs import PREFABS
+
+# Levels written by hand instead of made by a generator like map1gen.  A level is a json file:
+#
+#   {
+#    "legend": {"#": ["T_WALL", false], ".": ["T_FLOOR", true], "T": ["T_TRAPDOOR", true]},
+#    "map": ["#####",
+#            "#...#",
+#            "#.T.#",
+#            "#####"],
+#    "player": {"kind": "adventurer", "x": 1, "y": 1},
+#    "entities": [{"kind": "crab", "x": 3, "y": 1}, {"kind": "skaven", "x": 1, "y": 2, "name": "Pipi's cousin"}]
+#   }
+#
+# Each map row is one y, left to right is x.  The legend says what terrain (a T_ name from config) and whether it
+# can be walked on for each character, a space is void unless the legend says otherwise, and short rows get padded
+# with void.  Entities are prefab kinds (see prefabs.json) with a position and an optional name.
+#
+# Parsing a big map out of json is slow, so the first load compiles the level: the tile layers go in .npy files in a
+# folder under the cache, same as tilemap's memmap layers, and the entities go in a table next to them.  The folder
+# is named after a hash of the level file, so any edit to it makes a new one (and the old one gets cleared out).
+# After that a load just opens the memmaps, nothing gets parsed and pages only get read as the game touches them, so
+# big levels don't take any longer to start than small ones.  The hash is only worked out again if the file's size or
+# modified time changed since last time (kept in the cache's stamps.json).
+#
+# The layers are opened copy on write, so exploring or digging in the game never changes the compiled level.
+
+# bump this when what compile_level writes changes, so old caches don't get used
+FORMAT = 1
+
+ENTITY_FILE = "entities.npy"
+# level file -> [size, modified time, key], so an untouched file doesn't even need hashing
+STAMP_FILE = "stamps.json"
+
+
+def source_key(path):
+    digest = hashlib.sha1(b"%d\n" % FORMAT)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def stamp(path):
+    info = os.stat(path)
+    return [info.st_size, info.st_mtime_ns]
+
+
+def read_stamps(cache):
+    try:
+        with open(os.path.join(cache, STAMP_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_stamps(cache, stamps):
+    # same trick as the level folders, a whole new file moved into place
+    scratch = os.path.join(cache, "%s.%d.tmp" % (STAMP_FILE, os.getpid()))
+    with open(scratch, "w") as f:
+        json.dump(stamps, f)
+    os.replace(scratch, os.path.join(cache, STAMP_FILE))
+
+
+def cache_folder(path, key, cache):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache, "%s-%s" % (name, key))
+
+
+def terrain_id(name, path):
+    value = getattr(config, name, None) if name.startswith("T_") else None
+    if not isinstance(value, int):
+        raise ValueError("%s: no terrain called %s in config" % (path, name))
+    return value
+
+
+def parse_grid(rows, legend, path):
+    # the map rows as (terrain, passable) arrays indexed [x, y], with lookup tables over the characters instead of
+    # going cell by cell
+    width = max((len(row) for row in rows), default=0)
+    if not width:
+        raise ValueError("%s: the map is empty" % path)
+    try:
+        text = "".join(row.ljust(width) for row in rows).encode("ascii")
+    except UnicodeEncodeError:
+        raise ValueError("%s: map characters have to be plain ascii" % path) from None
+    chars = numpy.frombuffer(text, dtype=numpy.uint8).reshape(len(rows), width).T
+    known = numpy.zeros(256, dtype=bool)
+    terrain = numpy.zeros(256, dtype=numpy.uint8)
+    passable = numpy.zeros(256, dtype=bool)
+    known[ord(" ")] = True  # void, blocked
+    for char, entry in legend.items():
+        if len(char) != 1 or ord(char) > 127:
+            raise ValueError("%s: legend keys have to be single ascii characters, not %r" % (path, char))
+        try:
+            name, walkable = entry
+        except (TypeError, ValueError):
+            raise ValueError("%s: legend %r should be [terrain, passable], not %r" % (path, char, entry)) from None
+        known[ord(char)] = True
+        terrain[ord(char)] = terrain_id(name, path)
+        passable[ord(char)] = walkable
+    unknown = numpy.unique(chars[~known[chars]])
+    if len(unknown):
+        raise ValueError("%s: %r in the map but not in the legend" % (path, "".join(map(chr, unknown))))
+    return terrain[chars], passable[chars]
+
+
+def entity_table(level, width, height, path):
+    # the player first, then everything else
+    if "player" not in level:
+        raise ValueError("%s: there's no player" % path)
+    listed = [level["player"]] + list(level.get("entities", ()))
+    rows = []
+    for spec in listed:
+        try:
+            kind, x, y = spec["kind"], int(spec["x"]), int(spec["y"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("%s: entities need a kind, x and y, not %r" % (path, spec)) from None
+        if kind not in PREFABS.prefabs:
+            raise ValueError("%s: no prefab called %s" % (path, kind))
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError("%s: %s at %d, %d is off the map" % (path, kind, x, y))
+        rows.append((kind, spec.get("name", ""), x, y))
+    longest = lambda i: max(1, max(len(row[i]) for row in rows))
+    dtype = [('kind', 'U%d' % longest(0)), ('name', 'U%d' % longest(1)), ('x', numpy.int32), ('y', numpy.int32)]
+    return numpy.array(rows, dtype=dtype)
+
+
+def compile_level(path, folder):
+    # parses the level and writes it to folder
+    try:
+        with open(path, "rb") as f:
+            level = json.load(f)
+        rows, legend = level["map"], level["legend"]
+    except ValueError as error:
+        raise ValueError("%s: %s" % (path, error)) from None
+    except KeyError as error:
+        raise ValueError("%s: missing %s" % (path, error)) from None
+    terrain, passable = parse_grid(rows, legend, path)
+    width, height = terrain.shape
+    entities = entity_table(level, width, height, path)
+    # written to a folder of its own first, so nothing ever opens half a level, then moved into place
+    scratch = "%s.%d.tmp" % (folder, os.getpid())
+    tiles = tilemap.new_layers(width, height, scratch)
+    tiles.terrain[:] = terrain
+    tiles.passable[:] = passable
+    tiles.flush()
+    del tiles
+    numpy.save(os.path.join(scratch, ENTITY_FILE), entities)
+    try:
+        os.rename(scratch, folder)
+    except OSError:
+        # someone else compiled it at the same time, theirs is just as good
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def clear_old(path, folder, cache):
+    # other compiles of the same level file, from before it was edited
+    name = os.path.splitext(os.path.basename(path))[0] + "-"
+    for entry in os.listdir(cache):
+        old = os.path.join(cache, entry)
+        if entry.startswith(name) and old != folder and not entry.endswith(".tmp") and len(entry) == len(name) + 16:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def compiled(path, cache):
+    # the cache folder for path, compiling it first if it isn't there yet
+    stamps = read_stamps(cache)
+    known = stamps.get(os.path.abspath(path))
+    now = stamp(path)
+    if known and known[:2] == now:
+        folder = cache_folder(path, known[2], cache)
+        if os.path.isdir(folder):
+            return folder
+    key = source_key(path)
+    folder = cache_folder(path, key, cache)
+    if not os.path.isdir(folder):
+        os.makedirs(cache, exist_ok=True)
+        compile_level(path, folder)
+        clear_old(path, folder, cache)
+    stamps[os.path.abspath(path)] = now + [key]
+    write_stamps(cache, stamps)
+    return folder
+
+
+# same as map1gen.map_1_generate, but from a level file
+def load_level(path, cache=None):
+    folder = compiled(path, cache or config.LEVEL_CACHE)
+    tiles = tilemap.open_layers(folder, mode='c')
+    entities = numpy.load(os.path.join(folder, ENTITY_FILE), mmap_mode='r')
+    ecs.new_level(tiles.width, tiles.height)
+    actors = [PREFABS.spawn(str(kind), int(x), int(y), str(name) or None)
+              for kind, name, x, y in entities.tolist()]
+    selected = actors[0]
+    return actors, [], selected, tiles
+
+
+# compile levels ahead of time, or see how long loading takes as they get bigger
+#   python -m graphical2.levelfile levels/first_room.json
+#   python -m graphical2.levelfile --timing
+if __name__ == '__main__':
+    if sys.argv[1:] != ['--timing']:
+        for level_path in sys.argv[1:]:
+            print(level_path, "->", compiled(level_path, config.LEVEL_CACHE))
+        sys.exit()
+    import tempfile
+    rng = numpy.random.default_rng(0)
+    scratch_dir = tempfile.mkdtemp()
+    for size in (50, 500, 2000):
+        grid = numpy.where(rng.random((size, size)) < 0.3, "#", ".")
+        grid[:, 0] = grid[:, -1] = grid[0] = grid[-1] = "#"
+        grid[1, 1] = "."
+        level_path = os.path.join(scratch_dir, "cave%d.json" % size)
+        with open(level_path, "w") as f:
+            json.dump({"legend": {"#": ["T_WALL", False], ".": ["T_FLOOR", True]},
+                       "map": ["".join(row) for row in grid],
+                       "player": {"kind": "adventurer", "x": 1, "y": 1},
+                       "entities": [{"kind": "crab", "x": int(x), "y": int(y)}
+                                    for x, y in rng.integers(1, size - 1, (size // 5, 2))]}, f)
+        cache_dir = os.path.join(scratch_dir, "cache")
+        start = time.perf_counter()
+        load_level(level_path, cache_dir)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(20):
+            load_level(level_path, cache_dir)
+        again = (time.perf_counter() - start) / 20
+        print("%dx%d, %d entities: first load %.1f ms, after that %.2f ms" % (size, size, size // 5 + 1,
+                                                                              first * 1000, again * 1000))
+    shutil.rmtree(scratch_dir)
@@ -7,7 +7,20 @@ import tcod
 import time
 import random
 import numpy
-from graphical2 import astar_1
+from graphical2 import pathing
+from graphical2 import hpa
+from graphical2 import scheduler
+from graphical2 import speculate
+from graphical2 import history
+from graphical2 import events
+from graphical2 import combat
+from graphical2 import ecs
+from graphical2 import profiler
+from graphical2 import minimap
+from graphical2 import autotile
+from graphical2 import levelfile
+from graphical2.objects import obj_entity, com_health, com_sprite, com_inventory, com_item, com_attack, \
+    com_special, com_ondeath, entity_index
 
 # Things that are too annoying to fix right now but should be incorporated in v3:
 # SMART SPRITES(tm) - no need for annoying prams for every single little thing.
@@ -20,8 +33,8 @@ from graphical2 import astar_1
 # quality of life / fun
 # TODO smart object layering (Slicing)
 # I just decided to go max spaghetti on this one, I can optimize later.
-# TODO some type of dictionary were we can summon pre-constructed items
-# TODO Ranged weapons
+# DONE some type of dictionary were we can summon pre-constructed items (prefabs.py)
+# DONE Ranged weapons (right click, shift for a fireball, see combat.py)
 # TODO better attack system
 # DONE find out if its faster to make the sorting thing change the thing.  It's not but i did it anyway.
 
@@ -32,7 +45,9 @@ from graphical2 import astar_1
 # DONE turn system
 
 
-global ACTORS, PROPS, SELECTED, RUN_GAME, SURFACE_MAIN, FONTS, TIMESINCE, start_time, PARTICLES, DEBUG, STATE
+global ACTORS, PROPS, TILES, SELECTED, RUN_GAME, SURFACE_MAIN, FONTS, TIMESINCE, start_time, PARTICLES, DEBUG, STATE, \
+    HISTORY, TOUCHED, INDEX, LOG, PROFILER, OVERLAY, RNG, AI, SPECULATION, PATHS, HPA, MINIMAP, VARIANTS, \
+    TILE_SPRITES, STORE, DAMAGE
 
 
 # keyboard inputs
@@ -59,6 +74,12 @@ def get_inputs():
             # debug/fps menu
             if event.key == pygame.K_F1:
                 DEBUG["showfps"] = not (DEBUG["showfps"])
+            # overview map
+            if event.key == pygame.K_m:
+                STATE['minimap'] = not STATE['minimap']
+            # undo the last turn
+            if event.key == pygame.K_u:
+                rewind_turns(1)
 
             if event.key == pygame.K_UP:
                 STATE['camera pos'] = (STATE['camera pos'][0], STATE['camera pos'][1] + 32)
@@ -77,9 +98,15 @@ def get_inputs():
             # print(event.button)
             # if (pygame.mouse.get_pressed() == 1):
             xm, ym = pygame.mouse.get_pos()
-            itemsfound = query_click_location(xm, ym)
-            for thing in itemsfound:
-                print(thing.type)
+            if event.button == 3:
+                # right click shoots at it, with shift it's a fireball
+                cposx, cposy = STATE['camera pos']
+                blast = config.FIREBALL_RADIUS if pygame.key.get_mods() & pygame.KMOD_SHIFT else 0
+                ranged_attack((xm - cposx) // config.CELL_WIDTH, (ym - cposy) // config.CELL_HEIGHT, blast)
+            else:
+                itemsfound = query_click_location(xm, ym)
+                for thing in itemsfound:
+                    events.BUS.emit(events.EV_SELECT, thing.type)
             # print(xm, ym)
 
 
@@ -87,133 +114,7 @@ def get_inputs():
 #                                           OBJECT CONTROL
 ###############################################################################################################
 
-# actors
-# game objects need x, y, type, health, inventory,
-class obj_entity:
-    def __init__(self, x, y, objtype, sprite, blockpath=False, health=None, inventory=None, ondeath=None, attack=None,
-                 ai_persona="none", special=None):
-        # moving and location
-        self.x = x
-        self.y = y
-        self.dx = 0
-        self.dy = 0
-
-        # object type
-        self.type = objtype
-        self.blockpath = blockpath
-        self.ai_persona = ai_persona
-
-        # Question: what the heck is up with that retarded "self.owner" stuff?
-        # Answer: it's a workaround, python doesn't have a proper "parent" reference.  We need to get stuff from other
-        # components, so that's the work around.
-
-        # sprite and drawing
-        self.sprite = sprite
-        if self.sprite:
-            self.sprite.owner = self
-
-        # health
-        self.health = health
-        if self.health:
-            self.health.owner = self
-
-        self.attack = attack
-        if self.attack:
-            self.attack.owner = self
-
-        # inventory
-        self.inventory = inventory
-        if self.inventory:
-            self.inventory.owner = self
-
-        self.ondeath = ondeath
-        if self.ondeath:
-            self.ondeath.owner = self
-
-        self.special = special
-        if self.ondeath:
-            self.ondeath.owner = self
-
-
-###########################
-#### OBJECT COMPONENTS ####
-###########################
-
-
-# controls an object's health
-class com_health:
-    def __init__(self, hp, maxhp=None):
-        self.owner = None
-        self.hp = hp
-        self.dead = False  # allows you to know if you're dead
-        if maxhp == None:
-            self.maxhp = hp
-        else:
-            self.maxhp = maxhp
-
-
-# controls drawing and stuff
-class com_sprite:
-    def __init__(self, img, spriteoffsetx=0, spriteoffsety=0, layering=0):
-        self.img = img
-        self.spriteoffsetx = spriteoffsetx
-        self.spriteoffsety = spriteoffsety
-        self.layering = layering  # IMPORTANT! Higher numbers makes it go down, not up!
-        self.owner = None
-
-    def drawself(self, surf, offset_x, offset_y):
-        surf.blit(self.img, (
-            (self.owner.x * config.CELL_WIDTH) + (self.spriteoffsetx * config.CELL_WIDTH) + offset_x,
-            (self.owner.y * config.CELL_HEIGHT) + (self.spriteoffsety * config.CELL_HEIGHT) + offset_y))
-
-
-# things have inventories
-class com_inventory:
-    def __init__(self):
-        self.owner = None
-
-
-# some objects can be picked up and used as weapons.
-class com_item:
-    def __init__(self):
-        self.owner = None
-
-
-class com_attack:
-    def __init__(self, attackdamage):
-        self.owner = None
-        self.attackdamage = attackdamage
-
-
-class com_special:
-    def __init__(self, special_data):
-        self.owner = None
-        self.data = special_data
-
-
-###########################
-#### SPECIAL FUNCTIONS ####
-###########################
-
-
-class com_ondeath:
-    def __init__(self, deathimg=None, spriteoffsetx=0, spriteoffsety=0, blockafterdeath=False):
-        self.owner = None
-        self.deathimg = deathimg
-        self.blockafterdeath = blockafterdeath
-        self.spriteoffsetx = spriteoffsetx
-        self.spriteoffsety = spriteoffsety
-
-    def die(self):
-        global PROPS, ACTORS
-        self.owner.sprite.img = self.deathimg
-        self.owner.blockpath = self.blockafterdeath
-        self.owner.sprite.layering = 2
-        self.owner.sprite.spriteoffsetx = self.spriteoffsetx
-        self.owner.sprite.spriteoffsety = self.spriteoffsety
-        self.owner.ai_persona = "none"
-        self.owner.health.dead = True
-        print(self.owner.type, 'Died!')
+# obj_entity and the com_ components live in objects.py
 
 
 ###########################
@@ -221,6 +122,8 @@ class com_ondeath:
 ###########################
 
 class particle:
+    __slots__ = ('sprite', 'lifetime', 'x', 'y', 'dx', 'dy', 'ticks_until_move_x', 'ticks_until_move_y', 'speed_decay')
+
     def __init__(self, sprite, lifetime, x, y, dx=1, dy=1, speed_decay=1):
         self.sprite = sprite
         self.lifetime = lifetime
@@ -275,6 +178,23 @@ def process_particles():
             PARTICLES.remove(par)
 
 
+# the player sees what's around them, and the minimap gets told which bit that was
+def explore(x, y):
+    radius = config.EXPLORE_RADIUS
+    TILES.mark_explored(x, y, radius)
+    MINIMAP.mark(*TILES.clip(x - radius, y - radius, x + radius + 1, y + radius + 1))
+
+
+# where everyone is, for the minimap
+def place_dots():
+    count = len(ACTORS)
+    xs = numpy.fromiter((ent.x for ent in ACTORS), dtype=numpy.int64, count=count)
+    ys = numpy.fromiter((ent.y for ent in ACTORS), dtype=numpy.int64, count=count)
+    codes = numpy.fromiter((minimap.PLAYER if ent is SELECTED else minimap.ACTOR for ent in ACTORS),
+                           dtype=numpy.uint8, count=count)
+    MINIMAP.place(xs, ys, codes)
+
+
 def pos_to_abs(x, y):
     # converts grid chords to screen chords
     abs_x = (x * config.CELL_WIDTH) + (config.CELL_WIDTH / 2)
@@ -288,20 +208,22 @@ def query_click_location(x, y, actors=True, props=True):
     # Question:  Why is camera subtracted?  Answer:  Because the top left corner is 0,0
     xl = ((x - cposx) // config.CELL_WIDTH)
     yl = ((y - cposy) // config.CELL_HEIGHT)
-    print(xl, yl)
-    # The object must be BOTH at the same x and y values, AND be blocking
-    # break out because multiple blocks is redundant.
-    if actors:
-        for obj in ACTORS:
-            if (obj.x == xl) and (obj.y == yl):
-                found += [obj]
+    events.BUS.emit(events.EV_CLICK, xl, yl)
+    found += entities_at(xl, yl, actors, props)
+    return found
 
-    if props:
-        for obj in PROPS:
-            if (obj.x == xl) and (obj.y == yl):
-                found += [obj]
 
-    return found
+# everything standing on x, y, actors first then props.  goes by the store's columns (see ecs.py) instead of asking
+# every entity where it is
+def entities_at(x, y, actors=True, props=True):
+    count = STORE.count
+    ids = numpy.flatnonzero((STORE.x[:count] == x) & (STORE.y[:count] == y) & STORE.used[:count])
+    if not len(ids):
+        return []
+    here = [STORE.entity(i) for i in ids.tolist()]
+    in_props = [ent in PROPS for ent in here]
+    return [ent for ent, prop in zip(here, in_props) if actors and not prop] + \
+           [ent for ent, prop in zip(here, in_props) if props and prop]
 
 
 # functions for stuff
@@ -309,24 +231,19 @@ def query_object(x, y, actors=True, props=True, breakonblock=False):
     # set block to false
     block = False
     found = []
+    # walls and such live in the tile layers, not in PROPS
+    if not TILES.is_passable(x, y):
+        block = True
+        if breakonblock:
+            return block, found
     # The object must be BOTH at the same x and y values, AND be blocking
     # break out because multiple blocks is redundant.
-    if actors:
-        for obj in ACTORS:
-            if (obj.x == x) and (obj.y == y):
-                found += [obj]
-                if obj.blockpath:
-                    block = True
-                    if breakonblock:
-                        break
-    if props:
-        for obj in PROPS:
-            if (obj.x == x) and (obj.y == y):
-                found += [obj]
-                if obj.blockpath:
-                    block = True
-                    if breakonblock:
-                        break
+    for obj in entities_at(x, y, actors, props):
+        found += [obj]
+        if obj.blockpath:
+            block = True
+            if breakonblock:
+                break
     return block, found
 
 
@@ -341,42 +258,182 @@ def tick_objects():
 
 #    AI programs!
 
+# walls and everything that blocks except ai itself, as 1s in a float array [x, y].  what blocks comes straight
+# from the store's occupancy (see ecs.py)
+def build_blockmap(ai):
+    blockmap = numpy.logical_not(TILES.passable).astype(float)
+    blockmap[STORE.occupancy >= 0] = 1
+    # unless something else is stood there with it
+    if ai is not None and ai.blockpath and STORE.stacked[ai.x, ai.y] == 1:
+        blockmap[ai.x, ai.y] = not TILES.passable[ai.x, ai.y]
+    return blockmap
+
+
+# (priority, job) for everything that has to think this turn, closest to the player goes first (see scheduler.py)
+def ai_jobs(blocked):
+    # only the things that actually think, not every crab, trapdoor and corpse (see entity_index in objects.py)
+    jobs = []
+    for ai in INDEX.with_persona("dumb_attack"):
+        jobs.append((abs(ai.x - SELECTED.x) + abs(ai.y - SELECTED.y), chase(ai, blocked)))
+    return jobs
+
+
+####  Astar movment, just always attacks without any thinking
+def chase(ai, blocked):
+    # attacks directly at the player.  most turns it just carries on along the path it had (see path_cache in
+    # pathing.py).  from far away it goes by the cluster map and only works out the next leg (see hpa.py).
+    # otherwise the search goes a slice at a time so it can be spread over frames, and if the scheduler says hurry
+    # it takes the best path so far.  gives back (ai, the cell it should step to or None)
+    start, goal = (ai.x, ai.y), (SELECTED.x, SELECTED.y)
+    step = PATHS.follow(ai, start, goal, blocked)
+    if step is not None:
+        return ai, step
+    if abs(goal[0] - start[0]) + abs(goal[1] - start[1]) > config.HPA_DISTANCE:
+        route = HPA.route(start, goal)
+        if route is None:
+            # walls all the way, no point searching
+            return ai, None
+        leg = HPA.next_leg(route, blocked)
+        if leg and len(leg) > 1:
+            return ai, PATHS.store(ai, leg, leg=True)
+    # its own cell is blocked in there too, that doesn't matter to the search
+    search = pathing.path_search(blocked, start, goal)
+    while not search.step(config.AI_SLICE):
+        hurry = yield
+        if hurry:
+            break
+    if search.found:
+        return ai, PATHS.store(ai, search.path())
+    path = search.best_path()
+    return ai, path[1] if len(path) > 1 else None
+
+
+def start_ai_turn():
+    # one blockmap for everyone, nothing moves until they've all decided
+    AI.start(ai_jobs(build_blockmap(None)))
+
+
+def finish_ai_turn():
+    # every decision is in, now they all get their moves
+    for ai, step in AI.results:
+        if step:
+            ai.dx, ai.dy = step[0] - ai.x, step[1] - ai.y
+    AI.results = []
+    # the random ones all go at once
+    wander(STORE.with_persona("random"))
+
+
+# plans the enemy turn on a worker thread for each cell the player might end up on, while they make up their mind
+# (see speculate.py).  the worker gets copies, the blockmap without the player and where each chaser is.
+def speculate_ai_turn():
+    if not config.AI_SPECULATE:
+        return
+    blocked = build_blockmap(SELECTED)
+    chasers = [(ai, ai.x, ai.y) for ai in INDEX.with_persona("dumb_attack")]
+    px, py = SELECTED.x, SELECTED.y
+    # staying put (attacking, shooting) and the four moves that aren't blocked
+    cells = [(px, py)]
+    for dx, dy in pathing.NEIGHBOURS:
+        x, y = px + dx, py + dy
+        if 0 <= x < TILES.width and 0 <= y < TILES.height and not blocked[x, y]:
+            cells.append((x, y))
+
+    def plan(cell, stale):
+        # same as the chase jobs would get, just done all at once and with the player on cell
+        blockmap = blocked.copy()
+        blockmap[cell] = 1
+        results = []
+        for ai, x, y in chasers:
+            if stale():
+                return None
+            results.append((ai, pathing.find_path(blockmap, (x, y), cell)))
+        return results
+    SPECULATION.start((blocked, chasers), cells, plan)
+
+
+# the plan the worker made for where the player is now, or None if it isn't done or anything changed apart from
+# the player moving (something died, got shot, a rewind...)
+def speculated_ai_turn():
+    world = SPECULATION.world
+    if world is None:
+        return None
+    blocked, chasers = world
+    if [(ai, ai.x, ai.y) for ai in INDEX.with_persona("dumb_attack")] != chasers or \
+            not numpy.array_equal(build_blockmap(SELECTED), blocked):
+        SPECULATION.cancel()
+        return None
+    return SPECULATION.take((SELECTED.x, SELECTED.y))
+
+
+# the whole enemy turn in one go, no matter how long it takes
 def ai_moves():
-    global ACTORS
-    for ai in ACTORS:
-        if ai.ai_persona == "random":
-            # so this chooses a random direction and avoids moving diagonally.
-            if random.randint(0, 2):
-                ai.dx = random.randint(-1, 1)
-            else:
-                ai.dy = random.randint(-1, 1)
-            #
-        ####  Astar movment, just always attacks without any thinking
-        if ai.ai_persona == "dumb_attack":
-            # attacks directly at the player.
-            blockmap = numpy.zeros((config.MAP_1_GEN_SIZE[0], config.MAP_1_GEN_SIZE[1]))
-            for ent in ACTORS:
-                if ent.blockpath and ent != ai:
-                    blockmap[ent.x, ent.y] = 1
-            for ent in PROPS:
-                if ent.blockpath and ent != ai:
-                    blockmap[ent.x, ent.y] = 1
-            blockmap.astype(int)
-            blockmap2 = blockmap.astype(int).tolist()
-            # Wow!  Coding this was a horrible experience
-            astar = astar_1.Astar(blockmap)
-            result = astar.run((ai.x, ai.y), (SELECTED.x, SELECTED.y))
-            ai.dx, ai.dy = result[1][0] - ai.x, result[1][1] - ai.y
+    start_ai_turn()
+    AI.run(float('inf'))
+    finish_ai_turn()
+
+
+# the random persona for a whole crowd in one go.  Instead of a few random.randint calls and a query_object per
+# critter, every direction gets drawn at once and checked against the store's occupancy in one numpy step, and the
+# ones that can go are moved in one go too (see ecs.py).  If two want the same cell the first one gets it and the
+# other stays put.  Ones that walk into something and can fight keep their dx/dy so move_objects does the attack like
+# always, the rest just stay where they are.  ids are rows in the store, the entities only get looked up for the ones
+# that actually moved.
+def wander(ids):
+    if not len(ids):
+        return
+    count = len(ids)
+    xs = STORE.x[ids].astype(numpy.int64)
+    ys = STORE.y[ids].astype(numpy.int64)
+    # so this chooses a random direction and avoids moving diagonally, two in three go along x.
+    steps = RNG.integers(-1, 2, count)
+    along_x = RNG.integers(0, 3, count) > 0
+    dxs = numpy.where(along_x, steps, 0)
+    dys = numpy.where(along_x, 0, steps)
+    tx, ty = xs + dxs, ys + dys
+    moving = numpy.flatnonzero((steps != 0) & (tx >= 0) & (tx < TILES.width) & (ty >= 0) & (ty < TILES.height))
+    occupant = STORE.occupancy[tx[moving], ty[moving]]
+    free = TILES.passable[tx[moving], ty[moving]] & (occupant < 0)
+    picks = moving[free]
+    picks = picks[numpy.unique(tx[picks] * TILES.height + ty[picks], return_index=True)[1]]
+    STORE.place_many(ids[picks], tx[picks], ty[picks])
+    # the bookkeeping goes for the whole crowd in one go: it's all in the turn's history, paths over the cells a
+    # blocker stepped onto are no good now (same as blocking_change), and one event says how many went
+    moved = [STORE.entity(ent) for ent in ids[picks].tolist()]
+    TOUCHED.update(moved)
+    blocking = STORE.blockpath[ids[picks]] & (ids[picks] != SELECTED.id)
+    if blocking.any():
+        which = numpy.flatnonzero(blocking)
+        PATHS.blocked_many(tx[picks][which], ty[picks][which], [moved[i] for i in which.tolist()])
+    if len(picks):
+        events.BUS.emit(events.EV_WANDER, len(picks))
+    bumped = moving[occupant >= 0]
+    bumped = bumped[STORE.attack[ids[bumped]] > 0]
+    STORE.dx[ids[bumped]] = dxs[bumped]
+    STORE.dy[ids[bumped]] = dys[bumped]
+    # the draw order only cares about y, and move_objects sorts once for everybody who moved this turn
+    if dys[picks].any():
+        STATE['resort'] = True
 
 
 def move_objects():  #### MOVING AND ATTACKING ####
     global ACTORS, STATE, PROPS
     recalc = False
+    # who wants to go somewhere, straight from the store's dx/dy columns.  most frames that's nobody, and asking
+    # each actor in turn costs more than the whole check
+    count = STORE.count
+    moving = set(numpy.flatnonzero(STORE.dx[:count] | STORE.dy[:count]).tolist())
+    if not moving:
+        if STATE['resort']:
+            ACTORS = sort_objects(ACTORS)
+            STATE['resort'] = False
+        return
     for act in ACTORS:
         # if either one changes
-        if (act.dx != 0) or (act.dy != 0):
+        if act.id in moving:
             # Something moved, recalculate sprite layering
             recalc = True
+            # remember it for the turn history
+            TOUCHED.add(act)
             # make note of where it should go
             x, y = act.dx + act.x, act.dy + act.y
             # print(x, y)
@@ -384,8 +441,9 @@ def move_objects():  #### MOVING AND ATTACKING ####
             block, objects_found = query_object(x, y)
             if not block:
                 # move there
-                act.x = x
-                act.y = y
+                act.place(x, y)
+                blocking_change(act)
+                events.BUS.emit(events.EV_MOVE, act.type, x, y)
             else:
                 # we got something
                 for objf in objects_found:
@@ -393,28 +451,110 @@ def move_objects():  #### MOVING AND ATTACKING ####
                         # health checks that it's attackable, act.attack checks if the thing moving can attack, and
                         # not(objf.health.dead) checks if the object is already dead!  This was a problem because
                         # I was having problems with death functions running multiple times.
-                        # I could change it to only check actors, but the divide is for performance reasons.
+                        # The damage goes in the batch with everything else hit this go, it lands (and things die)
+                        # once the player or the enemies are done, see resolve_damage.
                         create_particles(objf.x, objf.y, 7, "spark")  # attack sparks!
-                        print(act.type, "(", act.health.hp, "hp)", "attacks", objf.type, "(", objf.health.hp, "hp)")
-                        objf.health.hp -= act.attack.attackdamage
-                        if objf.ondeath and objf.health.hp <= 0:  # the attack killed him
-                            objf.ondeath.die()
-                            if objf in ACTORS:
-                                ACTORS.remove(objf)
-                            PROPS += [objf]
+                        events.BUS.emit(events.EV_ATTACK, act.type, act.health.hp, objf.type, objf.health.hp)
+                        DAMAGE.add([objf.id], act.attack.attackdamage)
+                        TOUCHED.add(objf)
             if act == SELECTED:
-                print('action: player moved')
+                explore(act.x, act.y)
                 STATE['player action'] = True
 
             # either way, set our desired move back to zero
             act.dx, act.dy = 0, 0
-    if recalc:
+    if recalc or STATE['resort']:
         ACTORS = sort_objects(ACTORS)
+        STATE['resort'] = False
+
+
+# something that blocks just stepped onto a cell, so any kept path over it is no good now (see path_cache in
+# pathing.py).  the player is everyone's goal, that gets handled when the paths are followed.
+def blocking_change(ent):
+    if ent.blockpath and ent is not SELECTED:
+        PATHS.blocked((ent.x, ent.y), ent)
+
+
+# everything in ents dies and goes over to PROPS
+def kill(ents):
+    global ACTORS, PROPS
+    for ent in ents:
+        ent.ondeath.die(ent)
+        INDEX.died(ent)
+        PATHS.forget(ent)
+        # corpses that block are there for good
+        if ent.blockpath:
+            PATHS.blocked((ent.x, ent.y))
+    dead = set(ents)
+    ACTORS = [ent for ent in ACTORS if ent not in dead]
+    PROPS += ents
+
+
+# the player shoots at x, y.  a bolt hits the first thing in the way, with blast it blows up there and hurts
+# everything around it.  it all goes in the turn's damage batch like a melee hit (see combat.py), the store's
+# occupancy says who's standing where
+def ranged_attack(x, y, blast=0):
+    grid = STORE.occupancy
+    hit, ex, ey = combat.trace(TILES.passable, grid, SELECTED.x, SELECTED.y, x, y, config.RANGED_REACH)
+    if blast:
+        targets, damage = combat.gather_radius(grid, ex, ey, blast), config.FIREBALL_DAMAGE
+        create_particles(ex, ey, 20, "spark")
+    else:
+        targets, damage = numpy.array([hit] if hit >= 0 else [], dtype=numpy.int64), config.BOLT_DAMAGE
+        create_particles(ex, ey, 7, "spark")
+    # only things that can be hurt, and not the player
+    targets = targets[(STORE.maxhp[targets] > 0) & ~STORE.dead[targets] & (targets != SELECTED.id)]
+    DAMAGE.add(targets, damage)
+    for i in targets.tolist():
+        ent = STORE.entity(i)
+        events.BUS.emit(events.EV_ATTACK, SELECTED.type, SELECTED.health.hp, ent.type, ent.health.hp)
+        TOUCHED.add(ent)
+    STATE['player action'] = True
+
+
+# the hits land all at once, and only then does anything die (see damage_batch in combat.py).  that's once when the
+# player's action is done and again for the enemies' at the end of the turn
+def resolve_damage():
+    died = DAMAGE.apply(STORE)
+    if len(died):
+        kill([STORE.entity(i) for i in died.tolist()])
+
+
+# puts the game back how it was n turns ago (see history.py)
+def rewind_turns(n):
+    global ACTORS, PROPS
+    if TOUCHED or STATE['player action']:
+        # the player already did something this turn (a shot earlier in the same batch of input), so that gets
+        # committed as a turn of its own first, otherwise the history never hears about it.  The rewind then takes
+        # it back like any other turn, and the enemies don't get a go for it.
+        resolve_damage()
+        HISTORY.commit(TOUCHED)
+        TOUCHED.clear()
+        STATE['player action'] = False
+    # and a step typed before the undo shouldn't happen in the world after it
+    SELECTED.dx, SELECTED.dy = 0, 0
+    changed = HISTORY.rewind(n)
+    # anything could be anywhere now
+    PATHS.clear()
+    for ent in changed:
+        # the persona and such might be different now
+        INDEX.update(ent)
+        # things that died went into PROPS, bring them back if they're alive again
+        if ent.health and not ent.health.dead and ent in PROPS:
+            PROPS.remove(ent)
+            ACTORS += [ent]
+    ACTORS = sort_objects(ACTORS)
+    place_dots()
+    events.BUS.emit(events.EV_REWIND, HISTORY.turn)
+    # the old guesses are for a world that isn't there anymore
+    speculate_ai_turn()
 
 
-# sort list of objects for rendering niceness
+# sort list of objects for rendering niceness.  the y's are read out of the store (see ecs.py) all at once, it's
+# quicker than asking each entity
 def sort_objects(group):
-    outgoing = sorted(group, key=lambda x: x.sprite.layering - x.y, reverse=True)
+    ys = STORE.y[:STORE.count].tolist()
+    outgoing = sorted(group, key=lambda x: x.sprite.layering - ys[x.id], reverse=True)
     return outgoing
 
 
@@ -427,22 +567,42 @@ def draw_ui():
     pass
 
 
+# draws the terrain, but only the cells the camera can actually see (so big memmapped maps only load what's on screen)
+# each cell gets the version of its sprite that fits what's around it (see autotile.py)
+def draw_tiles(surf, cposx, cposy):
+    screen_w, screen_h = surf.get_size()
+    x0, y0, x1, y1 = TILES.clip(-cposx // config.CELL_WIDTH, -cposy // config.CELL_HEIGHT,
+                                (screen_w - cposx) // config.CELL_WIDTH + 1, (screen_h - cposy) // config.CELL_HEIGHT + 1)
+    if x0 >= x1 or y0 >= y1:
+        return
+    keys = VARIANTS.keys(x0, y0, x1, y1)
+    for x in range(x1 - x0):
+        column = keys[x]
+        for y in range(y1 - y0):
+            img = TILE_SPRITES.get(column[y])
+            if img:
+                surf.blit(img, ((x0 + x) * config.CELL_WIDTH + cposx, (y0 + y) * config.CELL_HEIGHT + cposy))
+
+
 def draw_game():
     # global ACTORS, PROPS, TILES, SELECTED, RUN_GAME, SURFACE_MAIN
     global TIMESINCE, STATE
     # camera location:
     cposx, cposy = STATE['camera pos']
     SURFACE_MAIN.fill((0, 0, 0))
+    draw_tiles(SURFACE_MAIN, cposx, cposy)
     for obj in PROPS:
         obj.sprite.drawself(SURFACE_MAIN, cposx, cposy)
     for obj in ACTORS:
         obj.sprite.drawself(SURFACE_MAIN, cposx, cposy)
-    # fps counter
-    if DEBUG['showfps']:
-        fpstxt = FONTS['fps'].render(TIMESINCE['frame'], 0, (255, 255, 255))
-        SURFACE_MAIN.blit(fpstxt, (100, 100))
     for par in PARTICLES:
         par.draw_self(SURFACE_MAIN, cposx, cposy)
+    # overview map in the top right, M (see minimap.py)
+    if STATE['minimap']:
+        MINIMAP.draw(SURFACE_MAIN, (SURFACE_MAIN.get_width() - MINIMAP.width * MINIMAP.zoom - 8, 8))
+    # frame timings, F1 (see profiler.py)
+    if DEBUG['showfps']:
+        OVERLAY.draw(SURFACE_MAIN)
 
     pygame.display.flip()
 
@@ -466,13 +626,36 @@ def process_gamestate():
     #     if time.time() - TIMESINCE['delay'] > config.WAIT_TIME:
     #         STATE['turn'] = 'player'
     if STATE['turn'] == 'thinking':
+        # everyone has moved, so that's the end of the turn.  all the hits land, then it goes in the history
+        resolve_damage()
+        HISTORY.commit(TOUCHED)
+        TOUCHED.clear()
+        place_dots()
         # no delay
         STATE['turn'] = 'player'
+        speculate_ai_turn()
 
     if STATE['turn'] == 'enemy':
-        ai_moves()
-        # print('ai moves')
-        STATE['turn'] = 'thinking'
+        PROFILER.begin('ai_moves')
+        plan = speculated_ai_turn()
+        if plan is None:
+            # guessed wrong, or it isn't finished yet
+            start_ai_turn()
+            STATE['turn'] = 'enemy planning'
+        else:
+            AI.results = [(ai, PATHS.store(ai, path)) for ai, path in plan]
+            finish_ai_turn()
+            STATE['turn'] = 'thinking'
+        PROFILER.end()
+
+    if STATE['turn'] == 'enemy planning':
+        # only config.AI_BUDGET of each frame goes on the ai, the rest waits for the next frame
+        PROFILER.begin('ai_moves')
+        if AI.run(config.AI_BUDGET):
+            finish_ai_turn()
+            # print('ai moves')
+            STATE['turn'] = 'thinking'
+        PROFILER.end()
 
     # check keyboard
     if STATE['turn'] == 'player':
@@ -492,31 +675,51 @@ def game_main_loop():
         start_time = time.time()
 
         # do whatever should be done on that state.
+        PROFILER.begin('process_gamestate')
         process_gamestate()
+        PROFILER.end()
 
         # process game objects
+        PROFILER.begin('move_objects')
         move_objects()
+        PROFILER.end()
         # tick_objects()
         # PROPS = sort_objects(PROPS) #might not be necessary to call every time
         # particles
+        PROFILER.begin('process_particles')
         process_particles()
+        PROFILER.end()
 
         # draw on screen
+        PROFILER.begin('draw_game')
         draw_game()
-        TIMESINCE['frame'] = str("FPS: " + str(1.0 / (time.time() - start_time)))
-        # print("FPS: " + str(1.0 / (time.time() - start_time)))
+        PROFILER.end()
+        PROFILER.end_frame(len(ACTORS) + len(PROPS), len(PARTICLES))
+
+        # hand this frame's events out (the log gets written on its own thread)
+        events.BUS.dispatch()
 
         # finally, switch to ai if played did an action
         if STATE['player action']:
+            # the player's hits land now, so whatever they killed doesn't get a go in the enemy turn
+            resolve_damage()
             STATE['turn'] = 'enemy'
             STATE['player action'] = False
+    events.BUS.dispatch()
+    SPECULATION.cancel()
+    if LOG:
+        LOG.close()
+    if config.PROFILE_FILE:
+        PROFILER.dump(config.PROFILE_FILE)
 
 
 # initialize game
 def game_initialize():
     pygame.init()
     # global variables
-    global ACTORS, PROPS, SELECTED, RUN_GAME, SURFACE_MAIN, FONTS, TIMESINCE, PARTICLES, DEBUG, STATE
+    global ACTORS, PROPS, TILES, SELECTED, RUN_GAME, SURFACE_MAIN, FONTS, TIMESINCE, PARTICLES, DEBUG, STATE, HISTORY, \
+        TOUCHED, INDEX, LOG, PROFILER, OVERLAY, RNG, AI, SPECULATION, PATHS, HPA, MINIMAP, VARIANTS, TILE_SPRITES, \
+        STORE, DAMAGE
 
     # Actors are objects that get ticked every cycle to see if they need to do something.  This isn't a good idea for
     # things that don't need to get ticked. (A plant needs ticks to grow, furnace needs ticks to smelt.)
@@ -529,16 +732,63 @@ def game_initialize():
     RUN_GAME = True
     # set the screen
     SURFACE_MAIN = pygame.display.set_mode((800, 600))
-    ACTORS, PROPS, SELECTED = map1gen.map_1_generate(config.MAP_1_GEN_SIZE[0], config.MAP_1_GEN_SIZE[1])
+    # Tiles are the terrain (floors, walls), kept as arrays.  See tilemap.py
+    if config.LEVEL_FILE:
+        ACTORS, PROPS, SELECTED, TILES = levelfile.load_level(config.LEVEL_FILE)
+    else:
+        ACTORS, PROPS, SELECTED, TILES = map1gen.map_1_generate(config.MAP_1_GEN_SIZE[0], config.MAP_1_GEN_SIZE[1],
+                                                                config.MAP_1_TILE_FOLDER)
+    # where the entities keep their positions, health and such, made along with the level
+    STORE = ecs.STORE
+    # which way each wall and floor is facing, and the sprites for that
+    VARIANTS = autotile.tile_variants(TILES, config.AUTOTILE_SOLID)
+    TILES.watch(VARIANTS.update)
+    TILE_SPRITES = autotile.variant_sprites(config.TERRAIN_SPRITES, config.AUTOTILE_SOLID)
+    # the overview map, drawn from the tile layers
+    MINIMAP = minimap.minimap(TILES, config.MINIMAP_COLOURS, config.MINIMAP_SIZE)
+    TILES.watch(MINIMAP.mark)
+    explore(SELECTED.x, SELECTED.y)
+    # the map in clusters for long routes, it keeps itself up to date when tiles change
+    HPA = hpa.hpa_map(TILES.passable, config.HPA_CLUSTER)
+    TILES.watch(HPA.update)
     ACTORS = sort_objects(ACTORS)
+    place_dots()
+    # who has what, for finding all the things with some component or persona quickly
+    INDEX = entity_index()
+    INDEX.add_all(ACTORS + PROPS)
     # set a font i guess.  wow there's a lot of globals even though someone told me globals are bad
-    FONTS = {"fps": pygame.font.SysFont("Arial", 60)}
-    TIMESINCE = {'frame': "0.0", 'delay': None}
+    FONTS = {"fps": pygame.font.SysFont("Courier", 14)}
+    TIMESINCE = {'delay': None}
+    # for the ai, numpy's so whole crowds can roll at once
+    RNG = numpy.random.default_rng()
+    # spreads the enemy turn over frames so it doesn't hitch
+    AI = scheduler.ai_scheduler(config.AI_HURRY_FRAMES)
+    # and gets a head start on it while the player is still deciding
+    SPECULATION = speculate.speculator()
+    # everyone's last path, so chasing doesn't mean a whole new search every turn
+    PATHS = pathing.path_cache(config.PATH_REPAIR_REACH, config.PATH_REPAIR_LIMIT, config.PATH_REFRESH,
+                               config.PATH_LOOKAHEAD)
     # controls particles!
     PARTICLES = []
     DEBUG = {"showfps": False}
+    # frame timings per phase of the game loop, F1 shows them
+    PROFILER = profiler.frame_profiler(config.PROFILE_WINDOW)
+    OVERLAY = profiler.overlay(PROFILER, FONTS['fps'])
     #turn decides who's turn it is, camera controls camera position, picked is what is clicked.
-    STATE = {"turn": "player", "player action": False, "camera pos": (32, 32), "picked": []}
+    STATE = {"turn": "player", "player action": False, "camera pos": (32, 32), "picked": [], "minimap": True,
+             "resort": False}
+    # the hits of whoever's going, melee and ranged, they land together once the player or the enemies are done
+    DAMAGE = combat.damage_batch()
+    # turn history for undo/rewind, and what got moved or hit during the current turn
+    HISTORY = history.turn_history()
+    HISTORY.track(ACTORS + PROPS)
+    TOUCHED = set()
+    # console log of what happens, off means the events don't even get recorded unless something else wants them
+    LOG = None
+    if config.LOG_EVENTS:
+        LOG = events.log_flusher()
+        events.BUS.subscribe(LOG)
+    speculate_ai_turn()
 
 
 
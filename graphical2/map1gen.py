@@ -1,54 +1,32 @@
 import pygame
-from graphical2.main2 import obj_entity, com_sprite, com_health, com_ondeath, com_attack, com_special
 from graphical2 import config
+from graphical2 import ecs
+from graphical2 import tilemap
+from graphical2.prefabs import PREFABS
 
 
 # This map generator makes a simple <height> by <width> room with some things to mess with.
+# If folder is given the tile layers are written there as memmap files.
 
-def map_1_generate(width, height):
+def map_1_generate(width, height, folder=None):
     actors = []
     props = []
+    # the entities for this map get a store of their own (see ecs.py)
+    ecs.new_level(width, height)
     # make a player character
-    actors += [obj_entity(1, 1, "Adventurer", sprite=com_sprite(config.S_HUMAN, spriteoffsetx=0, spriteoffsety=-1),
-                          blockpath=True, health=com_health(20), attack=com_attack(1))]
+    actors += [PREFABS.spawn('adventurer', 1, 1)]
     selected = actors[0]
-    actors += [obj_entity(1, 3, "Crabby the Crab", sprite=com_sprite(config.S_CRAB, spriteoffsetx=0, spriteoffsety=0),
-                          blockpath=True, ai_persona='random', ondeath=com_ondeath(config.S_CRAB_DIE), health=com_health(5))]
-
-    actors += [obj_entity(3, 3, "Pipi the Skaven", sprite=com_sprite(config.S_SKAVEN, spriteoffsetx=0,
-                                                                     spriteoffsety=-1),
-                          blockpath=True, ondeath=com_ondeath(config.S_SKAVEN_DIE), health=com_health(10),
-                          ai_persona='dumb_attack', attack=com_attack(1))]
-    actors += [obj_entity(4, 4, "Trapdoor", sprite=com_sprite(config.S_TRAPDOOR, layering=3), blockpath=False, special=({'level down': True}))]
-
-    #make a floor
-    for y in range(1, height - 1):
-        for x in range(1, width - 1):
-            floor = [obj_entity(x, y, "floor", sprite=com_sprite(config.S_FLOOR))]
-            props += floor
-
-    # walls
-    # top
-    for x in range(0, width):
-        y = 0
-        wall = [obj_entity(x, y, "wall", sprite=com_sprite(config.S_WALL), blockpath=True)]
-        props += wall
-    # left
-    for y in range(1, height - 1):
-        x = 0
-        wall = [obj_entity(x, y, "wall", sprite=com_sprite(config.S_WALL), blockpath=True)]
-        props += wall
-    # right
-    for y in range(1, height - 1):
-        x = width - 1
-        wall = [obj_entity(x, y, "wall", sprite=com_sprite(config.S_WALL), blockpath=True)]
-        props += wall
-    # bottom
-    for x in range(0, width):
-        y = height - 1
-        wall = [obj_entity(x, y, "wall", sprite=com_sprite(config.S_WALL), blockpath=True)]
-        props += wall
-
-    props += [obj_entity(5, 4, "wall", sprite=com_sprite(config.S_WALL), blockpath=True)]
-
-    return actors, props, selected
+    actors += [PREFABS.spawn('crab', 1, 3)]
+    actors += [PREFABS.spawn('skaven', 3, 3)]
+    actors += [PREFABS.spawn('trapdoor', 4, 4)]
+
+    # the room itself goes in the tile layers, not in props
+    tiles = tilemap.new_layers(width, height, folder)
+    # walls all the way around...
+    tiles.fill_rect(0, 0, width, height, config.T_WALL, False)
+    # ...then floor in the middle
+    tiles.fill_rect(1, 1, width - 1, height - 1, config.T_FLOOR, True)
+    tiles.set_tile(5, 4, config.T_WALL, False)
+    tiles.flush()
+
+    return actors, props, selected, tiles
@@ -0,0 +1,133 @@
+import os
+import time
+import numpy
+import pygame
+
+# The overview map, made straight from the tile layers instead of drawing sprites.
+#
+# Every cell gets a code: its terrain id if it's been explored, UNSEEN if not, and ACTOR or PLAYER where something is
+# standing.  A lookup table turns codes into colours, so a whole block of the map is one numpy index (colours[codes])
+# written into the surface through pygame.surfarray.  Big maps get shrunk by only taking every step'th cell, so the
+# picture is never more than `size` pixels across however big the level is.
+#
+# Nothing gets redone unless it changed.  mark() says a rectangle of cells changed (main2 has the tile layers call
+# it, and calls it for newly explored bits), place() says where everyone is now, and draw() only recolours those
+# bits before blitting the same surface as last time.
+
+UNSEEN = 253
+ACTOR = 254
+PLAYER = 255
+
+
+def colour_table(colours, unseen=(0, 0, 0), actor=(200, 40, 40), player=(60, 200, 255)):
+    # code -> rgb, anything not in colours is left black
+    table = numpy.zeros((256, 3), dtype=numpy.uint8)
+    for code, colour in colours.items():
+        table[code] = colour
+    table[UNSEEN] = unseen
+    table[ACTOR] = actor
+    table[PLAYER] = player
+    return table
+
+
+class minimap:
+    def __init__(self, tiles, colours, size=160, zoom=None):
+        self.tiles = tiles
+        self.colours = colour_table(colours)
+        # cells per pixel
+        self.step = max(1, -(-max(tiles.width, tiles.height) // size))
+        self.width = -(-tiles.width // self.step)
+        self.height = -(-tiles.height // self.step)
+        # small maps get blown up so they're not a speck
+        self.zoom = zoom or max(1, size // max(self.width, self.height))
+        self.surface = pygame.Surface((self.width, self.height))
+        self.shown = None
+        self.dirty = [(0, 0, tiles.width, tiles.height)]
+        self.dots = (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64),
+                     numpy.zeros(0, dtype=numpy.uint8))
+        self.moved = None  # pixels the dots were on before they moved
+
+    def mark(self, x0, y0, x1, y1):
+        # cells [x0, x1) by [y0, y1) changed
+        if x0 < x1 and y0 < y1:
+            self.dirty.append((x0, y0, x1, y1))
+
+    def place(self, xs, ys, codes):
+        # where everything is now (cell coordinates) and what to show it as (ACTOR, PLAYER)
+        old_x, old_y = self.dots[0], self.dots[1]
+        if self.moved is not None:
+            old_x, old_y = numpy.concatenate((self.moved[0], old_x)), numpy.concatenate((self.moved[1], old_y))
+        self.moved = (old_x, old_y)
+        self.dots = (numpy.asarray(xs, dtype=numpy.int64), numpy.asarray(ys, dtype=numpy.int64),
+                     numpy.asarray(codes, dtype=numpy.uint8))
+
+    def codes(self, xs, ys):
+        # codes for the cells at xs, ys (arrays or slices)
+        tiles = self.tiles
+        return numpy.where(tiles.explored[xs, ys], tiles.terrain[xs, ys], UNSEEN)
+
+    def refresh(self):
+        step = self.step
+        pixels = pygame.surfarray.pixels3d(self.surface)
+        for x0, y0, x1, y1 in self.dirty:
+            # the pixels that cover the rectangle, and the one cell each of them shows
+            px0, py0 = x0 // step, y0 // step
+            px1, py1 = -(-x1 // step), -(-y1 // step)
+            cells = (slice(px0 * step, px1 * step, step), slice(py0 * step, py1 * step, step))
+            pixels[px0:px1, py0:py1] = self.colours[self.codes(*cells)]
+        if self.moved is not None:
+            # put back whatever was under the dots before they moved
+            px, py = self.moved[0] // step, self.moved[1] // step
+            pixels[px, py] = self.colours[self.codes(px * step, py * step)]
+        xs, ys, codes = self.dots
+        if len(xs):
+            # only on bits the player has seen
+            seen = self.tiles.explored[xs, ys]
+            pixels[xs[seen] // step, ys[seen] // step] = self.colours[codes[seen]]
+        del pixels
+        self.dirty = []
+        self.moved = None
+        if self.zoom > 1:
+            self.shown = pygame.transform.scale(self.surface, (self.width * self.zoom, self.height * self.zoom))
+        else:
+            self.shown = self.surface
+
+    def draw(self, surf, pos):
+        if self.dirty or self.moved is not None or self.shown is None:
+            self.refresh()
+        surf.blit(self.shown, pos)
+
+
+if __name__ == '__main__':
+    # a 1000x1000 level: the first full draw, then frames where a bit gets explored and a few hundred things move
+    #   python -m graphical2.minimap
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    from graphical2 import tilemap
+    pygame.init()
+    screen = pygame.display.set_mode((800, 600))
+    size = 1000
+    rng = numpy.random.default_rng(0)
+    tiles = tilemap.new_layers(size, size)
+    tiles.fill_rect(0, 0, size, size, 2, False)
+    tiles.fill_rect(1, 1, size - 1, size - 1, 1, True)
+    tiles.explored[:size // 2] = True
+    view = minimap(tiles, {1: (90, 80, 70), 2: (160, 160, 160), 3: (120, 60, 20)})
+    tiles.watch(view.mark)
+    xs, ys = rng.integers(1, size - 1, 500), rng.integers(1, size - 1, 500)
+    start = time.perf_counter()
+    view.draw(screen, (0, 0))
+    print("first draw (all of it): %.2f ms" % ((time.perf_counter() - start) * 1000))
+    frames = 200
+    start = time.perf_counter()
+    for frame in range(frames):
+        x, y = rng.integers(10, size - 10, 2)
+        tiles.explored[x - 6:x + 7, y - 6:y + 7] = True
+        view.mark(x - 6, y - 6, x + 7, y + 7)
+        xs = numpy.clip(xs + rng.integers(-1, 2, len(xs)), 1, size - 2)
+        view.place(xs, ys, numpy.full(len(xs), ACTOR))
+        view.draw(screen, (0, 0))
+    print("frame with changes: %.3f ms" % ((time.perf_counter() - start) * 1000 / frames))
+    start = time.perf_counter()
+    for frame in range(frames):
+        view.draw(screen, (0, 0))
+    print("frame without: %.3f ms" % ((time.perf_counter() - start) * 1000 / frames))
@@ -0,0 +1,280 @@
+import pygame
+import socket
+import argparse
+import collections
+import os
+import time
+import numpy
+from graphical2 import config
+from graphical2_server import config as server_config
+from graphical2_server import net
+from graphical2_server import protocol
+from graphical2_server import world as server_world
+
+# The pygame client for the networked game (graphical2_server).
+#   python -m graphical2.netclient --port 1235
+#
+# The server is in charge, but waiting a whole round trip before your own guy moves feels awful, so:
+#   - prediction: our own moves are applied straight away on top of the last position the server gave us.  Every
+#     update from the server says which of our moves it's done with (the ack), those are dropped and the rest get
+#     replayed on top of the server's position.  If the server disagrees (someone was in the way, or we sent faster
+#     than it takes moves and it turned some away) we just snap to it.
+#   - interpolation: everything else is drawn a little in the past (INTERP_DELAY), sliding between the last two
+#     positions we got, so they move smoothly instead of jumping once per tick.
+# Try it with graphical2_server/delayproxy.py in between.
+
+# how far in the past other entities are drawn, should be a bit more than one server tick
+INTERP_DELAY = 1.5 / server_config.TICK_RATE
+
+# kind -> (sprite, dead sprite, sprite offset y)
+KIND_SPRITES = {server_world.KIND_PLAYER: (config.S_HUMAN, config.S_HUMAN, -1),
+                server_world.KIND_CRAB: (config.S_CRAB, config.S_CRAB_DIE, 0)}
+
+
+###########################
+####    NETWORKING     ####
+###########################
+
+# splits whatever the socket gave us into frames
+class frame_reader:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    def frames(self):
+        while len(self.buffer) >= net.HEADER.size:
+            size, = net.HEADER.unpack_from(self.buffer)
+            end = net.HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            payload = bytes(self.buffer[net.HEADER.size:end])
+            del self.buffer[:end]
+            yield payload
+
+
+# our moves that the server hasn't applied yet
+class prediction:
+    def __init__(self):
+        self.seq = 0
+        self.pending = collections.deque()  # (seq, dx, dy)
+
+    def reset(self):
+        self.pending.clear()
+
+    def add(self, dx, dy):
+        self.seq = (self.seq + 1) & 0xffff
+        self.pending.append((self.seq, dx, dy))
+        return self.seq
+
+    def ack(self, ack):
+        while self.pending and not protocol.seq_after(self.pending[0][0], ack):
+            self.pending.popleft()
+
+    def predict(self, x, y, blocked):
+        # replays everything the server hasn't seen yet on top of where the server says we are
+        for seq, dx, dy in self.pending:
+            if not blocked(x + dx, y + dy):
+                x, y = x + dx, y + dy
+        return x, y
+
+
+# keeps the last few positions of everything so it can be drawn between them
+class interpolator:
+    def __init__(self, delay):
+        self.delay = delay
+        self.history = {}  # id -> deque of (time, x, y)
+
+    def record(self, now, entities):
+        history = self.history
+        for entity_id, (x, y, hp, state) in entities.items():
+            samples = history.get(entity_id)
+            if samples is None:
+                history[entity_id] = collections.deque([(now, x, y)], maxlen=4)
+            elif samples[-1][1] != x or samples[-1][2] != y or now - samples[-1][0] > self.delay:
+                samples.append((now, x, y))
+        for entity_id in [entity_id for entity_id in history if entity_id not in entities]:
+            del history[entity_id]
+
+    def position(self, entity_id, now):
+        samples = self.history.get(entity_id)
+        if not samples:
+            return None
+        when = now - self.delay
+        previous = samples[0]
+        for sample in samples:
+            if sample[0] >= when:
+                if sample is previous:
+                    return sample[1], sample[2]
+                # somewhere between the two, slide along
+                t = (when - previous[0]) / max(1e-6, sample[0] - previous[0])
+                return previous[1] + (sample[1] - previous[1]) * t, previous[2] + (sample[2] - previous[2]) * t
+            previous = sample
+        return previous[1], previous[2]
+
+
+class connection:
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+        self.reader = frame_reader()
+        # bytes the socket wouldn't take yet, they go out as soon as it has room
+        self.outgoing = bytearray()
+        self.closed = False
+
+    def send(self, payload):
+        self.outgoing += net.frame(payload)
+        self.flush()
+
+    def flush(self):
+        while self.outgoing and not self.closed:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except BlockingIOError:
+                break
+            except ConnectionError:
+                self.closed = True
+                break
+            del self.outgoing[:sent]
+
+    def poll(self):
+        # called every frame, so anything send() couldn't get out goes now
+        self.flush()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            if not data:
+                self.closed = True
+                break
+            self.reader.feed(data)
+        return self.reader.frames()
+
+
+###########################
+####       GAME        ####
+###########################
+
+class net_game:
+    def __init__(self, conn, surface):
+        self.conn = conn
+        self.surface = surface
+        self.view = protocol.world_view()
+        self.prediction = prediction()
+        self.interp = interpolator(INTERP_DELAY)
+        self.player_id = None
+        self.terrain = None
+        self.run = True
+
+    def send_move(self, dx, dy):
+        seq = self.prediction.add(dx, dy)
+        self.conn.send(protocol.MOVE.pack(protocol.MSG_MOVE, seq, dx, dy))
+
+    def get_inputs(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.run = False
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_w:
+                    self.send_move(0, -1)
+                if event.key == pygame.K_s:
+                    self.send_move(0, 1)
+                if event.key == pygame.K_a:
+                    self.send_move(-1, 0)
+                if event.key == pygame.K_d:
+                    self.send_move(1, 0)
+
+    def receive(self):
+        now = time.perf_counter()
+        for payload in self.conn.poll():
+            msg = payload[0]
+            if msg == protocol.MSG_WELCOME:
+                # new player (or new floor), nothing we sent before counts any more
+                msg, self.player_id = protocol.WELCOME.unpack(payload)
+                self.prediction.reset()
+            elif msg == protocol.MSG_MAP:
+                width, height, terrain = protocol.decode_map(payload)
+                self.terrain = numpy.frombuffer(terrain, dtype=numpy.uint8).reshape(width, height)
+            elif self.view.apply(payload) in (protocol.MSG_SNAPSHOT, protocol.MSG_DELTA):
+                self.prediction.ack(self.view.ack)
+                self.interp.record(now, self.view.entities)
+        if self.conn.closed:
+            self.run = False
+
+    def blocked(self, x, y):
+        if self.terrain is None or not (0 <= x < self.terrain.shape[0] and 0 <= y < self.terrain.shape[1]):
+            return True
+        if self.terrain[x, y] == config.T_WALL:
+            return True
+        for entity_id, (ex, ey, hp, state) in self.view.entities.items():
+            if ex == x and ey == y and entity_id != self.player_id and not state & protocol.STATE_DEAD:
+                return True
+        return False
+
+    def player_position(self):
+        me = self.view.entities.get(self.player_id)
+        if me is None:
+            return None
+        return self.prediction.predict(me[0], me[1], self.blocked)
+
+    def draw(self):
+        now = time.perf_counter()
+        screen_w, screen_h = self.surface.get_size()
+        self.surface.fill((0, 0, 0))
+        me = self.player_position()
+        if me is None:
+            pygame.display.flip()
+            return
+        # camera sits on the (predicted) player
+        cposx = screen_w // 2 - me[0] * config.CELL_WIDTH
+        cposy = screen_h // 2 - me[1] * config.CELL_HEIGHT
+        if self.terrain is not None:
+            x0 = max(0, -cposx // config.CELL_WIDTH)
+            y0 = max(0, -cposy // config.CELL_HEIGHT)
+            x1 = min(self.terrain.shape[0], (screen_w - cposx) // config.CELL_WIDTH + 1)
+            y1 = min(self.terrain.shape[1], (screen_h - cposy) // config.CELL_HEIGHT + 1)
+            for x in range(x0, x1):
+                for y in range(y0, y1):
+                    img = config.TERRAIN_SPRITES.get(self.terrain[x, y])
+                    if img:
+                        self.surface.blit(img, (x * config.CELL_WIDTH + cposx, y * config.CELL_HEIGHT + cposy))
+        drawn = []
+        for entity_id, (x, y, hp, state) in self.view.entities.items():
+            if entity_id == self.player_id:
+                pos = me
+            else:
+                pos = self.interp.position(entity_id, now) or (x, y)
+            drawn.append((pos, state))
+        # same idea as sort_objects in main2: corpses under the living, further down the screen on top
+        drawn.sort(key=lambda item: (not item[1] & protocol.STATE_DEAD, item[0][1]))
+        for (x, y), state in drawn:
+            alive, dead, offset_y = KIND_SPRITES.get(state & protocol.KIND_MASK, KIND_SPRITES[server_world.KIND_CRAB])
+            img = dead if state & protocol.STATE_DEAD else alive
+            self.surface.blit(img, (int(x * config.CELL_WIDTH) + cposx,
+                                    int((y + (0 if state & protocol.STATE_DEAD else offset_y)) * config.CELL_HEIGHT)
+                                    + cposy))
+        pygame.display.flip()
+
+    def main_loop(self):
+        clock = pygame.time.Clock()
+        while self.run:
+            self.get_inputs()
+            self.receive()
+            self.draw()
+            clock.tick(60)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Experimental Dungeons network client")
+    parser.add_argument('--host', default=server_config.HOST)
+    parser.add_argument('--port', type=int, default=server_config.PORT)
+    args = parser.parse_args()
+    print("working directory is" + os.getcwd())
+    pygame.init()
+    surface = pygame.display.set_mode((800, 600))
+    conn = connection(args.host, args.port)
+    conn.send(protocol.VIEW.pack(protocol.MSG_VIEW, 800 // config.CELL_WIDTH + 1, 600 // config.CELL_HEIGHT + 1))
+    net_game(conn, surface).main_loop()
@@ -0,0 +1,382 @@
+import weakref
+from graphical2 import config
+from graphical2 import ecs
+from graphical2 import events
+
+# The entity and its components, split out of main2 so map1gen (and the benchmarks) can make things without pulling
+# in the whole game.
+#
+# Everything here uses __slots__: no __dict__ per object, so an entity plus its components takes less memory
+# (benchmarks/bench_memory.py has the numbers) and attribute lookups are a bit quicker too.  The catch is you can't
+# just stick a new attribute on something, it has to be added to __slots__ first.
+#
+# The owner back-reference is a weakref proxy to the entity.  It reads the same (self.owner.x) but it isn't a real
+# reference, so an entity and its components don't make a reference cycle.  They get freed by refcounting as soon as
+# nothing holds the entity, and the garbage collector has nothing to untangle.
+
+
+# actors
+# game objects need x, y, type, health, inventory,
+# x, y, dx, dy, blockpath, ai_persona (and health.hp and such) are kept in a row of the entity store, see ecs.py, so
+# whole crowds can be moved and hurt with numpy.  Reading them here is the same as ever, just a bit slower.
+class obj_entity:
+    __slots__ = ('store', 'id', 'type', 'sprite', 'health', 'attack', 'inventory', 'ondeath', 'special', 'prefab',
+                 '__weakref__')
+
+    def __init__(self, x, y, objtype, sprite, blockpath=False, health=None, inventory=None, ondeath=None, attack=None,
+                 ai_persona="none", special=None, shared=False):
+        # moving and location (and blockpath, attack, ... for the systems in ecs.py) go in its row
+        self.store = ecs.STORE
+        self.id = self.store.spawn(x, y, attack=attack.attackdamage if attack else 0, blockpath=blockpath,
+                                   persona=ecs.persona_code(ai_persona), mortal=ondeath is not None, obj=self)
+
+        # object type
+        self.type = objtype
+        # the shared per-type data if this came from a prefab (see prefabs.py)
+        self.prefab = None
+
+        # Question: what the heck is up with that retarded "self.owner" stuff?
+        # Answer: it's a workaround, python doesn't have a proper "parent" reference.  We need to get stuff from other
+        # components, so that's the work around.  It's a weak proxy so it doesn't keep the entity alive (see the top).
+        # With shared the attack, ondeath and special belong to a whole kind of thing (a prefab's, see prefabs.py) and
+        # don't get an owner, otherwise every crab would be pointing them at itself.
+        owner = weakref.proxy(self)
+
+        # sprite and drawing
+        self.sprite = sprite
+        if self.sprite:
+            self.sprite.owner = owner
+
+        # health
+        self.health = health
+        if self.health:
+            self.health.owner = owner
+            self.health.bind(self)
+
+        self.attack = attack
+        if self.attack and not shared:
+            self.attack.owner = owner
+
+        # inventory
+        self.inventory = inventory
+        if self.inventory:
+            self.inventory.owner = owner
+
+        self.ondeath = ondeath
+        if self.ondeath and not shared:
+            self.ondeath.owner = owner
+
+        self.special = special
+        if self.special and not shared:
+            self.special.owner = owner
+
+    def __del__(self):
+        # the row goes back to the store once nothing holds the entity
+        self.store.remove(self.id)
+
+    # puts com in one of the component slots, with the owner hookup and the store's columns kept in step.  shared
+    # works the same as for __init__, and the entity's own prefab components count as shared without saying so.
+    # gives back what was there before.
+    def swap(self, name, com, shared=False):
+        old = getattr(self, name)
+        if name == 'health' and old is not None:
+            old.unbind()
+        setattr(self, name, com)
+        if com is not None:
+            if not shared and not (self.prefab and getattr(self.prefab, name, None) is com):
+                com.owner = weakref.proxy(self)
+            if name == 'health':
+                com.bind(self)
+        self.store.attack[self.id] = self.attack.attackdamage if self.attack else 0
+        self.store.mortal[self.id] = self.ondeath is not None
+        return old
+
+    def place(self, x, y):
+        # both at once, so it never stands on the cell in between
+        self.store.place(self.id, x, y)
+
+    @property
+    def x(self):
+        return self.store.x.item(self.id)
+
+    @x.setter
+    def x(self, value):
+        self.store.place(self.id, value, self.store.y.item(self.id))
+
+    @property
+    def y(self):
+        return self.store.y.item(self.id)
+
+    @y.setter
+    def y(self, value):
+        self.store.place(self.id, self.store.x.item(self.id), value)
+
+    @property
+    def dx(self):
+        return self.store.dx.item(self.id)
+
+    @dx.setter
+    def dx(self, value):
+        self.store.dx[self.id] = value
+
+    @property
+    def dy(self):
+        return self.store.dy.item(self.id)
+
+    @dy.setter
+    def dy(self, value):
+        self.store.dy[self.id] = value
+
+    @property
+    def blockpath(self):
+        return self.store.blockpath.item(self.id)
+
+    @blockpath.setter
+    def blockpath(self, value):
+        self.store.set_blockpath(self.id, bool(value))
+
+    @property
+    def ai_persona(self):
+        return ecs.PERSONAS[self.store.persona.item(self.id)]
+
+    @ai_persona.setter
+    def ai_persona(self, value):
+        self.store.persona[self.id] = ecs.persona_code(value)
+
+
+###########################
+#### OBJECT COMPONENTS ####
+###########################
+
+
+# controls an object's health
+# the numbers live in the owner's row of the entity store (so damage can be done to everyone at once, see ecs.py).
+# Until it's given to an entity they wait in start.
+class com_health:
+    __slots__ = ('owner', 'store', 'id', 'start')
+
+    def __init__(self, hp, maxhp=None):
+        self.owner = None
+        self.store = None
+        self.id = None
+        # hp, maxhp, dead (allows you to know if you're dead)
+        if maxhp == None:
+            self.start = [hp, hp, False]
+        else:
+            self.start = [hp, maxhp, False]
+
+    def bind(self, ent):
+        self.store, self.id = ent.store, ent.id
+        self.store.hp[self.id], self.store.maxhp[self.id], self.store.dead[self.id] = self.start
+        self.start = None
+
+    def unbind(self):
+        # taken off its entity, the numbers come back here and the row has no health anymore
+        self.start = [self.hp, self.maxhp, self.dead]
+        self.store.hp[self.id] = self.store.maxhp[self.id] = 0
+        self.store.dead[self.id] = False
+        self.store = self.id = None
+
+    @property
+    def hp(self):
+        if self.store is None:
+            return self.start[0]
+        return self.store.hp.item(self.id)
+
+    @hp.setter
+    def hp(self, value):
+        if self.store is None:
+            self.start[0] = value
+        else:
+            self.store.hp[self.id] = value
+
+    @property
+    def maxhp(self):
+        if self.store is None:
+            return self.start[1]
+        return self.store.maxhp.item(self.id)
+
+    @maxhp.setter
+    def maxhp(self, value):
+        if self.store is None:
+            self.start[1] = value
+        else:
+            self.store.maxhp[self.id] = value
+
+    @property
+    def dead(self):
+        if self.store is None:
+            return self.start[2]
+        return self.store.dead.item(self.id)
+
+    @dead.setter
+    def dead(self, value):
+        if self.store is None:
+            self.start[2] = value
+        else:
+            self.store.dead[self.id] = value
+
+
+# controls drawing and stuff
+class com_sprite:
+    __slots__ = ('img', 'spriteoffsetx', 'spriteoffsety', 'layering', 'owner')
+
+    def __init__(self, img, spriteoffsetx=0, spriteoffsety=0, layering=0):
+        self.img = img
+        self.spriteoffsetx = spriteoffsetx
+        self.spriteoffsety = spriteoffsety
+        self.layering = layering  # IMPORTANT! Higher numbers makes it go down, not up!
+        self.owner = None
+
+    def drawself(self, surf, offset_x, offset_y):
+        surf.blit(self.img, (
+            (self.owner.x * config.CELL_WIDTH) + (self.spriteoffsetx * config.CELL_WIDTH) + offset_x,
+            (self.owner.y * config.CELL_HEIGHT) + (self.spriteoffsety * config.CELL_HEIGHT) + offset_y))
+
+
+# things have inventories
+class com_inventory:
+    __slots__ = ('owner',)
+
+    def __init__(self):
+        self.owner = None
+
+
+# some objects can be picked up and used as weapons.
+class com_item:
+    __slots__ = ('owner',)
+
+    def __init__(self):
+        self.owner = None
+
+
+class com_attack:
+    __slots__ = ('owner', 'attackdamage')
+
+    def __init__(self, attackdamage):
+        self.owner = None
+        self.attackdamage = attackdamage
+
+
+class com_special:
+    __slots__ = ('owner', 'data')
+
+    def __init__(self, special_data):
+        self.owner = None
+        self.data = special_data
+
+
+###########################
+#### SPECIAL FUNCTIONS ####
+###########################
+
+
+class com_ondeath:
+    __slots__ = ('owner', 'deathimg', 'blockafterdeath', 'spriteoffsetx', 'spriteoffsety')
+
+    def __init__(self, deathimg=None, spriteoffsetx=0, spriteoffsety=0, blockafterdeath=False):
+        self.owner = None
+        self.deathimg = deathimg
+        self.blockafterdeath = blockafterdeath
+        self.spriteoffsetx = spriteoffsetx
+        self.spriteoffsety = spriteoffsety
+
+    def die(self, ent=None):
+        # prefabs share one ondeath between every entity of a type, so those have no owner and get told who died
+        if ent is None:
+            ent = self.owner
+        ent.sprite.img = self.deathimg
+        ent.blockpath = self.blockafterdeath
+        ent.sprite.layering = 2
+        ent.sprite.spriteoffsetx = self.spriteoffsetx
+        ent.sprite.spriteoffsety = self.spriteoffsety
+        ent.ai_persona = "none"
+        ent.health.dead = True
+        events.BUS.emit(events.EV_DEATH, ent.type)
+
+
+###########################
+####     INDEXES       ####
+###########################
+
+# the component slots on obj_entity, in the order the index files them
+COMPONENTS = ('sprite', 'health', 'attack', 'inventory', 'ondeath', 'special')
+
+
+# Keeps track of which entities have which components, which ai persona and which special tags ('level down'), so
+# game code can go straight to "everything with the random persona" instead of looking at every crab, trapdoor and
+# corpse to find out.
+#
+# Each group is a dict used as an ordered set (values are None), so things come out in the order they were added.
+# Entities aren't watched: whatever changes a component, the persona or the special data has to tell the index
+# (attach/detach do it for you, died() after something dies, update() after anything else like a rewind).
+class entity_index:
+    def __init__(self):
+        self.components = {name: {} for name in COMPONENTS}
+        self.personas = {}  # persona -> entities, 'none' isn't kept
+        self.tags = {}  # special data key -> entities
+        self.filed = {}  # entity -> (components, persona, tags) it's filed under, so it can be taken out again
+
+    def add(self, ent):
+        self.update(ent)
+
+    def add_all(self, ents):
+        for ent in ents:
+            self.update(ent)
+
+    def remove(self, ent):
+        filed = self.filed.pop(ent, None)
+        if filed is None:
+            return
+        names, persona, tags = filed
+        for name in names:
+            del self.components[name][ent]
+        if persona is not None:
+            group = self.personas[persona]
+            del group[ent]
+            if not group:
+                del self.personas[persona]
+        for tag in tags:
+            group = self.tags[tag]
+            del group[ent]
+            if not group:
+                del self.tags[tag]
+
+    def update(self, ent):
+        # (re)files the entity under whatever it has right now
+        self.remove(ent)
+        names = tuple(name for name in COMPONENTS if getattr(ent, name) is not None)
+        for name in names:
+            self.components[name][ent] = None
+        persona = ent.ai_persona if ent.ai_persona != "none" else None
+        if persona is not None:
+            self.personas.setdefault(persona, {})[ent] = None
+        special = ent.special
+        tags = tuple(special.data) if special and isinstance(special.data, dict) else ()
+        for tag in tags:
+            self.tags.setdefault(tag, {})[ent] = None
+        self.filed[ent] = (names, persona, tags)
+
+    # dying takes the persona away (see com_ondeath.die), so it has to come out of its persona group
+    def died(self, ent):
+        self.update(ent)
+
+    # shared is the same as for obj_entity.swap
+    def attach(self, ent, name, com, shared=False):
+        ent.swap(name, com, shared)
+        self.update(ent)
+
+    def detach(self, ent, name):
+        com = ent.swap(name, None)
+        self.update(ent)
+        return com
+
+    # these hand back a list, so it's fine to change the index while going through it
+    def with_component(self, name):
+        return list(self.components[name])
+
+    def with_persona(self, persona):
+        return list(self.personas.get(persona, ()))
+
+    def tagged(self, tag):
+        return list(self.tags.get(tag, ()))
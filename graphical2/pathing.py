@@ -0,0 +1,257 @@
+import heapq
+import numpy
+
+# A* on the blockmap, for when astar_1 gets too slow.
+#
+# blocked is an array indexed [x, y] (same as the tile layers and build_blockmap in main2), anything non zero can't
+# be walked through.  The goal is allowed to be blocked, it's usually the player standing there.  Moves are up, down,
+# left and right, each costs 1, and the heuristic is the manhattan distance so the paths come out as short as they
+# can be.
+#
+# The search can be done a bit at a time: step(limit) expands at most limit cells and says whether it's finished,
+# so a long search can be spread over a few frames (see scheduler.py).  If it has to stop early, best_path() gives the
+# path to the cell it got closest to the goal so far, which is usually a good enough first step (anytime search).
+
+NEIGHBOURS = ((-1, 0), (0, -1), (0, 1), (1, 0))
+
+
+class path_search:
+    def __init__(self, blocked, start, goal):
+        self.blocked = blocked
+        self.width, self.height = blocked.shape
+        self.start = tuple(start)
+        self.goal = tuple(goal)
+        self.cost = {self.start: 0}
+        self.came_from = {self.start: None}
+        self.counter = 0  # tie breaker, so the heap never compares cells
+        # (estimate, distance left, tie breaker, cell).  with the same estimate the one closer to the goal goes first,
+        # otherwise it wades through every cell in the box between start and goal before it gets anywhere
+        self.open = [(self.distance(self.start), self.distance(self.start), self.counter, self.start)]
+        self.closest = self.start
+        self.closest_distance = self.distance(self.start)
+        self.found = self.start == self.goal
+        self.done = self.found
+        self.expanded = 0
+
+    def distance(self, cell):
+        return abs(cell[0] - self.goal[0]) + abs(cell[1] - self.goal[1])
+
+    def step(self, limit):
+        # expands up to limit cells, returns True once it's finished (found the goal or ran out of places to look)
+        if self.done:
+            return True
+        blocked, width, height, goal = self.blocked, self.width, self.height, self.goal
+        cost, came_from, open_list = self.cost, self.came_from, self.open
+        for i in range(limit):
+            if not open_list:
+                self.done = True
+                return True
+            estimate, left, order, cell = heapq.heappop(open_list)
+            so_far = estimate - left
+            if so_far > cost[cell]:
+                # found a cheaper way here after this was queued
+                continue
+            self.expanded += 1
+            if cell == goal:
+                self.found = self.done = True
+                return True
+            x, y = cell
+            for dx, dy in NEIGHBOURS:
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < width and 0 <= ny < height):
+                    continue
+                nxt = (nx, ny)
+                if blocked[nx, ny] and nxt != goal:
+                    continue
+                new_cost = so_far + 1
+                if new_cost < cost.get(nxt, new_cost + 1):
+                    cost[nxt] = new_cost
+                    came_from[nxt] = cell
+                    left = abs(nx - goal[0]) + abs(ny - goal[1])
+                    if left < self.closest_distance:
+                        self.closest, self.closest_distance = nxt, left
+                    self.counter += 1
+                    heapq.heappush(open_list, (new_cost + left, left, self.counter, nxt))
+        return False
+
+    def walk_back(self, cell):
+        path = []
+        while cell is not None:
+            path.append(cell)
+            cell = self.came_from[cell]
+        path.reverse()
+        return path
+
+    def path(self):
+        # start to goal, both included, or None if there isn't one (or it isn't finished)
+        if not self.found:
+            return None
+        return self.walk_back(self.goal)
+
+    def best_path(self):
+        # the whole path if there is one, otherwise the way to the closest cell seen so far
+        if self.found:
+            return self.path()
+        return self.walk_back(self.closest)
+
+
+def find_path(blocked, start, goal):
+    search = path_search(blocked, start, goal)
+    while not search.step(10000):
+        pass
+    return search.path()
+
+
+# Each actor's last path, kept from turn to turn so chasing something doesn't mean a whole new search every turn.
+#
+# Usually the actor took one step along its path and the thing it's after moved a cell, so follow() moves it along,
+# patches the end up to the new goal with a tiny search (cutting out any loop that makes) and gives the next step.
+# A path only gets thrown away when something blocking lands on one of its cells: main2 calls blocked(cell) from the
+# movement and death code, and `through` says straight away whose paths go over that cell.  Something that's just
+# walking past only counts if it's within lookahead steps of the owner, further on it'll most likely have moved along
+# by the time the owner gets there (and if it hasn't, follow() notices when it's the next step).  A path also goes if
+# the goal jumps further than repair_reach, the patch-up search can't find it within repair_limit cells, or it's been
+# patched refresh times already (the patches add up and it drifts from the shortest path).  Then it's a normal search
+# again.
+#
+# A path is stored as the whole list of cells plus `at`, where the owner is on it, so following it is O(1).  The
+# owner's cell and the goal aren't in `through`, moving onto your own path or the goal moving doesn't break anything.
+#
+# A leg (store(..., leg=True)) is a path that only goes part of the way, to a waypoint (see hpa.py).  It gets followed
+# to its end whatever the goal does, and then it's a miss so the next leg gets worked out.
+
+class path_cache:
+    def __init__(self, repair_reach=3, repair_limit=64, refresh=10, lookahead=4):
+        self.repair_reach = repair_reach
+        self.lookahead = lookahead
+        self.repair_limit = repair_limit
+        self.refresh = refresh
+        self.entries = {}  # owner -> [cells, at, where (cell -> index in cells), times patched, leg]
+        self.through = {}  # cell -> owners whose path goes over it
+        self.hits = 0
+        self.misses = 0
+
+    def index(self, owner, cell):
+        owners = self.through.get(cell)
+        if owners is None:
+            owners = self.through[cell] = set()
+        owners.add(owner)
+
+    def unindex(self, owner, cell):
+        owners = self.through.get(cell)
+        if owners is not None:
+            owners.discard(owner)
+            if not owners:
+                del self.through[cell]
+
+    def store(self, owner, path, leg=False):
+        # keeps a fresh path (owner's cell to the goal) and gives back the first step along it, None if there isn't one
+        self.forget(owner)
+        if not path or len(path) < 2:
+            return None
+        cells = [tuple(cell) for cell in path]
+        self.entries[owner] = [cells, 0, dict(zip(cells, range(len(cells)))), 0, leg]
+        # same as index() for each, but this is the slow part when a lot of paths come in at once
+        through = self.through
+        for cell in cells[1:] if leg else cells[1:-1]:
+            owners = through.get(cell)
+            if owners is None:
+                through[cell] = {owner}
+            else:
+                owners.add(owner)
+        return cells[1]
+
+    def forget(self, owner):
+        entry = self.entries.pop(owner, None)
+        if entry is not None:
+            cells, at = entry[0], entry[1]
+            for cell in cells[at + 1:] if entry[4] else cells[at + 1:-1]:
+                self.unindex(owner, cell)
+
+    def clear(self):
+        self.entries = {}
+        self.through = {}
+
+    def blocked(self, cell, mover=None):
+        # something that blocks is on cell now.  mover is whatever walked there, None for things that stay put (a
+        # corpse, a wall), which spoil every path over the cell
+        cell = tuple(cell)
+        owners = self.through.get(cell)
+        if owners:
+            for owner in list(owners):
+                if owner is mover:
+                    continue
+                entry = self.entries[owner]
+                if mover is None or entry[2][cell] - entry[1] <= self.lookahead:
+                    self.forget(owner)
+
+    def blocked_many(self, xs, ys, movers):
+        # blocked() for a whole crowd that stepped at once, xs and ys are arrays of where they went and movers the
+        # things in the same order.  hardly any of them land on somebody's path, so those cells get picked out first
+        # and only they go through blocked()
+        if not self.through or not len(xs):
+            return
+        cells = numpy.array(list(self.through), dtype=numpy.int64)
+        hits = numpy.isin((xs.astype(numpy.int64) << 32) | ys.astype(numpy.int64), (cells[:, 0] << 32) | cells[:, 1])
+        for i in numpy.flatnonzero(hits).tolist():
+            self.blocked((int(xs[i]), int(ys[i])), movers[i])
+
+    def truncate(self, owner, entry, end):
+        # drops everything after cells[end]
+        cells, where = entry[0], entry[2]
+        while len(cells) > end + 1:
+            cell = cells.pop()
+            if where.get(cell) == len(cells):
+                del where[cell]
+            self.unindex(owner, cell)
+
+    def miss(self, owner):
+        self.forget(owner)
+        self.misses += 1
+        return None
+
+    def follow(self, owner, start, goal, blocked):
+        # the next cell on owner's kept path from start to goal, patched up if the goal moved a little.  None means
+        # there's nothing usable kept and it needs a proper search (and store() after).  blocked is the blockmap now.
+        entry = self.entries.get(owner)
+        if entry is None:
+            self.misses += 1
+            return None
+        cells, at, where, leg = entry[0], entry[1], entry[2], entry[4]
+        if cells[at] != start:
+            # it took the step it was given
+            if at + 1 < (len(cells) if leg else len(cells) - 1) and cells[at + 1] == start:
+                at = entry[1] = at + 1
+                self.unindex(owner, start)
+            else:
+                return self.miss(owner)
+        old = cells[-1]
+        if old != goal and not leg:
+            if entry[3] >= self.refresh or abs(goal[0] - old[0]) + abs(goal[1] - old[1]) > self.repair_reach or \
+                    blocked[old]:
+                return self.miss(owner)
+            search = path_search(blocked, old, goal)
+            search.step(self.repair_limit)
+            if not search.found:
+                return self.miss(owner)
+            entry[3] += 1
+            # the old goal is in the middle of the path now
+            self.index(owner, old)
+            for cell in search.path()[1:]:
+                i = where.get(cell)
+                if i is not None and at <= i < len(cells):
+                    # came back on itself, cut the loop out
+                    self.truncate(owner, entry, i)
+                else:
+                    cells.append(cell)
+                    where[cell] = len(cells) - 1
+                    self.index(owner, cell)
+            self.unindex(owner, goal)
+        if at + 1 >= len(cells):
+            return self.miss(owner)
+        step = cells[at + 1]
+        # anything that got past blocked() (a tile changing, say)
+        if step != goal and blocked[step]:
+            return self.miss(owner)
+        self.hits += 1
+        return step
@@ -0,0 +1,84 @@
+import json
+import os
+from graphical2 import config
+from graphical2.objects import obj_entity, com_sprite, com_health, com_attack, com_ondeath, com_special
+
+# Prefabs: pre-made kinds of things (crab, skaven, ...) read from prefabs.json, so you can just say
+#   crab = PREFABS.spawn('crab', 3, 4)
+# instead of spelling out every sprite, offset and stat.
+#
+# Everything that's the same for every entity of a kind lives once in its prefab and is shared (flyweight).  That's
+# the attack, the ondeath and the special components, which are never changed once made.  Each entity only gets
+# its own position, sprite and health, because those change while playing (dying swaps the sprite for example).
+# So a thousand crabs share one com_attack and one com_ondeath instead of having a thousand of each.
+#
+# Sprites in the data file are names from config (S_CRAB), hp/attack are numbers, anything left out gets the same
+# default as the obj_entity/component arguments.
+
+PREFAB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prefabs.json')
+
+
+def sprite_named(name):
+    img = getattr(config, name, None) if name else None
+    if name and img is None:
+        raise ValueError("no sprite called %s in config" % name)
+    return img
+
+
+class prefab:
+    __slots__ = ('kind', 'name', 'img', 'spriteoffsetx', 'spriteoffsety', 'layering', 'blockpath', 'hp', 'ai_persona',
+                 'attack', 'ondeath', 'special')
+
+    def __init__(self, kind, name, sprite, spriteoffsetx=0, spriteoffsety=0, layering=0, blockpath=False, hp=None,
+                 attack=None, ai_persona="none", deathimg=None, deathoffsetx=0, deathoffsety=0,
+                 blockafterdeath=False, special=None):
+        self.kind = kind
+        self.name = name
+        self.img = sprite_named(sprite)
+        self.spriteoffsetx = spriteoffsetx
+        self.spriteoffsety = spriteoffsety
+        self.layering = layering
+        self.blockpath = blockpath
+        self.hp = hp
+        self.ai_persona = ai_persona
+        # the shared components, no owner since they belong to the whole kind
+        self.attack = com_attack(attack) if attack else None
+        self.ondeath = com_ondeath(sprite_named(deathimg), deathoffsetx, deathoffsety, blockafterdeath) \
+            if deathimg else None
+        self.special = com_special(special) if special else None
+
+    def spawn(self, x, y, name=None):
+        # a sprite and health of its own, the rest is the prefab's (shared, so obj_entity leaves their owner alone)
+        sprite = com_sprite(self.img, self.spriteoffsetx, self.spriteoffsety, self.layering)
+        health = com_health(self.hp) if self.hp is not None else None
+        ent = obj_entity(x, y, name or self.name, sprite, self.blockpath, health, None, self.ondeath, self.attack,
+                         self.ai_persona, self.special, shared=True)
+        ent.prefab = self
+        return ent
+
+
+class prefab_registry:
+    def __init__(self):
+        self.prefabs = {}  # kind -> prefab
+
+    def add(self, kind, **data):
+        self.prefabs[kind] = prefab(kind, **data)
+        return self.prefabs[kind]
+
+    def spawn(self, kind, x, y, name=None):
+        prefab = self.prefabs.get(kind)
+        if prefab is None:
+            raise ValueError("no prefab called %s" % kind)
+        return prefab.spawn(x, y, name)
+
+    def load(self, path=PREFAB_FILE):
+        with open(path) as f:
+            for kind, data in json.load(f).items():
+                try:
+                    self.add(kind, **data)
+                except TypeError as error:
+                    raise ValueError("prefab %s in %s: %s" % (kind, path, error)) from None
+        return self
+
+
+PREFABS = prefab_registry().load()
@@ -0,0 +1,116 @@
+import collections
+import json
+import time
+import pygame
+
+# Per-phase frame timings, so when a frame gets slow you can tell which part of the loop did it.
+#
+#   PROFILER.begin('move_objects')
+#   move_objects()
+#   PROFILER.end()
+#   ...
+#   PROFILER.end_frame(entities, particles)
+#
+# Phases can sit inside each other (ai_moves runs inside process_gamestate).  A phase only gets its own time, what
+# its inner phases took is taken off, so the numbers add up to the frame and nothing gets counted twice.
+#
+# Each phase keeps the last `window` frames and gives p50/p95/p99 of them.  overlay draws that on the screen (F1 in
+# main2) but only re-renders the text a couple of times a second, in between it blits the same surface.  dump()
+# writes the lot to a json file, main2 does that on exit.
+
+
+def percentile(ordered, point):
+    # nearest rank, ordered has to be sorted already
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * point / 100.0))]
+
+
+class frame_profiler:
+    def __init__(self, window=600):
+        self.window = window
+        self.samples = collections.OrderedDict()  # phase -> deque of seconds, one per frame the phase ran in
+        self.frame_times = collections.deque(maxlen=window)
+        self.counts = collections.deque(maxlen=window)  # (entities, particles)
+        self.stack = []  # [phase, start, time spent in inner phases]
+        self.this_frame = {}  # phase -> seconds so far this frame
+        self.frame_start = time.perf_counter()
+        self.frames = 0
+
+    def begin(self, phase):
+        self.stack.append([phase, time.perf_counter(), 0.0])
+
+    def end(self):
+        phase, start, inner = self.stack.pop()
+        spent = time.perf_counter() - start
+        if self.stack:
+            self.stack[-1][2] += spent
+        self.this_frame[phase] = self.this_frame.get(phase, 0.0) + spent - inner
+
+    def end_frame(self, entities=0, particles=0):
+        now = time.perf_counter()
+        for phase, seconds in self.this_frame.items():
+            samples = self.samples.get(phase)
+            if samples is None:
+                samples = self.samples[phase] = collections.deque(maxlen=self.window)
+            samples.append(seconds)
+        self.this_frame = {}
+        self.frame_times.append(now - self.frame_start)
+        self.counts.append((entities, particles))
+        self.frame_start = now
+        self.frames += 1
+
+    def stats(self, points=(50, 95, 99)):
+        # {'frame': {'p50': ms, ...}, phase: {...}, ..., 'entities': {...}, 'particles': {...}}
+        def summary(values, scale):
+            ordered = sorted(values)
+            return {'p%d' % point: round(percentile(ordered, point) * scale, 3) for point in points}
+        result = collections.OrderedDict()
+        result['frame'] = summary(self.frame_times, 1000.0)
+        for phase, samples in self.samples.items():
+            result[phase] = summary(samples, 1000.0)
+        result['entities'] = summary([entities for entities, particles in self.counts], 1)
+        result['particles'] = summary([particles for entities, particles in self.counts], 1)
+        return result
+
+    def dump(self, path):
+        report = {'frames': self.frames, 'window': self.window, 'ms': self.stats()}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+            f.write("\n")
+
+
+class overlay:
+    def __init__(self, profiler, font, every=0.5):
+        self.profiler = profiler
+        self.font = font
+        self.every = every
+        self.surface = None
+        self.rendered_at = None
+
+    def render(self):
+        stats = self.profiler.stats()
+        frame = stats['frame']['p50']
+        lines = ["%.0f fps  (p50 frame %.2f ms)" % (1000.0 / frame if frame else 0, frame)]
+        for phase, points in stats.items():
+            if phase in ('entities', 'particles'):
+                lines.append("%-18s %6d %6d %6d" % (phase, points['p50'], points['p95'], points['p99']))
+            else:
+                lines.append("%-18s %6.2f %6.2f %6.2f" % (phase, points['p50'], points['p95'], points['p99']))
+        rendered = [self.font.render(line, 0, (255, 255, 255)) for line in lines]
+        height = sum(text.get_height() for text in rendered)
+        width = max(text.get_width() for text in rendered)
+        surface = pygame.Surface((width + 8, height + 8))
+        surface.set_alpha(200)
+        y = 4
+        for text in rendered:
+            surface.blit(text, (4, y))
+            y += text.get_height()
+        self.surface = surface
+
+    def draw(self, surf, pos=(8, 8)):
+        now = time.perf_counter()
+        if self.surface is None or now - self.rendered_at >= self.every:
+            self.render()
+            self.rendered_at = now
+        surf.blit(self.surface, pos)
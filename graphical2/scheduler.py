@@ -0,0 +1,64 @@
+import heapq
+import time
+
+# Spreads the enemy turn over as many frames as it needs, so a lot of planning doesn't freeze the screen.
+#
+# Each ai decision is a generator (a job).  It does a bit of work and yields, and when it's done it returns what it
+# decided.  run(budget) keeps going through the jobs, most important first (lowest priority number, main2 uses the
+# distance to the player), until the frame's budget is used up, and picks up where it left off next frame.  The turn
+# is over once every job has returned.
+#
+# Whatever a job gets back from its yield says whether to hurry: once a turn has taken hurry_after frames, jobs get
+# True and should wrap up with what they've got (an anytime search hands back its best path so far, see pathing.py).
+#
+#   def job():
+#       while not search.step(200):
+#           hurry = yield
+#           if hurry:
+#               break
+#       return ai, search.best_path()
+
+
+class ai_scheduler:
+    def __init__(self, hurry_after=30):
+        self.hurry_after = hurry_after
+        self.jobs = []  # heap of [priority, order, generator, started]
+        self.results = []
+        self.frames = 0
+        self.order = 0
+
+    def start(self, jobs):
+        # jobs is (priority, generator) pairs.  anything left from before is thrown away.
+        self.jobs = []
+        self.results = []
+        self.frames = 0
+        for priority, job in jobs:
+            self.add(priority, job)
+
+    def add(self, priority, job):
+        self.order += 1
+        heapq.heappush(self.jobs, [priority, self.order, job, False])
+
+    def busy(self):
+        return bool(self.jobs)
+
+    def run(self, budget):
+        # works for about budget seconds, returns True once every job is finished
+        deadline = time.perf_counter() + budget
+        hurry = self.frames >= self.hurry_after
+        self.frames += 1
+        jobs = self.jobs
+        while jobs:
+            entry = jobs[0]
+            try:
+                if entry[3]:
+                    entry[2].send(hurry)
+                else:
+                    entry[3] = True
+                    next(entry[2])
+            except StopIteration as finished:
+                heapq.heappop(jobs)
+                self.results.append(finished.value)
+            if time.perf_counter() >= deadline:
+                return not jobs
+        return True
@@ -0,0 +1,62 @@
+import threading
+
+# Works out the enemy turn ahead of time, on another thread, while the game is just sat waiting for the player.
+#
+# When the player's turn starts main2 hands over a copy of the world (the blockmap and where the chasers are) and
+# the cells the player could end up on: where they are now (attacking or shooting leaves them there) and the four
+# next to it.  The worker goes through those cells and plans the whole enemy turn for each one.  Once the player has
+# done something, take() gives back the plan for the cell they're on, if it's finished.  Whether the world is still
+# the one the plans were made for is for main2 to check (see speculated_ai_turn), if anything else changed it just
+# plans the normal way.
+#
+# The worker only gets plain numbers and arrays, never touches the entities, so nothing needs locking except the
+# finished plans.  Starting again or cancel() just bumps the generation, an old worker notices at its next check
+# and stops without saving anything, there's no waiting on it.
+
+
+class speculator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.plans = {}  # cell -> whatever plan() gave back
+        self.world = None
+        self.thread = None
+
+    def start(self, world, cells, plan):
+        # plan(cell, stale) is run on the worker for each cell, it should give up (return anything) once stale()
+        # is True.  world is kept as it is, for checking against later.
+        with self.lock:
+            self.generation += 1
+            self.plans = {}
+            self.world = world
+            generation = self.generation
+        self.thread = threading.Thread(target=self.work, args=(generation, list(cells), plan), name='ai speculation',
+                                       daemon=True)
+        self.thread.start()
+
+    def stale(self, generation):
+        return generation != self.generation
+
+    def work(self, generation, cells, plan):
+        stale = lambda: self.stale(generation)
+        for cell in cells:
+            if stale():
+                return
+            result = plan(cell, stale)
+            with self.lock:
+                if stale():
+                    return
+                self.plans[cell] = result
+
+    def take(self, cell):
+        # the finished plan for cell or None, and the worker is stopped either way
+        with self.lock:
+            result = self.plans.get(tuple(cell))
+        self.cancel()
+        return result
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.plans = {}
+            self.world = None
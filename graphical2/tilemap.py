@@ -0,0 +1,108 @@
+import os
+import sys
+import numpy
+from numpy.lib import format as npformat
+
+# Tile layers for a level.  Instead of one floor/wall object per cell, the map lives in a few flat arrays:
+#   terrain  - terrain id per cell (see the T_* ids in config)
+#   passable - True if something can walk on the cell
+#   explored - True once the player has seen the cell
+# Arrays are indexed [x, y] (same as the ai blockmap and pygame.surfarray), so shape is (width, height).
+#
+# If a folder is given the layers are numpy.memmap files (plain .npy files, so numpy.load works on them too).
+# Opening one only reads the headers, and pages get loaded as the camera and the simulation touch them.  Several
+# processes (the server, an analysis tool...) can open the same folder read only and share the pages.
+#
+# Things built from the layers (the hierarchical pathfinder...) can watch() them.  set_tile and fill_rect tell every
+# watcher which rectangle changed, callback(x0, y0, x1, y1) with x1, y1 not included, so they only redo that bit.
+
+LAYERS = (('terrain', numpy.uint8), ('passable', numpy.bool_), ('explored', numpy.bool_))
+
+
+class tile_layers:
+    def __init__(self, terrain, passable, explored, folder=None):
+        self.terrain = terrain
+        self.passable = passable
+        self.explored = explored
+        self.folder = folder
+        self.width, self.height = terrain.shape
+        self.watchers = []
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_passable(self, x, y):
+        # off the map counts as a wall
+        return self.in_bounds(x, y) and bool(self.passable[x, y])
+
+    def set_tile(self, x, y, terrain, passable):
+        self.terrain[x, y] = terrain
+        self.passable[x, y] = passable
+        self.changed(x, y, x + 1, y + 1)
+
+    def fill_rect(self, x0, y0, x1, y1, terrain, passable):
+        # fills [x0, x1) by [y0, y1) in one go
+        self.terrain[x0:x1, y0:y1] = terrain
+        self.passable[x0:x1, y0:y1] = passable
+        self.changed(*self.clip(x0, y0, x1, y1))
+
+    def watch(self, callback):
+        self.watchers.append(callback)
+
+    def unwatch(self, callback):
+        if callback in self.watchers:
+            self.watchers.remove(callback)
+
+    def changed(self, x0, y0, x1, y1):
+        for callback in self.watchers:
+            callback(x0, y0, x1, y1)
+
+    def clip(self, x0, y0, x1, y1):
+        # clamps a rectangle to the map, handy for only touching what the camera can see
+        return max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height)
+
+    def mark_explored(self, x, y, radius):
+        x0, y0, x1, y1 = self.clip(x - radius, y - radius, x + radius + 1, y + radius + 1)
+        self.explored[x0:x1, y0:y1] = True
+
+    def flush(self):
+        # push dirty pages to disk, does nothing for in-memory layers
+        for name, dtype in LAYERS:
+            layer = getattr(self, name)
+            if isinstance(layer, numpy.memmap):
+                layer.flush()
+
+
+def layer_path(folder, name):
+    return os.path.join(folder, name + ".npy")
+
+
+# makes a new blank (all void, all blocked, nothing explored) set of layers.
+def new_layers(width, height, folder=None):
+    if folder is None:
+        arrays = [numpy.zeros((width, height), dtype=dtype) for name, dtype in LAYERS]
+    else:
+        os.makedirs(folder, exist_ok=True)
+        arrays = [npformat.open_memmap(layer_path(folder, name), mode='w+', dtype=dtype, shape=(width, height))
+                  for name, dtype in LAYERS]
+    return tile_layers(*arrays, folder=folder)
+
+
+# opens layers that were made with new_layers(folder=...).
+# mode is the numpy.memmap mode: 'r' read only, 'r+' read/write, 'c' copy on write (changes stay in this process)
+def open_layers(folder, mode='r'):
+    arrays = [npformat.open_memmap(layer_path(folder, name), mode=mode) for name, dtype in LAYERS]
+    shape = arrays[0].shape
+    for (name, dtype), array in zip(LAYERS, arrays):
+        if array.shape != shape or array.dtype != dtype:
+            raise ValueError("layer '%s' in %s is %s %s, expected %s %s" % (name, folder, array.shape, array.dtype,
+                                                                            shape, numpy.dtype(dtype)))
+    return tile_layers(*arrays, folder=folder)
+
+
+# quick look at a level on disk without loading it all: python -m graphical2.tilemap <folder>
+if __name__ == '__main__':
+    tiles = open_layers(sys.argv[1])
+    print("size:", tiles.width, "x", tiles.height)
+    print("passable cells:", int(numpy.count_nonzero(tiles.passable)))
+    print("explored cells:", int(numpy.count_nonzero(tiles.explored)))
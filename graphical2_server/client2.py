@@ -0,0 +1,70 @@
+import asyncio
+import argparse
+import random
+from graphical2_server import config
+from graphical2_server import net
+from graphical2_server import protocol
+
+
+# Bare bones client for the game server, mostly for checking it over loopback:
+#   python -m graphical2_server.client2 --bots 300 --seconds 10
+# Each bot connects, walks around at random and keeps its own copy of the world from the snapshots and deltas.
+
+class bot:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.player_id = None
+        self.seq = 0
+        self.frames = 0
+        self.bytes = 0
+        self.view = protocol.world_view()
+
+    async def run(self, seconds):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        mover = asyncio.ensure_future(self.move_loop(writer))
+        try:
+            await asyncio.wait_for(self.recv_loop(reader), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            mover.cancel()
+            writer.close()
+
+    async def recv_loop(self, reader):
+        while True:
+            payload = await net.read_frame(reader, 1 << 24)
+            self.frames += 1
+            self.bytes += len(payload) + net.HEADER.size
+            if payload[0] == protocol.MSG_WELCOME:
+                msg, self.player_id = protocol.WELCOME.unpack(payload)
+            else:
+                self.view.apply(payload)
+
+    async def move_loop(self, writer):
+        while True:
+            await asyncio.sleep(random.uniform(0.05, 0.3))
+            dx, dy = random.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+            self.seq = (self.seq + 1) & 0xffff
+            writer.write(net.frame(protocol.MOVE.pack(protocol.MSG_MOVE, self.seq, dx, dy)))
+            await writer.drain()
+
+
+async def run_bots(host, port, count, seconds):
+    bots = [bot(host, port) for i in range(count)]
+    results = await asyncio.gather(*[b.run(seconds) for b in bots], return_exceptions=True)
+    failed = [result for result in results if isinstance(result, Exception)]
+    frames = sum(b.frames for b in bots)
+    print("%d bots, %d failed, %d frames, %.1f KB/s per bot" % (
+        count, len(failed), frames, sum(b.bytes for b in bots) / 1024.0 / seconds / max(1, count)))
+    return bots
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Loopback bots for the game server")
+    parser.add_argument('--host', default=config.HOST)
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--bots', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+    net.run(run_bots(args.host, args.port, args.bots, args.seconds))
@@ -0,0 +1,30 @@
+HOST = '127.0.0.1'
+PORT = 1235
+# delayproxy.py listens here by default.  It's below PORT because shard.py's floor workers take the ports above it.
+PROXY_PORT = PORT - 1
+
+# simulation ticks per second
+TICK_RATE = 10
+MAP_SIZE = (64, 64)
+# wandering crabs to keep the world busy
+CRABS = 40
+
+# area of interest: chunk size in cells, the camera size a client gets until it tells us otherwise (800x600 at 64
+# pixel cells), and how far a player can see
+CHUNK_SIZE = 8
+VIEW_CELLS = (13, 10)
+MAX_VIEW_CELLS = 64
+FOV_RADIUS = 6
+
+# how many frames we queue for one client before we start dropping old ones (backpressure)
+SEND_QUEUE = 8
+# a client that's this many ticks behind gets kicked
+MAX_BEHIND_TICKS = 50
+# moves a client can have waiting, one gets applied per tick and any more than this are turned away (and acked)
+MOVE_QUEUE = 4
+# biggest frame we accept from a client, in bytes
+MAX_FRAME = 64 * 1024
+
+# print tick stats every this many ticks, and how many ticks the rolling stats cover
+STATS_EVERY = 100
+STATS_WINDOW = 1000
@@ -0,0 +1,100 @@
+import asyncio
+import argparse
+import collections
+import random
+from graphical2_server import config
+from graphical2_server import net
+
+
+# A TCP proxy that adds lag, for trying the client against a far away server without leaving the box.
+#   python -m graphical2_server.server2
+#   python -m graphical2_server.delayproxy --delay 150 --jitter 20
+#   python -m graphical2.netclient --port 1234
+#
+# --delay is the round trip in ms, half of it is added each way.  Jitter never reorders anything (TCP wouldn't
+# either), a chunk just can't go out before the one in front of it.
+
+
+class delayed_pipe:
+    def __init__(self, reader, writer, delay, jitter):
+        self.reader = reader
+        self.writer = writer
+        self.delay = delay
+        self.jitter = jitter
+        self.queue = collections.deque()
+        self.ready = asyncio.Event()
+        self.done = False
+
+    async def read_loop(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                due = loop.time() + max(0.0, self.delay + random.uniform(-self.jitter, self.jitter))
+                if self.queue:
+                    due = max(due, self.queue[-1][0])
+                self.queue.append((due, data))
+                self.ready.set()
+        except ConnectionError:
+            pass
+        self.done = True
+        self.ready.set()
+
+    async def write_loop(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while not (self.done and not self.queue):
+                if not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                due, data = self.queue[0]
+                wait = due - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.queue.popleft()
+                self.writer.write(data)
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+    async def run(self):
+        await asyncio.gather(self.read_loop(), self.write_loop())
+
+
+async def handle(client_reader, client_writer, target_host, target_port, delay, jitter):
+    try:
+        server_reader, server_writer = await asyncio.open_connection(target_host, target_port)
+    except OSError:
+        client_writer.close()
+        return
+    # half the round trip each way
+    await asyncio.gather(delayed_pipe(client_reader, server_writer, delay / 2.0, jitter / 2.0).run(),
+                         delayed_pipe(server_reader, client_writer, delay / 2.0, jitter / 2.0).run())
+
+
+async def run_proxy(listen_port, target_host, target_port, delay_ms, jitter_ms):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle(reader, writer, target_host, target_port, delay_ms / 1000.0, jitter_ms / 1000.0),
+        config.HOST, listen_port)
+    print("delaying", listen_port, "->", target_host, target_port, "by", delay_ms, "ms round trip")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="TCP proxy that adds latency")
+    parser.add_argument('--listen', type=int, default=config.PROXY_PORT)
+    parser.add_argument('--host', default=config.HOST)
+    parser.add_argument('--port', type=int, default=config.PORT, help="where the real server is")
+    parser.add_argument('--delay', type=float, default=150.0, help="round trip delay in ms")
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- ms on the round trip")
+    args = parser.parse_args()
+    net.run(run_proxy(args.listen, args.host, args.port, args.delay, args.jitter))
@@ -0,0 +1,113 @@
+from graphical2_server import protocol
+
+# Area of interest: which entities each client actually needs to hear about.
+#
+# The map is cut into square chunks and every entity is filed under the chunk it stands in.  Each client covers the
+# chunks under its camera (and its field of view around the player), and only gets spawns, updates and removes for
+# entities in those chunks.  Working out a client's delta only looks at those chunks, so it costs about the number of
+# entities near the client and not the size of the world.
+#
+# When something walks into a client's area the client gets it as a spawn (an enter event), and when it walks out
+# (or is gone) the client gets a remove (an exit event).
+
+
+class chunk_grid:
+    def __init__(self, size):
+        self.size = size
+        self.chunks = {}  # (cx, cy) -> set of ids
+        self.where = {}  # id -> (cx, cy)
+
+    def chunk_of(self, x, y):
+        return x // self.size, y // self.size
+
+    def place(self, entity_id, x, y):
+        chunk = self.chunk_of(x, y)
+        old = self.where.get(entity_id)
+        if old == chunk:
+            return
+        if old is not None:
+            self.take_out(entity_id, old)
+        self.chunks.setdefault(chunk, set()).add(entity_id)
+        self.where[entity_id] = chunk
+
+    def remove(self, entity_id):
+        old = self.where.pop(entity_id, None)
+        if old is not None:
+            self.take_out(entity_id, old)
+
+    def take_out(self, entity_id, chunk):
+        ids = self.chunks[chunk]
+        ids.discard(entity_id)
+        if not ids:
+            del self.chunks[chunk]
+
+    def chunks_covering(self, x0, y0, x1, y1):
+        # every chunk touching the cells x0..x1, y0..y1 (inclusive)
+        cx0, cy0 = self.chunk_of(x0, y0)
+        cx1, cy1 = self.chunk_of(x1, y1)
+        return {(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)}
+
+
+class interest:
+    def __init__(self, grid, view_width, view_height, fov_radius, on_enter=None, on_exit=None):
+        self.grid = grid
+        # camera size in cells, the client can change it
+        self.view_width = view_width
+        self.view_height = view_height
+        self.fov_radius = fov_radius
+        self.chunks = set()
+        # id -> record, what this client currently knows about
+        self.known = {}
+        # optional callbacks, called with (interest, list of ids)
+        self.on_enter = on_enter
+        self.on_exit = on_exit
+
+    def focus(self, x, y):
+        # the camera follows the player, and the player can see fov_radius around them either way
+        half_w = max(self.view_width // 2 + 1, self.fov_radius)
+        half_h = max(self.view_height // 2 + 1, self.fov_radius)
+        self.chunks = self.grid.chunks_covering(x - half_w, y - half_h, x + half_w, y + half_h)
+
+    def visible(self):
+        chunks = self.grid.chunks
+        for chunk in self.chunks:
+            ids = chunks.get(chunk)
+            if ids:
+                yield from ids
+
+    def snapshot(self, lookup):
+        # start over: the client gets everything in its area.  returns (id, record) pairs for encode_snapshot
+        self.known = {entity_id: lookup(entity_id) for entity_id in self.visible()}
+        if self.on_enter and self.known:
+            self.on_enter(self, list(self.known))
+        return self.known.items()
+
+    def delta(self, lookup, tick_updates):
+        # lookup(id) is the current record, tick_updates is id -> (old record, new record, encoded update) for
+        # everything that changed this tick.  returns (spawned, update parts, removed) for encode_delta_parts.
+        known = self.known
+        spawned, parts = [], []
+        seen = set()
+        for entity_id in self.visible():
+            seen.add(entity_id)
+            if entity_id not in known:
+                record = lookup(entity_id)
+                known[entity_id] = record
+                spawned.append((entity_id, record))
+            elif entity_id in tick_updates:
+                old, new, encoded = tick_updates[entity_id]
+                if known[entity_id] == old:
+                    # same as everybody else, so reuse the bytes
+                    parts.append(encoded)
+                else:
+                    parts.append(protocol.encode_update(entity_id, known[entity_id], new))
+                known[entity_id] = new
+        removed = [entity_id for entity_id in known if entity_id not in seen]
+        for entity_id in removed:
+            del known[entity_id]
+        if self.on_enter and spawned:
+            self.on_enter(self, [entity_id for entity_id, record in spawned])
+        if self.on_exit and removed:
+            self.on_exit(self, removed)
+        return spawned, parts, removed
+
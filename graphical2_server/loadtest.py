@@ -0,0 +1,233 @@
+import asyncio
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from graphical2_server import config
+from graphical2_server import net
+from graphical2_server import protocol
+from graphical2_server.server2 import percentiles
+
+# Load test for the game server: lots of scripted bots over loopback, then a report.
+#   python -m graphical2_server.loadtest --bots 500 --seconds 30 --report load_500.json
+#   python -m graphical2_server.loadtest --bots 500 --seconds 30 --compare load_500.json
+#
+# By default it starts its own server (python -m graphical2_server.server2) so the bots and the server don't fight
+# over the same core, use --port without --spawn-server to point it at one that's already running.
+#
+# Bots connect, wander about, go for whatever is next to them (attacking is just walking into it) and leave after a
+# while, and a new bot takes their place so the count stays the same.
+#
+# The report has connect latency, tick to client latency (how long after the server started a tick the update
+# landed, works because both ends share a clock), bytes per client per second and the server's own cpu use and tick
+# times.  It's plain json with sorted keys so two runs can be diffed, or use --compare.
+
+
+class load_bot:
+    def __init__(self, host, port, results):
+        self.host = host
+        self.port = port
+        self.results = results
+        self.player_id = None
+        self.seq = 0
+        self.view = protocol.world_view()
+
+    async def run(self, lifetime):
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        mover = None
+        received = 0
+        try:
+            payload = await net.read_frame(reader, 1 << 24)
+            msg, self.player_id = protocol.WELCOME.unpack(payload)
+            connected = time.perf_counter()
+            self.results['connect'].append(connected - started)
+            mover = asyncio.ensure_future(self.move_loop(writer))
+            end = connected + lifetime
+            while True:
+                left = end - time.perf_counter()
+                if left <= 0:
+                    break
+                try:
+                    payload = await asyncio.wait_for(net.read_frame(reader, 1 << 24), left)
+                except asyncio.TimeoutError:
+                    break
+                received += len(payload) + net.HEADER.size
+                msg = self.view.apply(payload)
+                if msg in (protocol.MSG_SNAPSHOT, protocol.MSG_DELTA):
+                    self.results['tick latency'].append(protocol.age_ms(self.view.ms) / 1000.0)
+                elif msg == protocol.MSG_WELCOME:
+                    # new floor (see shard.py), new player id
+                    msg, self.player_id = protocol.WELCOME.unpack(payload)
+            self.results['bytes per second'].append(received / max(0.001, time.perf_counter() - connected))
+        finally:
+            if mover:
+                mover.cancel()
+            writer.close()
+
+    def next_move(self):
+        me = self.view.entities.get(self.player_id)
+        if me and random.random() < 0.5:
+            # anything right next to us gets hit
+            for entity_id, (x, y, hp, state) in self.view.entities.items():
+                if entity_id != self.player_id and not state & protocol.STATE_DEAD \
+                        and abs(x - me[0]) + abs(y - me[1]) == 1:
+                    return x - me[0], y - me[1]
+        return random.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+
+    async def move_loop(self, writer):
+        while True:
+            await asyncio.sleep(random.uniform(0.1, 0.5))
+            dx, dy = self.next_move()
+            self.seq = (self.seq + 1) & 0xffff
+            writer.write(net.frame(protocol.MOVE.pack(protocol.MSG_MOVE, self.seq, dx, dy)))
+            await writer.drain()
+
+
+async def ask_stats(host, port):
+    # the stats connection is just another client, so it shows up as one extra player
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(net.frame(protocol.STATS.pack(protocol.MSG_STATS)))
+        while True:
+            payload = await net.read_frame(reader, 1 << 24)
+            if payload[0] == protocol.MSG_STATS_REPLY:
+                return json.loads(payload[1:].decode('utf-8'))
+    finally:
+        writer.close()
+
+
+async def keep_bots_going(host, port, results, seconds, lifetime):
+    # runs one bot after another in the same slot until time's up
+    end = time.perf_counter() + seconds
+    while True:
+        left = end - time.perf_counter()
+        if left <= 0:
+            return
+        try:
+            await load_bot(host, port, results).run(min(left, random.uniform(*lifetime)))
+        except (OSError,) + net.BROKEN:
+            results['failed'] += 1
+            await asyncio.sleep(0.1)
+
+
+async def load_test(host, port, bots, seconds, lifetime, ramp):
+    results = {'connect': [], 'tick latency': [], 'bytes per second': [], 'failed': 0}
+    before = await ask_stats(host, port)
+    started = time.perf_counter()
+    slots = []
+    for i in range(bots):
+        slots.append(asyncio.ensure_future(keep_bots_going(host, port, results, seconds, lifetime)))
+        # don't slam the listen backlog with every connection at once
+        if ramp:
+            await asyncio.sleep(ramp / bots)
+    await asyncio.gather(*slots)
+    wall = time.perf_counter() - started
+    after = await ask_stats(host, port)
+
+    cpu = after['cpu s'] - before['cpu s']
+    return {
+        'bots': bots,
+        'seconds': round(wall, 1),
+        'failed connections': results['failed'],
+        'connections': len(results['connect']),
+        'connect ms': rounded(percentiles(results['connect'])),
+        'tick to client ms': rounded(percentiles(results['tick latency'])),
+        'bytes per client per second': rounded(percentiles(results['bytes per second']), scale=0.001),
+        'server cpu s': round(cpu, 2),
+        'server cpu percent': round(100.0 * cpu / wall, 1),
+        'server tick ms': {'p' + key: round(value, 3) for key, value in after['tick ms'].items()},
+        'server late ms': {'p' + key: round(value, 3) for key, value in after['late ms'].items()},
+        'server dropped frames': after['dropped frames'] - before['dropped frames'],
+        'server dropped moves': after['dropped moves'] - before['dropped moves'],
+    }
+
+
+def rounded(points, scale=1.0):
+    # percentiles() gives milliseconds from seconds, scale undoes that for things that aren't times
+    return {'p%d' % point: round(value * scale, 3) for point, value in points.items()}
+
+
+def flatten(report, prefix=''):
+    flat = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + ' '))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old, new):
+    old, new = flatten(old), flatten(new)
+    for key in sorted(set(old) | set(new)):
+        a, b = old.get(key), new.get(key)
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)) and a:
+            print("%-40s %12s %12s %+8.1f%%" % (key, a, b, 100.0 * (b - a) / abs(a)))
+        else:
+            print("%-40s %12s %12s" % (key, a, b))
+
+
+def raise_file_limit():
+    # every bot is a socket on both ends, the default limit of 1024 runs out fast
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def start_server(port, tick_rate):
+    server = subprocess.Popen([sys.executable, '-m', 'graphical2_server.server2', '--port', str(port),
+                               '--tick-rate', str(tick_rate)],
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              stdout=subprocess.DEVNULL)
+    # wait for it to start listening
+    for i in range(100):
+        try:
+            net.run(ask_stats(config.HOST, port))
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server didn't start")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the game server with bots over loopback")
+    parser.add_argument('--host', default=config.HOST)
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--spawn-server', action='store_true', default=None,
+                        help="start a server for the test (the default unless --port is given)")
+    parser.add_argument('--tick-rate', type=int, default=config.TICK_RATE, help="for the spawned server")
+    parser.add_argument('--bots', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=30.0)
+    parser.add_argument('--lifetime', type=float, nargs=2, default=(5.0, 20.0),
+                        help="bots stay connected between these many seconds")
+    parser.add_argument('--ramp', type=float, default=2.0, help="seconds to spread the first connections over")
+    parser.add_argument('--report', help="write the report here")
+    parser.add_argument('--compare', help="compare against an earlier report")
+    args = parser.parse_args()
+    if args.spawn_server is None:
+        args.spawn_server = '--port' not in sys.argv
+
+    raise_file_limit()
+    server = start_server(args.port, args.tick_rate) if args.spawn_server else None
+    try:
+        report = net.run(load_test(args.host, args.port, args.bots, args.seconds, args.lifetime, args.ramp))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    text = json.dumps(report, indent=1, sort_keys=True)
+    print(text)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,45 @@
+import asyncio
+import struct
+
+# Framing for the game's TCP connections.  Every frame is a 4 byte big endian length followed by the payload.
+# What goes in the payload is in protocol.py.  A payload always has at least its message type byte, so an empty frame
+# is as bad as one that's too big.
+
+HEADER = struct.Struct('!I')
+
+# what a connection going away, or the other end sending nonsense, looks like.  Handlers catch all of these and hang
+# up, a broken message shouldn't take anything else down with it.
+BROKEN = (asyncio.IncompleteReadError, ConnectionError, ValueError, IndexError, struct.error)
+
+
+def frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader, max_size):
+    # raises asyncio.IncompleteReadError when the other end goes away
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if size > max_size:
+        raise ValueError("frame of %d bytes is too big" % size)
+    if not size:
+        raise ValueError("empty frame")
+    return await reader.readexactly(size)
+
+
+# same as asyncio.run, which needs python 3.7 (the project's interpreter is 3.6).  Like it, anything still running
+# when the coroutine returns gets cancelled and waited for, so connections close properly.
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        try:
+            all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+            left = [task for task in all_tasks(loop) if not task.done()]
+            for task in left:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*left, return_exceptions=True))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -1,21 +1,31 @@
+import itertools
+
+# every actor gets a unique id, this is how clients refer to them
+_IDS = itertools.count(1)
+
+
 class actor:
 
-    def __init__(self, x, y, health=None, inventory=None):
+    def __init__(self, x, y, objtype="actor", health=None, inventory=None, ai_persona="none", attack=0):
 
+        self.id = next(_IDS)
         self.x = x
         self.y = y
+        self.dx = 0
+        self.dy = 0
+        self.type = objtype
+        self.ai_persona = ai_persona
+        self.attack = attack
 
-        if health:
-            self.health = health
-
-        if inventory:
-            self.inventory = inventory
+        self.health = health
+        self.inventory = inventory
 
 
 class com_health:
 
     def __init__(self, maxhp, currenthp=None):
         self.maxhp = maxhp
+        self.dead = False
         if currenthp:
             self.currenthp = currenthp
         else:
@@ -0,0 +1,244 @@
+import struct
+import time
+import zlib
+
+# The wire protocol, everything is struct packed big endian inside net.py's length prefixed frames.
+# The first byte of every payload is the message type.
+#
+# On join a client gets a full snapshot.  After that every tick it only gets a delta with the entities that showed
+# up, changed or went away, so bandwidth depends on how much is going on and not on how big the world is.
+#
+# An entity on the wire is a record: (x, y, hp, state)
+#   x, y  - cell position, 0..65535
+#   hp    - clamped to one byte
+#   state - low 4 bits is the kind (what sprite to draw), STATE_DEAD is set once it's a corpse
+#
+# A delta update starts with the id and a change mask, then only the fields the mask says changed:
+#   CH_STEP   one byte, dx and dy as nibbles (-8..7), for the usual one cell move
+#   CH_POS    two shorts, absolute position for anything that jumped further
+#   CH_HP     one byte
+#   CH_STATE  one byte
+
+# Snapshots and deltas also carry the server's wall clock in milliseconds (wrapping at 2**32) from when the tick
+# started, so tools on the same box can tell how long an update took to arrive.
+#
+# Every move a client sends has a sequence number (wrapping at 2**16).  Snapshots and deltas carry the sequence
+# number of the last move the server has applied for that client, so the client can tell which of its moves are
+# already in the positions it got (see graphical2/netclient.py).
+
+# client -> server
+MSG_MOVE = 1  # sequence number, dx, dy
+MSG_VIEW = 2  # camera width, height in cells
+MSG_STATS = 3  # please send MSG_STATS_REPLY
+MSG_JOIN = 4  # from shard.py's front: this player is coming from another floor with this much hp
+# server -> client
+MSG_WELCOME = 100  # your player id
+MSG_SNAPSHOT = 101  # tick, ms, ack, count, then count entities
+MSG_DELTA = 102  # tick, ms, ack, spawn count, update count, remove count, then the spawns, updates and removes
+MSG_STATS_REPLY = 103  # server stats as json, for tools
+MSG_HANDOFF = 104  # to shard.py's front: this player went down a trapdoor to this floor with this much hp
+MSG_MAP = 105  # width, height, then the terrain layer zlib compressed, sent after the welcome
+
+MOVE = struct.Struct('!BHbb')
+VIEW = struct.Struct('!BHH')
+WELCOME = struct.Struct('!BI')
+STATS = struct.Struct('!B')
+JOIN = struct.Struct('!Bh')
+HANDOFF = struct.Struct('!BHh')
+SNAPSHOT_HEADER = struct.Struct('!BIIHI')
+DELTA_HEADER = struct.Struct('!BIIHIII')
+MAP_HEADER = struct.Struct('!BHH')
+ENTITY = struct.Struct('!IHHBB')
+UPDATE = struct.Struct('!IB')
+POS = struct.Struct('!HH')
+BYTE = struct.Struct('!B')
+ID = struct.Struct('!I')
+
+CH_STEP = 1
+CH_POS = 2
+CH_HP = 4
+CH_STATE = 8
+
+STATE_DEAD = 0x80
+KIND_MASK = 0x0f
+
+
+def make_state(kind, dead):
+    return (kind & KIND_MASK) | (STATE_DEAD if dead else 0)
+
+
+def quantize_hp(hp):
+    return max(0, min(255, hp))
+
+
+def quantize_pos(value):
+    return max(0, min(65535, value))
+
+
+def clock_ms():
+    return int(time.time() * 1000) & 0xffffffff
+
+
+# how many ms ago a stamp from clock_ms was
+def age_ms(stamp):
+    return (clock_ms() - stamp) & 0xffffffff
+
+
+# True if move sequence number seq came after ack
+def seq_after(seq, ack):
+    return 0 < ((seq - ack) & 0xffff) < 0x8000
+
+
+###########################
+####     ENCODING      ####
+###########################
+
+# entities is an iterable of (id, (x, y, hp, state))
+def encode_snapshot(tick, entities, ms=0, ack=0):
+    entities = list(entities)
+    parts = [SNAPSHOT_HEADER.pack(MSG_SNAPSHOT, tick, ms, ack, len(entities))]
+    pack = ENTITY.pack
+    for entity_id, (x, y, hp, state) in entities:
+        parts.append(pack(entity_id, x, y, hp, state))
+    return b''.join(parts)
+
+
+def encode_update(entity_id, old, new):
+    x, y, hp, state = new
+    mask = 0
+    fields = []
+    dx, dy = x - old[0], y - old[1]
+    if dx or dy:
+        if -8 <= dx <= 7 and -8 <= dy <= 7:
+            mask |= CH_STEP
+            fields.append(BYTE.pack(((dx & 0xf) << 4) | (dy & 0xf)))
+        else:
+            mask |= CH_POS
+            fields.append(POS.pack(x, y))
+    if hp != old[2]:
+        mask |= CH_HP
+        fields.append(BYTE.pack(hp))
+    if state != old[3]:
+        mask |= CH_STATE
+        fields.append(BYTE.pack(state))
+    return UPDATE.pack(entity_id, mask) + b''.join(fields)
+
+
+# spawned is (id, record) pairs, updated is (id, old record, new record), removed is ids.
+def encode_delta(tick, spawned, updated, removed, ms=0, ack=0):
+    return encode_delta_parts(tick, spawned, [encode_update(entity_id, old, new) for entity_id, old, new in updated],
+                              removed, ms, ack)
+
+
+# same as encode_delta but the updates are already encoded (so they can be shared between clients)
+def encode_delta_parts(tick, spawned, update_parts, removed, ms=0, ack=0):
+    parts = [DELTA_HEADER.pack(MSG_DELTA, tick, ms, ack, len(spawned), len(update_parts), len(removed))]
+    pack = ENTITY.pack
+    for entity_id, (x, y, hp, state) in spawned:
+        parts.append(pack(entity_id, x, y, hp, state))
+    parts += update_parts
+    for entity_id in removed:
+        parts.append(ID.pack(entity_id))
+    return b''.join(parts)
+
+
+# keeps track of what has been sent so far and works out the delta for the next tick
+class delta_tracker:
+    def __init__(self):
+        # id -> record, what the clients currently believe
+        self.sent = {}
+
+    def diff(self, lookup, changed_ids):
+        # lookup(id) gives the current record (or None if it's gone), changed_ids is what might have changed since
+        # last time.  returns (spawned, updated, removed) for encode_delta and updates what the clients know.
+        spawned, updated, removed = [], [], []
+        for entity_id in changed_ids:
+            new = lookup(entity_id)
+            old = self.sent.get(entity_id)
+            if new is None:
+                if old is not None:
+                    removed.append(entity_id)
+                    del self.sent[entity_id]
+            elif old is None:
+                spawned.append((entity_id, new))
+                self.sent[entity_id] = new
+            elif old != new:
+                updated.append((entity_id, old, new))
+                self.sent[entity_id] = new
+        return spawned, updated, removed
+
+
+# terrain is a tilemap layer, indexed [x, y]
+def encode_map(terrain):
+    width, height = terrain.shape
+    return MAP_HEADER.pack(MSG_MAP, width, height) + zlib.compress(terrain.tobytes())
+
+
+###########################
+####     DECODING      ####
+###########################
+
+# gives back (width, height, terrain bytes), numpy.frombuffer(terrain, numpy.uint8).reshape(width, height) to use it
+def decode_map(payload):
+    msg, width, height = MAP_HEADER.unpack_from(payload)
+    return width, height, zlib.decompress(payload[MAP_HEADER.size:])
+
+
+# the client's picture of the world, fed with every snapshot and delta payload that comes in
+class world_view:
+    def __init__(self):
+        self.tick = None
+        self.ms = None  # server clock when that tick started
+        self.ack = 0  # last of our moves the server has applied
+        self.entities = {}  # id -> [x, y, hp, state]
+
+    def apply(self, payload):
+        msg = payload[0]
+        if msg == MSG_SNAPSHOT:
+            self.apply_snapshot(payload)
+        elif msg == MSG_DELTA:
+            self.apply_delta(payload)
+        return msg
+
+    def apply_snapshot(self, payload):
+        msg, self.tick, self.ms, self.ack, count = SNAPSHOT_HEADER.unpack_from(payload)
+        entities = {}
+        unpack = ENTITY.unpack_from
+        offset = SNAPSHOT_HEADER.size
+        for i in range(count):
+            entity_id, x, y, hp, state = unpack(payload, offset)
+            entities[entity_id] = [x, y, hp, state]
+            offset += ENTITY.size
+        self.entities = entities
+
+    def apply_delta(self, payload):
+        msg, self.tick, self.ms, self.ack, spawns, updates, removes = DELTA_HEADER.unpack_from(payload)
+        entities = self.entities
+        offset = DELTA_HEADER.size
+        unpack = ENTITY.unpack_from
+        for i in range(spawns):
+            entity_id, x, y, hp, state = unpack(payload, offset)
+            entities[entity_id] = [x, y, hp, state]
+            offset += ENTITY.size
+        for i in range(updates):
+            entity_id, mask = UPDATE.unpack_from(payload, offset)
+            offset += UPDATE.size
+            ent = entities[entity_id]
+            if mask & CH_STEP:
+                step = payload[offset]
+                ent[0] += ((step >> 4) ^ 8) - 8
+                ent[1] += ((step & 0xf) ^ 8) - 8
+                offset += 1
+            if mask & CH_POS:
+                ent[0], ent[1] = POS.unpack_from(payload, offset)
+                offset += POS.size
+            if mask & CH_HP:
+                ent[2] = payload[offset]
+                offset += 1
+            if mask & CH_STATE:
+                ent[3] = payload[offset]
+                offset += 1
+        for i in range(removes):
+            entity_id, = ID.unpack_from(payload, offset)
+            entities.pop(entity_id, None)
+            offset += ID.size
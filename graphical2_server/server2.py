@@ -1,13 +1,304 @@
-import pygame
-import graphical2_server.objects
-import socket
+import asyncio
+import argparse
+import collections
+import json
+import time
+from graphical2_server import config
+from graphical2_server import interest
+from graphical2_server import net
+from graphical2_server import protocol
+from graphical2_server import world
 
 
-#setup server
+# The authoritative game server.  One asyncio loop owns the world, steps it at a fixed tick rate and talks to every
+# client over TCP, so there's no thread per socket and hundreds of connections fit on one core.
+#
+# Clients only hear about what's near them, see interest.py.
+#
+# Backpressure: each client has a small queue of frames waiting to go out.  If a client can't keep up the snapshots and
+# deltas in its queue are thrown away and it gets a fresh snapshot instead of the deltas it missed, and if it stays
+# behind it gets kicked.  The welcome, the map and a handoff stay queued, nothing later would make up for those.
 
-#main game loop
+# the frames a later snapshot replaces, everything else has to get there
+WORLD_FRAMES = (protocol.MSG_SNAPSHOT, protocol.MSG_DELTA)
+
+
+def world_frame(data):
+    return data[net.HEADER.size] in WORLD_FRAMES
+
+
+###############################################################################################################
+#                                               CLIENTS
+###############################################################################################################
+
+class client_conn:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+        self.player = None
+        self.interest = interest.interest(server.grid, config.VIEW_CELLS[0], config.VIEW_CELLS[1], config.FOV_RADIUS)
+        self.outgoing = collections.deque()
+        # (seq, dx, dy) waiting for the next tick, dx and dy are None for a move that was turned away.  waiting is how
+        # many in there will really be applied, and ack is the seq of the last one we're done with.
+        self.moves = collections.deque()
+        self.waiting = 0
+        self.ack = 0
+        self.dropped_moves = 0
+        self.ready = asyncio.Event()
+        self.closed = False
+        # new clients (and ones that missed deltas) need a full snapshot before deltas make sense
+        self.needs_snapshot = True
+        # ticks in a row we had to drop frames for this client
+        self.behind = 0
+        self.dropped = 0
+
+    def send(self, data):
+        # queue a frame, never blocks the tick
+        if self.closed:
+            return
+        if len(self.outgoing) >= config.SEND_QUEUE:
+            # the deltas only work as a chain, so skipping one means starting over from a snapshot
+            kept = collections.deque(frame for frame in self.outgoing if not world_frame(frame))
+            self.dropped += len(self.outgoing) - len(kept)
+            self.outgoing = kept
+            self.needs_snapshot = True
+            self.behind += 1
+            if self.behind > config.MAX_BEHIND_TICKS:
+                print(self.address, "is too far behind, kicking")
+                self.close()
+                return
+            if world_frame(data):
+                # and this frame goes too, the snapshot next tick replaces it
+                self.dropped += 1
+                return
+        else:
+            self.behind = 0
+        self.outgoing.append(data)
+        self.ready.set()
+
+    async def send_loop(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.outgoing:
+                    self.writer.write(self.outgoing.popleft())
+                # waits here while the socket buffer is full, that's where the backpressure comes from
+                await self.writer.drain()
+        except ConnectionError:
+            self.close()
+
+    async def recv_loop(self):
+        while not self.closed:
+            payload = await net.read_frame(self.reader, config.MAX_FRAME)
+            if self.player is None:
+                # handed off to another floor, just waiting for the front to hang up
+                continue
+            if payload[0] == protocol.MSG_MOVE and len(payload) == protocol.MOVE.size:
+                msg, seq, dx, dy = protocol.MOVE.unpack(payload)
+                self.add_move(seq, dx, dy)
+            elif payload[0] == protocol.MSG_JOIN and len(payload) == protocol.JOIN.size:
+                msg, hp = protocol.JOIN.unpack(payload)
+                self.player.health.currenthp = max(1, min(hp, self.player.health.maxhp))
+                self.server.world.changed.add(self.player.id)
+            elif payload[0] == protocol.MSG_VIEW and len(payload) == protocol.VIEW.size:
+                msg, width, height = protocol.VIEW.unpack(payload)
+                self.interest.view_width = min(width, config.MAX_VIEW_CELLS)
+                self.interest.view_height = min(height, config.MAX_VIEW_CELLS)
+            elif payload[0] == protocol.MSG_STATS:
+                stats = json.dumps(self.server.stats()).encode('utf-8')
+                self.send(net.frame(protocol.STATS.pack(protocol.MSG_STATS_REPLY) + stats))
+
+    def add_move(self, seq, dx, dy):
+        # one move gets applied per tick.  If a client sends faster than that and the queue is full, the new move is
+        # turned away, but it still gets acked in its turn like the others.  So the client's prediction stops
+        # replaying it and ends up where the server says it is, instead of snapping back for no reason.
+        if self.waiting < config.MOVE_QUEUE:
+            self.moves.append((seq, dx, dy))
+            self.waiting += 1
+            return
+        self.dropped_moves += 1
+        if self.moves and self.moves[-1][1] is None:
+            # turned away ones in a row only need the newest acked
+            self.moves[-1] = (seq, None, None)
+        else:
+            self.moves.append((seq, None, None))
+
+    def next_move(self):
+        # (dx, dy) to apply this tick or None, and moves the ack past it and any turned away ones after it
+        move = None
+        while self.moves and move is None:
+            seq, dx, dy = self.moves.popleft()
+            self.ack = seq
+            if dx is not None:
+                self.waiting -= 1
+                move = (dx, dy)
+        while self.moves and self.moves[0][1] is None:
+            self.ack = self.moves.popleft()[0]
+        return move
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.ready.set()
+            self.writer.close()
+
+
+###############################################################################################################
+#                                               SERVER
+###############################################################################################################
+
+class game_server:
+    def __init__(self, game_world, host=config.HOST, port=config.PORT, tick_rate=config.TICK_RATE):
+        self.world = game_world
+        self.host = host
+        self.port = port
+        self.tick_rate = tick_rate
+        self.clients = set()
+        # player id -> client
+        self.players = {}
+        self.server = None
+        self.tracker = protocol.delta_tracker()
+        self.grid = interest.chunk_grid(config.CHUNK_SIZE)
+        self.map_frame = net.frame(protocol.encode_map(self.world.tiles.terrain))
+        # rolling per tick stats: how long the tick took, and how late it started
+        self.tick_times = collections.deque(maxlen=config.STATS_WINDOW)
+        self.tick_late = collections.deque(maxlen=config.STATS_WINDOW)
+        # frames and moves dropped for clients that have since left
+        self.dropped_gone = 0
+        self.dropped_moves_gone = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 backlog=1024)
+        # port 0 means pick one, so remember what we got
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle_client(self, reader, writer):
+        client = client_conn(self, reader, writer)
+        client.player = self.world.add_player()
+        self.clients.add(client)
+        self.players[client.player.id] = client
+        client.send(net.frame(protocol.WELCOME.pack(protocol.MSG_WELCOME, client.player.id)))
+        client.send(self.map_frame)
+        sender = asyncio.ensure_future(client.send_loop())
+        try:
+            await client.recv_loop()
+        except net.BROKEN:
+            pass
+        finally:
+            client.close()
+            sender.cancel()
+            self.clients.discard(client)
+            self.dropped_gone += client.dropped
+            self.dropped_moves_gone += client.dropped_moves
+            if client.player:
+                del self.players[client.player.id]
+                self.world.remove(client.player.id)
+
+    def record(self, actor_id):
+        # what clients get to know about an actor
+        act = self.world.actors.get(actor_id)
+        if act is None:
+            return None
+        return (protocol.quantize_pos(act.x), protocol.quantize_pos(act.y), protocol.quantize_hp(act.health.currenthp),
+                protocol.make_state(world.KINDS.get(act.type, 0), act.health.dead))
+
+    def tick(self):
+        ms = protocol.clock_ms()
+        for client in self.clients:
+            if client.moves and client.player:
+                move = client.next_move()
+                if move:
+                    self.world.queue_move(client.player.id, move[0], move[1])
+        self.world.step()
+        tick = self.world.tick
+        # only look at what changed: keep the chunk grid up to date and encode each update once
+        spawned, updated, removed = self.tracker.diff(self.record, self.world.changed)
+        self.world.changed.clear()
+        for entity_id, (x, y, hp, state) in spawned:
+            self.grid.place(entity_id, x, y)
+        tick_updates = {}
+        for entity_id, old, new in updated:
+            self.grid.place(entity_id, new[0], new[1])
+            tick_updates[entity_id] = (old, new, protocol.encode_update(entity_id, old, new))
+        for entity_id in removed:
+            self.grid.remove(entity_id)
+
+        # players that took a trapdoor belong to another floor now, tell shard.py's front where they went
+        for player, floor in self.world.handoffs:
+            client = self.players.pop(player.id, None)
+            if client:
+                client.player = None
+                client.send(net.frame(protocol.HANDOFF.pack(protocol.MSG_HANDOFF, floor, player.health.currenthp)))
+        self.world.handoffs.clear()
+
+        # then every client gets what's changed near it
+        lookup = self.tracker.sent.get
+        for client in list(self.clients):
+            if client.player is None:
+                continue
+            client.interest.focus(client.player.x, client.player.y)
+            if client.needs_snapshot:
+                client.needs_snapshot = False
+                client.send(net.frame(protocol.encode_snapshot(tick, client.interest.snapshot(lookup), ms, client.ack)))
+            else:
+                spawned, parts, removed = client.interest.delta(lookup, tick_updates)
+                client.send(net.frame(protocol.encode_delta_parts(tick, spawned, parts, removed, ms, client.ack)))
+
+    async def run(self, ticks=None):
+        loop = asyncio.get_event_loop()
+        period = 1.0 / self.tick_rate
+        next_tick = loop.time()
+        while ticks is None or self.world.tick < ticks:
+            # always sleep, even for 0, so the clients get a look in when ticks run long
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            start = loop.time()
+            self.tick_late.append(start - next_tick)
+            self.tick()
+            self.tick_times.append(loop.time() - start)
+            # if we fall way behind don't try to catch up with a burst of ticks
+            next_tick = max(next_tick + period, start)
+            if self.world.tick % config.STATS_EVERY == 0:
+                print(self.stats_line())
+
+    def stats(self):
+        return {'tick': self.world.tick, 'clients': len(self.clients),
+                'tick ms': percentiles(self.tick_times), 'late ms': percentiles(self.tick_late),
+                'dropped frames': self.dropped_gone + sum(client.dropped for client in self.clients),
+                'dropped moves': self.dropped_moves_gone + sum(client.dropped_moves for client in self.clients),
+                'cpu s': time.process_time()}
+
+    def stats_line(self):
+        stats = self.stats()
+        return "tick %d, %d clients, tick ms p50 %.2f p99 %.2f max %.2f, late ms p99 %.2f" % (
+            stats['tick'], stats['clients'], stats['tick ms'][50], stats['tick ms'][99], stats['tick ms'][100],
+            stats['late ms'][99])
+
+
+# p50/p95/p99/max of a list of seconds, in milliseconds
+def percentiles(values, points=(50, 95, 99, 100)):
+    ordered = sorted(values)
+    if not ordered:
+        return {point: 0.0 for point in points}
+    return {point: ordered[min(len(ordered) - 1, len(ordered) * point // 100)] * 1000.0 for point in points}
+
+
+async def serve(host, port, tick_rate, ticks=None, floor=0, floors=1):
+    game_world = world.world(config.MAP_SIZE[0], config.MAP_SIZE[1], crabs=config.CRABS, floor=floor, floors=floors)
+    server = game_server(game_world, host, port, tick_rate)
+    await server.start()
+    print("floor", floor, "serving on", server.host, server.port)
+    await server.run(ticks)
 
-#
 
 if __name__ == '__main__':
-    pass
+    parser = argparse.ArgumentParser(description="Experimental Dungeons game server")
+    parser.add_argument('--host', default=config.HOST)
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--tick-rate', type=int, default=config.TICK_RATE)
+    parser.add_argument('--ticks', type=int, default=None, help="stop after this many ticks")
+    args = parser.parse_args()
+    net.run(serve(args.host, args.port, args.tick_rate, args.ticks))
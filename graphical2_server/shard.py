@@ -0,0 +1,152 @@
+import asyncio
+import argparse
+import multiprocessing
+from graphical2_server import config
+from graphical2_server import net
+from graphical2_server import protocol
+from graphical2_server import server2
+
+
+# Runs the dungeon as one process per floor, so a busy floor only eats its own core.
+#   python -m graphical2_server.shard --floors 4
+#
+# Each floor is a normal server2 game server in its own worker process, listening on loopback at port + 1 + floor.
+# Clients connect to the front process on the normal port.  The front doesn't simulate anything, it just relays
+# frames between each client and the worker for the floor the client's player is on.
+#
+# When a player takes a trapdoor, its worker drops the player from its world and sends the front a MSG_HANDOFF with
+# the floor and hp.  The front hangs up on that worker, connects to the next floor's worker and sends a MSG_JOIN with
+# the hp.  The new worker says welcome and sends a snapshot like for any new player, so the client just starts over
+# on the new floor.  The player is only ever in one world at a time.
+
+
+def worker_port(port, floor):
+    return port + 1 + floor
+
+
+def run_worker(port, tick_rate, floor, floors):
+    net.run(server2.serve('127.0.0.1', worker_port(port, floor), tick_rate, floor=floor, floors=floors))
+
+
+class routed_client:
+    def __init__(self, front, reader, writer):
+        self.front = front
+        self.reader = reader
+        self.writer = writer
+        self.floor = None
+        self.worker_reader = None
+        self.worker_writer = None
+
+    async def connect(self, floor, hp=None):
+        # no worker while the new one is being reached, so client_to_worker drops what the client sends meanwhile
+        # instead of writing it to the old floor's closed connection
+        if self.worker_writer:
+            self.worker_writer.close()
+            self.worker_writer = None
+        reader, writer = await asyncio.open_connection('127.0.0.1', worker_port(self.front.port, floor))
+        self.worker_reader, self.worker_writer = reader, writer
+        self.floor = floor
+        if hp is not None:
+            self.worker_writer.write(net.frame(protocol.JOIN.pack(protocol.MSG_JOIN, hp)))
+
+    async def run(self):
+        await self.connect(0)
+        upstream = asyncio.ensure_future(self.client_to_worker())
+        try:
+            await self.worker_to_client()
+        except net.BROKEN:
+            pass
+        finally:
+            upstream.cancel()
+            if self.worker_writer:
+                self.worker_writer.close()
+            self.writer.close()
+
+    async def worker_to_client(self):
+        while True:
+            payload = await net.read_frame(self.worker_reader, 1 << 24)
+            if payload[0] == protocol.MSG_HANDOFF:
+                msg, floor, hp = protocol.HANDOFF.unpack(payload)
+                self.front.handoffs += 1
+                await self.connect(min(floor, self.front.floors - 1), hp)
+                continue
+            self.writer.write(net.frame(payload))
+            # if the client can't keep up, stop reading from the worker so the worker's own backpressure kicks in
+            await self.writer.drain()
+
+    async def client_to_worker(self):
+        try:
+            while True:
+                payload = await net.read_frame(self.reader, config.MAX_FRAME)
+                # anything sent while we're switching floors goes to the new floor (or nowhere if it's not up yet)
+                if self.worker_writer:
+                    self.worker_writer.write(net.frame(payload))
+        except net.BROKEN:
+            # client went away, hanging up on the worker ends the other direction too
+            if self.worker_writer:
+                self.worker_writer.close()
+
+
+class front:
+    def __init__(self, host, port, floors):
+        self.host = host
+        self.port = port
+        self.floors = floors
+        self.clients = 0
+        self.handoffs = 0
+
+    async def handle_client(self, reader, writer):
+        self.clients += 1
+        try:
+            await routed_client(self, reader, writer).run()
+        except OSError as error:
+            print("couldn't reach a floor:", error)
+            writer.close()
+        finally:
+            self.clients -= 1
+
+    async def wait_for_workers(self):
+        for floor in range(self.floors):
+            while True:
+                try:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', worker_port(self.port, floor))
+                    writer.close()
+                    break
+                except OSError:
+                    await asyncio.sleep(0.1)
+
+    async def run(self):
+        await self.wait_for_workers()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, backlog=1024)
+        print("front serving on", self.host, self.port, "for", self.floors, "floors")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                print("front:", self.clients, "clients,", self.handoffs, "trapdoor handoffs so far")
+        finally:
+            server.close()
+            await server.wait_closed()
+
+
+def start_workers(port, tick_rate, floors):
+    workers = []
+    for floor in range(floors):
+        worker = multiprocessing.Process(target=run_worker, args=(port, tick_rate, floor, floors), daemon=True)
+        worker.start()
+        workers.append(worker)
+    return workers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Experimental Dungeons sharded server, one process per floor")
+    parser.add_argument('--host', default=config.HOST)
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--tick-rate', type=int, default=config.TICK_RATE)
+    parser.add_argument('--floors', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+    workers = start_workers(args.port, args.tick_rate, args.floors)
+    try:
+        net.run(front(args.host, args.port, args.floors).run())
+    finally:
+        for worker in workers:
+            worker.terminate()
@@ -0,0 +1,133 @@
+import random
+from graphical2 import tilemap
+from graphical2_server.objects import actor, com_health
+
+# The server's copy of the game.  No pygame in here, it just pushes numbers around: a room in tile layers (same
+# layout as graphical2's map1gen) and a dict of actors that clients see.
+
+T_FLOOR = 1
+T_WALL = 2
+T_TRAPDOOR = 3
+
+# what kind of thing an actor is, sent to clients so they know what to draw
+KIND_PLAYER = 0
+KIND_CRAB = 1
+KINDS = {"player": KIND_PLAYER, "crab": KIND_CRAB}
+
+PLAYER_HP = 20
+CRAB_HP = 5
+# how long a dead crab lies around before it's cleared away and a new one turns up
+CORPSE_TICKS = 30
+# trapdoors down to the next floor, on every floor but the last
+TRAPDOORS = 4
+
+
+class world:
+    def __init__(self, width, height, crabs=0, folder=None, seed=None, floor=0, floors=1):
+        self.random = random.Random(seed)
+        self.tick = 0
+        self.floor = floor
+        self.tiles = tilemap.new_layers(width, height, folder)
+        self.tiles.fill_rect(0, 0, width, height, T_WALL, False)
+        self.tiles.fill_rect(1, 1, width - 1, height - 1, T_FLOOR, True)
+        # players that took a trapdoor this tick, as (player, floor they're going to).  they're already gone from
+        # this world, the server has to pass them on.
+        self.handoffs = []
+        # id -> actor, and (x, y) -> actor for the ones that are standing up
+        self.actors = {}
+        self.blocking = {}
+        # (tick it died, actor)
+        self.corpses = []
+        # ids of actors that showed up, moved, got hurt, died or went away since the server last looked
+        self.changed = set()
+        if floor < floors - 1:
+            for i in range(TRAPDOORS):
+                x, y = self.free_cell()
+                self.tiles.terrain[x, y] = T_TRAPDOOR
+        for i in range(crabs):
+            self.spawn("crab", CRAB_HP, ai_persona="random")
+
+    def free_cell(self):
+        while True:
+            x = self.random.randrange(self.tiles.width)
+            y = self.random.randrange(self.tiles.height)
+            if self.tiles.terrain[x, y] == T_FLOOR and (x, y) not in self.blocking:
+                return x, y
+
+    def spawn(self, objtype, hp, ai_persona="none", attack=0):
+        x, y = self.free_cell()
+        act = actor(x, y, objtype, health=com_health(hp), ai_persona=ai_persona, attack=attack)
+        self.actors[act.id] = act
+        self.blocking[(x, y)] = act
+        self.changed.add(act.id)
+        return act
+
+    def add_player(self):
+        return self.spawn("player", PLAYER_HP, attack=1)
+
+    def remove(self, actor_id):
+        act = self.actors.pop(actor_id, None)
+        self.changed.add(actor_id)
+        if act and self.blocking.get((act.x, act.y)) is act:
+            del self.blocking[(act.x, act.y)]
+
+    def queue_move(self, actor_id, dx, dy):
+        act = self.actors.get(actor_id)
+        if act:
+            # one step at a time, and no diagonals
+            act.dx = max(-1, min(1, dx))
+            act.dy = 0 if act.dx else max(-1, min(1, dy))
+
+    def step(self):
+        self.tick += 1
+        while self.corpses and self.tick - self.corpses[0][0] >= CORPSE_TICKS:
+            died, corpse = self.corpses.pop(0)
+            self.remove(corpse.id)
+            self.spawn(corpse.type, corpse.health.maxhp, ai_persona="random", attack=corpse.attack)
+        for act in self.actors.values():
+            if act.ai_persona == "random" and not act.health.dead:
+                if self.random.randint(0, 2):
+                    act.dx = self.random.randint(-1, 1)
+                else:
+                    act.dy = self.random.randint(-1, 1)
+        for act in list(self.actors.values()):
+            if act.dx or act.dy:
+                self.move(act)
+                act.dx, act.dy = 0, 0
+
+    def move(self, act):
+        if act.health.dead:
+            return
+        x, y = act.x + act.dx, act.y + act.dy
+        if not self.tiles.is_passable(x, y):
+            return
+        other = self.blocking.get((x, y))
+        if other is None:
+            del self.blocking[(act.x, act.y)]
+            act.x, act.y = x, y
+            self.blocking[(x, y)] = act
+            self.changed.add(act.id)
+            if act.type == "player" and self.tiles.terrain[x, y] == T_TRAPDOOR:
+                self.remove(act.id)
+                self.handoffs.append((act, self.floor + 1))
+        elif act.attack:
+            self.hit(other, act.attack)
+
+    def hit(self, target, damage):
+        target.health.currenthp -= damage
+        self.changed.add(target.id)
+        if target.health.currenthp <= 0:
+            self.kill(target)
+
+    def kill(self, target):
+        if target.type == "player":
+            # players just start over somewhere else
+            del self.blocking[(target.x, target.y)]
+            target.x, target.y = self.free_cell()
+            target.health.currenthp = target.health.maxhp
+            self.blocking[(target.x, target.y)] = target
+        else:
+            target.health.dead = True
+            target.ai_persona = "none"
+            del self.blocking[(target.x, target.y)]
+            self.corpses.append((self.tick, target))
@@ -2,6 +2,8 @@
 
 # controls an object's health
 class health:
+    __slots__ = ('owner', 'hp', 'dead', 'maxhp')
+
     def __init__(self, hp, maxhp=None):
         self.owner = None
         self.hp = hp
@@ -14,6 +16,8 @@ class health:
 
 # controls drawing and stuff
 class sprite:
+    __slots__ = ('img', 'spriteoffsetx', 'spriteoffsety', 'layering', 'owner')
+
     def __init__(self, img, spriteoffsetx=0, spriteoffsety=0, layering=0):
         self.img = img
         self.spriteoffsetx = spriteoffsetx
@@ -29,23 +33,31 @@ class sprite:
 
 # things have inventories
 class inventory:
+    __slots__ = ('owner',)
+
     def __init__(self):
         self.owner = None
 
 
 # some objects can be picked up and used as weapons.
 class item:
+    __slots__ = ('owner',)
+
     def __init__(self):
         self.owner = None
 
 
 class attack:
+    __slots__ = ('owner', 'attackdamage')
+
     def __init__(self, attackdamage):
         self.owner = None
         self.attackdamage = attackdamage
 
 
 class special:
+    __slots__ = ('owner', 'data')
+
     def __init__(self, special_data):
         self.owner = None
-        self.data = special_data
\ No newline at end of file
+        self.data = special_data
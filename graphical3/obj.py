@@ -1,4 +1,12 @@
+import weakref
+
+
+# __slots__ and a weak owner proxy, same as graphical2/objects.py: no __dict__ per entity and no reference cycles
+# between an entity and its components.
 class entity:
+    __slots__ = ('x', 'y', 'dx', 'dy', 'type', 'blockpath', 'ai_persona', 'sprite', 'health', 'attack', 'inventory',
+                 'ondeath', 'special', '__weakref__')
+
     def __init__(self, x, y, objtype, sprite, blockpath=False, health=None, inventory=None, ondeath=None, attack=None,
                  ai_persona="none", special=None):
         # moving and location
@@ -15,30 +23,31 @@ class entity:
         # Question: what the heck is up with that retarded "self.owner" stuff?
         # Answer: it's a workaround, python doesn't have a proper "parent" reference.  We need to get stuff from other
         # components, so that's the work around.
+        owner = weakref.proxy(self)
 
         # sprite and drawing
         self.sprite = sprite
         if self.sprite:
-            self.sprite.owner = self
+            self.sprite.owner = owner
 
         # health
         self.health = health
         if self.health:
-            self.health.owner = self
+            self.health.owner = owner
 
         self.attack = attack
         if self.attack:
-            self.attack.owner = self
+            self.attack.owner = owner
 
         # inventory
         self.inventory = inventory
         if self.inventory:
-            self.inventory.owner = self
+            self.inventory.owner = owner
 
         self.ondeath = ondeath
         if self.ondeath:
-            self.ondeath.owner = self
+            self.ondeath.owner = owner
 
         self.special = special
-        if self.ondeath:
-            self.ondeath.owner = self
\ No newline at end of file
+        if self.special:
+            self.special.owner = owner
@@ -2,4 +2,5 @@ window_width = 600
 window_height = 400
 
 field_width = 20
-field_height = 10
\ No newline at end of file
+field_height = 10
+mine_count = 30
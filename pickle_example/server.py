@@ -1,5 +1,226 @@
+import itertools
+import struct
+import numpy
+import pickle_example.config as config
+
+# Minefield engine.  Everything is numpy arrays indexed [x, y]:
+#   mines    - True where there's a mine
+#   counts   - how many of the 8 neighbours are mines
+#   revealed - cells the player has opened
+#   flagged  - cells the player has flagged
+#   regions  - which zero region each zero cell (no mine, no mines around) is in, see label_zero_regions
+# Big fields (10,000 x 10,000) work, and every game is just its own few arrays so one server can run lots of them.
+
+# fields bigger than this get their mines by density instead of an exact count (an exact pick needs a list of every
+# cell, which gets silly at 100 million cells)
+EXACT_MINES_LIMIT = 10 ** 7
+
+# the 8 neighbours
+AROUND = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+PACK_HEADER = struct.Struct('!IIB')
+
+
+class minefield:
+    def __init__(self, mines):
+        self.mines = mines
+        self.width, self.height = mines.shape
+        self.counts = count_neighbours(mines)
+        self.regions, self.region_boxes = label_zero_regions(~mines & (self.counts == 0))
+        self.revealed = numpy.zeros(mines.shape, dtype=numpy.bool_)
+        self.flagged = numpy.zeros(mines.shape, dtype=numpy.bool_)
+        self.lost = False
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def flag(self, x, y):
+        if self.in_bounds(x, y) and not self.revealed[x, y]:
+            self.flagged[x, y] = not self.flagged[x, y]
+
+    def reveal(self, x, y):
+        # opens a cell.  returns how many cells got opened, or -1 if it was a mine.
+        if not self.in_bounds(x, y) or self.revealed[x, y] or self.flagged[x, y]:
+            return 0
+        if self.mines[x, y]:
+            self.lost = True
+            self.revealed[x, y] = True
+            return -1
+        if self.counts[x, y]:
+            self.revealed[x, y] = True
+            return 1
+        return self.open_region(self.regions[x, y])
+
+    def open_region(self, label):
+        # opens a whole zero region and the numbered cells around its edge in one go (neighbours of a zero are never
+        # mines).  only the region's bounding box gets looked at.  flagged cells stay closed, but unlike a flood fill
+        # they don't stop the rest of the region opening.
+        x0, y0, x1, y1 = self.region_boxes[:, label]
+        x0, y0, x1, y1 = max(0, x0 - 1), max(0, y0 - 1), min(self.width, x1 + 2), min(self.height, y1 + 2)
+        region = self.regions[x0:x1, y0:y1] == label
+        # grow it by a cell in all 8 directions: along x, then that along y
+        grown = region.copy()
+        grown[1:] |= region[:-1]
+        grown[:-1] |= region[1:]
+        wide = grown.copy()
+        grown[:, 1:] |= wide[:, :-1]
+        grown[:, :-1] |= wide[:, 1:]
+        opening = grown & ~self.revealed[x0:x1, y0:y1] & ~self.flagged[x0:x1, y0:y1]
+        self.revealed[x0:x1, y0:y1] |= opening
+        return int(numpy.count_nonzero(opening))
+
+    def won(self):
+        return not self.lost and numpy.count_nonzero(self.revealed) == self.mines.size - numpy.count_nonzero(self.mines)
+
+    def pack(self):
+        # what a client gets to see, squashed for sending:
+        #   header (width, height, lost), revealed as bits, flagged as bits, then the counts of the revealed cells
+        #   (in order) two to a byte.  if the game is lost the mines go on the end as bits too.
+        revealed = self.revealed.ravel()
+        counts = self.counts.ravel()[revealed]
+        if len(counts) % 2:
+            counts = numpy.append(counts, numpy.uint8(0))
+        nibbles = (counts[0::2] << 4) | counts[1::2]
+        parts = [PACK_HEADER.pack(self.width, self.height, self.lost), numpy.packbits(revealed).tobytes(),
+                 numpy.packbits(self.flagged.ravel()).tobytes(), nibbles.astype(numpy.uint8).tobytes()]
+        if self.lost:
+            parts.append(numpy.packbits(self.mines.ravel()).tobytes())
+        return b''.join(parts)
+
+
+# opposite of minefield.pack, for the client.  returns (revealed, flagged, counts, mines or None), counts is 0 for
+# anything that isn't revealed.
+def unpack(data):
+    width, height, lost = PACK_HEADER.unpack_from(data)
+    cells = width * height
+    bits = (cells + 7) // 8
+    offset = PACK_HEADER.size
+    revealed = numpy.unpackbits(numpy.frombuffer(data, numpy.uint8, bits, offset), count=cells).astype(numpy.bool_)
+    offset += bits
+    flagged = numpy.unpackbits(numpy.frombuffer(data, numpy.uint8, bits, offset), count=cells).astype(numpy.bool_)
+    offset += bits
+    shown = int(numpy.count_nonzero(revealed))
+    nibble_bytes = (shown + 1) // 2
+    nibbles = numpy.frombuffer(data, numpy.uint8, nibble_bytes, offset)
+    offset += nibble_bytes
+    counts = numpy.zeros(cells, dtype=numpy.uint8)
+    counts[revealed] = numpy.stack((nibbles >> 4, nibbles & 0xf), axis=1).ravel()[:shown]
+    mines = None
+    if lost:
+        mines = numpy.unpackbits(numpy.frombuffer(data, numpy.uint8, bits, offset), count=cells).astype(numpy.bool_)
+        mines = mines.reshape(width, height)
+    return revealed.reshape(width, height), flagged.reshape(width, height), counts.reshape(width, height), mines
+
+
+# the neighbour count is a 3x3 convolution, done as the sum of the 8 shifted copies of the padded mine map
+def count_neighbours(mines):
+    width, height = mines.shape
+    padded = numpy.pad(mines.view(numpy.uint8), 1)
+    counts = numpy.zeros(mines.shape, dtype=numpy.uint8)
+    for dx, dy in AROUND:
+        counts += padded[1 + dx:1 + dx + width, 1 + dy:1 + dy + height]
+    return counts
+
+
+# every zero cell gets the label of the region it's in, zero cells touching (8 ways) being one region, so opening a
+# zero is one masked step instead of a flood fill.  gives back (labels, boxes): labels[x, y] is 0 for cells that
+# aren't zeros, boxes[:, label] is the region's x0, y0, x1, y1 (x1, y1 included).
+def label_zero_regions(zero):
+    width, height = zero.shape
+    # runs of zeros down each column first, numbered in order (1 and up), there are a lot fewer of those than cells
+    starts = zero.copy()
+    starts[:, 1:] &= ~zero[:, :-1]
+    labels = numpy.cumsum(starts, axis=None, dtype=numpy.int32).reshape(width, height)
+    labels[~zero] = 0
+    first = numpy.flatnonzero(starts)
+    del starts
+    last = numpy.flatnonzero(zero & ~numpy.pad(zero[:, 1:], ((0, 0), (0, 1))))
+    runs = len(first)
+    run_x, run_y0, run_y1 = first // height, first % height, last % height
+
+    # run r touches the runs in the next column that overlap its y0 - 1 .. y1 + 1.  runs are in (x, y) order, so
+    # with x and y squashed into one sorted key searchsorted finds that span for every run at once
+    stride = height + 2
+    key_y0, key_y1 = run_x * stride + run_y0, run_x * stride + run_y1
+    lo = numpy.searchsorted(key_y1, (run_x + 1) * stride + run_y0 - 1)
+    hi = numpy.searchsorted(key_y0, (run_x + 1) * stride + run_y1 + 1, side='right')
+    touching = numpy.maximum(hi - lo, 0)
+    offsets = numpy.arange(touching.sum()) - numpy.repeat(numpy.cumsum(touching) - touching, touching)
+    a = numpy.repeat(numpy.arange(1, runs + 1, dtype=numpy.int32), touching)
+    b = (numpy.repeat(lo, touching) + offsets + 1).astype(numpy.int32)
+
+    # union find on the runs, all the pairs at once: each round hooks every root onto the smallest root it touches
+    # and then squashes the trees flat, and pairs that are already in one region get dropped.  a few rounds does it.
+    parent = numpy.arange(runs + 1, dtype=numpy.int32)
+    while len(a):
+        root_a, root_b = parent[a], parent[b]
+        apart = root_a != root_b
+        a, b, root_a, root_b = a[apart], b[apart], root_a[apart], root_b[apart]
+        parent[numpy.maximum(root_a, root_b)] = numpy.minimum(root_a, root_b)
+        while True:
+            grand = parent[parent]
+            if (grand == parent).all():
+                break
+            parent = grand
+    labels = parent[labels]
+
+    # bounding box of each region, from the runs in it
+    roots = parent[1:]
+    boxes = numpy.zeros((4, runs + 1), dtype=numpy.int64)
+    boxes[0:2] = max(width, height)
+    numpy.minimum.at(boxes[0], roots, run_x)
+    numpy.minimum.at(boxes[1], roots, run_y0)
+    numpy.maximum.at(boxes[2], roots, run_x)
+    numpy.maximum.at(boxes[3], roots, run_y1)
+    return labels, boxes
 
 
 #generate mines
-def make_minefield():
-    pass
\ No newline at end of file
+def make_minefield(width=config.field_width, height=config.field_height, mines=config.mine_count, safe=None,
+                   seed=None):
+    # safe is an (x, y) that won't have a mine on or next to it, so the first click always opens something up.  those
+    # cells are left out before the mines are placed, so there are still `mines` of them.
+    rng = numpy.random.default_rng(seed)
+    cells = width * height
+    excluded = numpy.zeros(0, dtype=numpy.int64)
+    if safe:
+        sx, sy = safe
+        xs, ys = numpy.meshgrid(numpy.arange(max(0, sx - 1), min(width, sx + 2)),
+                                numpy.arange(max(0, sy - 1), min(height, sy + 2)), indexing='ij')
+        excluded = (xs * height + ys).ravel()
+    allowed = cells - len(excluded)
+    if cells <= EXACT_MINES_LIMIT:
+        # pick from the allowed cells only: number them 0..allowed-1 and step each pick past the excluded cells
+        # before it
+        picks = rng.choice(allowed, size=min(mines, allowed), replace=False)
+        picks += numpy.searchsorted(excluded - numpy.arange(len(excluded)), picks, side='right')
+        field = numpy.zeros(cells, dtype=numpy.bool_)
+        field[picks] = True
+        field = field.reshape(width, height)
+    else:
+        # a column at a time so we never hold more than one column of random floats
+        field = numpy.empty((width, height), dtype=numpy.bool_)
+        density = mines / float(max(1, allowed))
+        for x in range(0, width, 1024):
+            field[x:x + 1024] = rng.random((min(1024, width - x), height), dtype=numpy.float32) < density
+        field.ravel()[excluded] = False
+    return minefield(field)
+
+
+###########################
+####       GAMES       ####
+###########################
+
+# every game this server is running, by id
+GAMES = {}
+_GAME_IDS = itertools.count(1)
+
+
+def new_game(width=config.field_width, height=config.field_height, mines=config.mine_count, safe=None, seed=None):
+    game_id = next(_GAME_IDS)
+    GAMES[game_id] = make_minefield(width, height, mines, safe, seed)
+    return game_id
+
+
+def end_game(game_id):
+    GAMES.pop(game_id, None)